@@ -0,0 +1,36 @@
+"""add model catalog
+
+Revision ID: 3f2a9c1d7b4e
+Revises:
+Create Date: 2026-10-16 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f2a9c1d7b4e'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'model_catalog_directories',
+        sa.Column('root', sa.Text(), nullable=False),
+        sa.Column('path', sa.Text(), nullable=False),
+        sa.Column('mtime', sa.Float(), nullable=False),
+        sa.Column('files', sa.Text(), nullable=False),
+        sa.Column('subdirs', sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint('root', 'path'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('model_catalog_directories')
@@ -0,0 +1,42 @@
+"""add history
+
+Revision ID: 8c41d2e6f0a7
+Revises: 3f2a9c1d7b4e
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c41d2e6f0a7'
+down_revision: Union[str, None] = '3f2a9c1d7b4e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'history',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('prompt_id', sa.Text(), nullable=False),
+        sa.Column('client_id', sa.Text(), nullable=True),
+        sa.Column('completed_at', sa.Integer(), nullable=False),
+        sa.Column('status', sa.Text(), nullable=True),
+        sa.Column('data', sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('prompt_id'),
+    )
+    op.create_index('ix_history_client_id', 'history', ['client_id'])
+    op.create_index('ix_history_completed_at', 'history', ['completed_at'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_history_completed_at', table_name='history')
+    op.drop_index('ix_history_client_id', table_name='history')
+    op.drop_table('history')
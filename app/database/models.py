@@ -1,3 +1,4 @@
+from sqlalchemy import Column, Float, Integer, Text
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -11,4 +12,26 @@ def to_dict(obj):
         if (val := getattr(obj, field))
     }
 
-# TODO: Define models here
+
+class ModelCatalogDirectory(Base):
+    """A directory of a model folder indexed by app.model_catalog, files and subdirs are JSON lists of names."""
+    __tablename__ = "model_catalog_directories"
+
+    root = Column(Text, primary_key=True)
+    path = Column(Text, primary_key=True)
+    mtime = Column(Float, nullable=False)
+    files = Column(Text, nullable=False)
+    subdirs = Column(Text, nullable=False)
+
+
+class HistoryEntry(Base):
+    """A finished prompt of the queue history, data is the JSON of its /history entry."""
+    __tablename__ = "history"
+
+    # Completion order, the cursor of the history pages.
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    prompt_id = Column(Text, nullable=False, unique=True)
+    client_id = Column(Text, nullable=True, index=True)
+    completed_at = Column(Integer, nullable=False, index=True)
+    status = Column(Text, nullable=True)
+    data = Column(Text, nullable=False)
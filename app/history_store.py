@@ -0,0 +1,242 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from app.database.db import can_create_session
+
+# Number of the latest history entries kept in memory when the history is persisted in the database.
+HISTORY_CACHE_SIZE = 1000
+
+
+class CachedEntry:
+    __slots__ = ("seq", "client_id", "completed_at", "entry")
+
+    def __init__(self, seq: int, client_id: str | None, completed_at: int, entry: dict):
+        self.seq = seq
+        self.client_id = client_id
+        self.completed_at = completed_at
+        self.entry = entry
+
+
+def entry_client_id(entry: dict) -> str | None:
+    prompt = entry.get("prompt", None)
+    if prompt is None or len(prompt) < 4:
+        return None
+    return prompt[3].get("client_id", None)
+
+
+class HistoryStore:
+    """
+    The history of a PromptQueue. Every entry is written to the database (when available) so the
+    history survives restarts and isn't capped, only the latest cache_size entries stay in memory.
+    Without a database the history is the latest max_size entries in memory like it used to be.
+    A page has at most max_size entries either way.
+
+    Entries are numbered in the order they complete and pages are read by that number from a cursor
+    (the prompt_id before or after which the page starts), so reading a page costs the same at any
+    depth. Returned entries are shared with the store and must not be modified.
+    """
+    def __init__(self, max_size: int, cache_size=HISTORY_CACHE_SIZE):
+        self.max_size = max_size
+        self.cache_size = cache_size
+        # prompt_id -> CachedEntry, in completion order.
+        self.entries: OrderedDict[str, CachedEntry] = OrderedDict()
+        self.next_seq = 0
+        # Every entry numbered from cached_from up is in entries.
+        self.cached_from = 0
+        self.checked = False
+        self.persisted = False
+        self.lock = threading.RLock()
+
+    def _check_database(self):
+        if self.checked or not can_create_session():
+            return
+        self.checked = True
+        try:
+            from sqlalchemy import func
+            from app.database.db import create_session
+            from app.database.models import HistoryEntry
+            with create_session() as session:
+                last = session.query(func.max(HistoryEntry.id)).scalar()
+        except Exception as e:
+            logging.warning(f"Unable to load the history from the database: {e}")
+            return
+        self.persisted = True
+        # Prompts that finished before the database was initialized are written out after the stored ones.
+        entries = list(self.entries.items())
+        self.entries.clear()
+        self.next_seq = self.cached_from = 0 if last is None else last + 1
+        for prompt_id, cached in entries:
+            self._add(prompt_id, cached.entry, cached.completed_at)
+
+    def _add(self, prompt_id: str, entry: dict, completed_at: int):
+        self.entries.pop(prompt_id, None)
+        cached = CachedEntry(self.next_seq, entry_client_id(entry), completed_at, entry)
+        self.next_seq += 1
+        self.entries[prompt_id] = cached
+        if self.persisted:
+            try:
+                from app.database.db import create_session
+                from app.database.models import HistoryEntry
+                status = entry.get("status", None) or {}
+                with create_session() as session:
+                    # A prompt_id that ran again moves to the end of the history.
+                    session.query(HistoryEntry).filter_by(prompt_id=prompt_id).delete()
+                    session.add(HistoryEntry(id=cached.seq, prompt_id=prompt_id, client_id=cached.client_id, completed_at=completed_at,
+                                             status=status.get("status_str", None), data=json.dumps(entry)))
+                    session.commit()
+            except Exception as e:
+                logging.warning(f"Unable to save the history of prompt {prompt_id} to the database: {e}")
+        max_size = self.cache_size if self.persisted else self.max_size
+        while len(self.entries) > max_size:
+            _, evicted = self.entries.popitem(last=False)
+            self.cached_from = evicted.seq + 1
+
+    def _delete(self, prompt_id: str):
+        self.entries.pop(prompt_id, None)
+        if self.persisted:
+            try:
+                from app.database.db import create_session
+                from app.database.models import HistoryEntry
+                with create_session() as session:
+                    session.query(HistoryEntry).filter_by(prompt_id=prompt_id).delete()
+                    session.commit()
+            except Exception as e:
+                logging.warning(f"Unable to delete the history of prompt {prompt_id} from the database: {e}")
+
+    def add(self, prompt_id: str, entry: dict):
+        with self.lock:
+            self._check_database()
+            self._add(prompt_id, entry, int(time.time() * 1000))
+
+    def delete(self, prompt_id: str):
+        with self.lock:
+            self._check_database()
+            self._delete(prompt_id)
+
+    def clear(self):
+        with self.lock:
+            self._check_database()
+            self.entries.clear()
+            self.cached_from = self.next_seq
+            if self.persisted:
+                try:
+                    from app.database.db import create_session
+                    from app.database.models import HistoryEntry
+                    with create_session() as session:
+                        session.query(HistoryEntry).delete()
+                        session.commit()
+                except Exception as e:
+                    logging.warning(f"Unable to clear the history in the database: {e}")
+
+    def get(self, prompt_id: str) -> dict | None:
+        with self.lock:
+            self._check_database()
+            cached = self.entries.get(prompt_id, None)
+            if cached is not None:
+                return cached.entry
+            if not self.persisted:
+                return None
+            try:
+                from app.database.db import create_session
+                from app.database.models import HistoryEntry
+                with create_session() as session:
+                    row = session.query(HistoryEntry).filter_by(prompt_id=prompt_id).one_or_none()
+                    return None if row is None else json.loads(row.data)
+            except Exception as e:
+                logging.warning(f"Unable to read the history of prompt {prompt_id} from the database: {e}")
+                return None
+
+    def _seq(self, prompt_id: str) -> int | None:
+        cached = self.entries.get(prompt_id, None)
+        if cached is not None:
+            return cached.seq
+        if not self.persisted:
+            return None
+        from app.database.db import create_session
+        from app.database.models import HistoryEntry
+        with create_session() as session:
+            row = session.query(HistoryEntry).filter_by(prompt_id=prompt_id).one_or_none()
+            return None if row is None else row.id
+
+    def page(self, max_items: int | None = None, offset=-1, before: str | None = None, after: str | None = None,
+             client_id: str | None = None, since: int | None = None) -> list[tuple[str, dict]]:
+        """
+        The (prompt_id, entry) of a page of the history, oldest first. Without a cursor it is the page
+        at offset from the oldest entry, or the latest max_items entries for a negative offset. With
+        before, the max_items entries that completed right before that prompt, with after the ones
+        right after it. client_id and since (a completion time in ms) only keep the matching entries.
+        Without max_items (or above max_size) the page has max_size entries, the database isn't read whole.
+        """
+        max_items = self.max_size if max_items is None else min(max_items, self.max_size)
+        with self.lock:
+            self._check_database()
+            try:
+                before_seq = self._seq(before) if before is not None else None
+                after_seq = self._seq(after) if after is not None else None
+                if (before is not None and before_seq is None) or (after is not None and after_seq is None):
+                    return []
+                out = self._page_from_cache(max_items, offset, before_seq, after_seq, client_id, since)
+                if out is None:
+                    out = self._page_from_database(max_items, offset, before_seq, after_seq, client_id, since)
+                return out
+            except Exception as e:
+                logging.warning(f"Unable to read the history from the database: {e}")
+                return []
+
+    def _page_from_cache(self, max_items, offset, before_seq, after_seq, client_id, since):
+        """The page when it only has entries that are in memory, else None."""
+        def matches(cached):
+            return ((before_seq is None or cached.seq < before_seq) and (after_seq is None or cached.seq > after_seq)
+                    and (client_id is None or cached.client_id == client_id) and (since is None or cached.completed_at >= since))
+
+        if not self.persisted:
+            matching = [(prompt_id, cached.entry) for prompt_id, cached in self.entries.items() if matches(cached)]
+            if after_seq is not None:
+                return matching[:max_items]
+            if before_seq is not None or offset < 0:
+                return matching if max_items is None else matching[max(len(matching) - max_items, 0):]
+            return matching[offset:] if max_items is None else matching[offset:offset + max_items]
+
+        if after_seq is not None and before_seq is None and after_seq + 1 >= self.cached_from:
+            return [(prompt_id, cached.entry) for prompt_id, cached in self.entries.items() if matches(cached)][:max_items]
+        if (before_seq is not None or offset < 0) and after_seq is None and max_items is not None:
+            out = []
+            for prompt_id in reversed(self.entries):
+                if len(out) >= max_items:
+                    break
+                cached = self.entries[prompt_id]
+                if matches(cached):
+                    out.append((prompt_id, cached.entry))
+            if len(out) >= max_items:
+                return out[::-1]
+        return None
+
+    def _page_from_database(self, max_items, offset, before_seq, after_seq, client_id, since):
+        from app.database.db import create_session
+        from app.database.models import HistoryEntry
+        with create_session() as session:
+            query = session.query(HistoryEntry)
+            if before_seq is not None:
+                query = query.filter(HistoryEntry.id < before_seq)
+            if after_seq is not None:
+                query = query.filter(HistoryEntry.id > after_seq)
+            if client_id is not None:
+                query = query.filter(HistoryEntry.client_id == client_id)
+            if since is not None:
+                query = query.filter(HistoryEntry.completed_at >= since)
+            newest_first = after_seq is None and max_items is not None and (before_seq is not None or offset < 0)
+            if newest_first:
+                rows = query.order_by(HistoryEntry.id.desc()).limit(max_items).all()[::-1]
+            else:
+                query = query.order_by(HistoryEntry.id.asc())
+                if after_seq is None and offset > 0:
+                    query = query.offset(offset)
+                rows = query.limit(max_items).all()
+            out = []
+            for row in rows:
+                cached = self.entries.get(row.prompt_id, None)
+                out.append((row.prompt_id, cached.entry if cached is not None else json.loads(row.data)))
+            return out
@@ -0,0 +1,309 @@
+import json
+import logging
+import os
+import threading
+import time
+
+# Model folders are checked for changes (a stat of every indexed directory) at most this often.
+CATALOG_REFRESH_INTERVAL = 1.0
+
+
+class CatalogDirectory:
+    __slots__ = ("mtime", "files", "subdirs")
+
+    def __init__(self, mtime: float, files: list[str], subdirs: list[str]):
+        self.mtime = mtime
+        self.files = files
+        self.subdirs = subdirs
+
+
+class CatalogRoot:
+    def __init__(self, root: str, excluded_dir_names: frozenset[str]):
+        self.root = root
+        self.excluded_dir_names = excluded_dir_names
+        self.key = json.dumps([root, sorted(excluded_dir_names)])
+        self.directories: dict[str, CatalogDirectory] = {}
+        self.checked = None
+        self.loaded = False
+        self.result = None
+
+
+def scan_directory(path: str, excluded_dir_names: frozenset[str]) -> CatalogDirectory | None:
+    try:
+        mtime = os.path.getmtime(path)
+        files = []
+        subdirs = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    if entry.name not in excluded_dir_names:
+                        subdirs.append(entry.name)
+                else:
+                    files.append(entry.name)
+    except OSError:
+        logging.warning(f"Warning: Unable to access {path}. Skipping this path.")
+        return None
+    return CatalogDirectory(mtime, files, subdirs)
+
+
+def database_available() -> bool:
+    try:
+        from app.database.db import can_create_session
+        return can_create_session()
+    except Exception:
+        return False
+
+
+class ModelCatalog:
+    """
+    Index of the files in the model folders, replacing a full os.walk of every folder each time a
+    file list is needed. Directories are only listed again when their mtime changes and the index
+    is persisted in the database (when available) so a restart doesn't have to walk everything.
+    """
+    def __init__(self, refresh_interval=CATALOG_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.roots: dict[tuple[str, frozenset[str]], CatalogRoot] = {}
+        self.lock = threading.RLock()
+
+    def _get_root(self, directory: str, excluded_dir_names) -> CatalogRoot:
+        excluded = frozenset(excluded_dir_names or [])
+        state = self.roots.get((directory, excluded), None)
+        if state is None:
+            state = CatalogRoot(directory, excluded)
+            self.roots[(directory, excluded)] = state
+        if not state.loaded and database_available():
+            # Custom nodes list models before the database is initialized, those roots are
+            # written out once it is instead of being loaded.
+            state.loaded = True
+            if state.checked is None:
+                self._load(state)
+            else:
+                self._save(state, state.directories, None)
+        now = time.monotonic()
+        if state.checked is None or now - state.checked >= self.refresh_interval:
+            self._refresh(state)
+            state.checked = time.monotonic()
+        return state
+
+    def _refresh(self, state: CatalogRoot):
+        indexed = len(state.directories) > 0
+        changed = {}
+        seen = set()
+        if os.path.isdir(state.root):
+            stack = [state.root]
+            while len(stack) > 0:
+                path = stack.pop()
+                if path in seen:
+                    continue
+                known = state.directories.get(path, None)
+                try:
+                    mtime = os.path.getmtime(path)
+                except OSError:
+                    logging.warning(f"Warning: Unable to access {path}. Skipping this path.")
+                    continue
+                if known is None or known.mtime != mtime:
+                    known = scan_directory(path, state.excluded_dir_names)
+                    if known is None:
+                        continue
+                    state.directories[path] = known
+                    changed[path] = known
+                seen.add(path)
+                stack.extend(os.path.join(path, d) for d in known.subdirs)
+
+        removed = [path for path in state.directories if path not in seen]
+        for path in removed:
+            state.directories.pop(path)
+        if len(changed) > 0 or len(removed) > 0:
+            logging.debug("model catalog: {} directories changed, {} removed in {}".format(len(changed), len(removed), state.root))
+            state.result = None
+            self._save(state, changed, removed if indexed else None)
+
+    def _build_result(self, state: CatalogRoot):
+        if state.result is None:
+            files = []
+            dirs = {}
+            for path, directory in state.directories.items():
+                dirs[path] = directory.mtime
+                relative_dir = os.path.relpath(path, state.root)
+                for file_name in directory.files:
+                    files.append(file_name if relative_dir == "." else os.path.join(relative_dir, file_name))
+            state.result = (files, dirs, frozenset(files))
+        return state.result
+
+    def search(self, directory: str, excluded_dir_names: list[str] | None = None) -> tuple[list[str], dict[str, float]]:
+        """Same result as folder_paths.recursive_search: the relative file paths and the mtime of every directory."""
+        with self.lock:
+            files, dirs, _ = self._build_result(self._get_root(directory, excluded_dir_names))
+            return list(files), dict(dirs)
+
+    def directory_mtimes(self, directory: str, excluded_dir_names: list[str] | None = None) -> dict[str, float]:
+        with self.lock:
+            return self._build_result(self._get_root(directory, excluded_dir_names))[1]
+
+    def index(self, directory: str, excluded_dir_names: list[str] | None = None) -> tuple[list[str], dict[str, float], frozenset[str]]:
+        """The (files, directory mtimes, file set) of directory. Replaced when anything changes, callers must not modify it."""
+        with self.lock:
+            return self._build_result(self._get_root(directory, excluded_dir_names))
+
+    def contains(self, directory: str, relative_path: str, excluded_dir_names: list[str] | None = None) -> bool:
+        """
+        True if relative_path is a file or directory under directory according to the index. Only
+        answers from an index that was checked recently, never walks the directory for a lookup.
+        """
+        with self.lock:
+            state = self.roots.get((directory, frozenset(excluded_dir_names or [])), None)
+            if state is None or state.checked is None or time.monotonic() - state.checked >= self.refresh_interval:
+                return False
+            if os.path.join(state.root, relative_path) in state.directories:
+                return True
+            return relative_path in self._build_result(state)[2]
+
+    def clear(self):
+        with self.lock:
+            self.roots.clear()
+
+    def _load(self, state: CatalogRoot):
+        try:
+            from app.database.db import create_session
+            from app.database.models import ModelCatalogDirectory
+            with create_session() as session:
+                for row in session.query(ModelCatalogDirectory).filter_by(root=state.key):
+                    state.directories[row.path] = CatalogDirectory(row.mtime, json.loads(row.files), json.loads(row.subdirs))
+            logging.debug("model catalog: loaded {} directories of {}".format(len(state.directories), state.root))
+        except Exception as e:
+            logging.warning(f"Unable to load the model catalog of {state.root} from the database: {e}")
+            state.directories = {}
+
+    def _save(self, state: CatalogRoot, changed: dict[str, CatalogDirectory], removed: list[str] | None):
+        """Writes the changed directories, removed=None replaces every row of the root."""
+        if not state.loaded:
+            return
+        try:
+            from app.database.db import create_session
+            from app.database.models import ModelCatalogDirectory
+            with create_session() as session:
+                if removed is None:
+                    session.query(ModelCatalogDirectory).filter_by(root=state.key).delete()
+                else:
+                    for path in removed:
+                        session.query(ModelCatalogDirectory).filter_by(root=state.key, path=path).delete()
+                for path, directory in changed.items():
+                    row = ModelCatalogDirectory(root=state.key, path=path, mtime=directory.mtime, files=json.dumps(directory.files), subdirs=json.dumps(directory.subdirs))
+                    if removed is None:
+                        session.add(row)
+                    else:
+                        session.merge(row)
+                session.commit()
+        except Exception as e:
+            logging.warning(f"Unable to save the model catalog of {state.root} to the database: {e}")
+
+
+model_catalog = ModelCatalog()
+
+
+# The blobs are the same files as the snapshot symlinks under hash names.
+HF_CACHE_EXCLUDED_DIR_NAMES = [".git", ".locks", "blobs"]
+
+
+def parse_hf_cache_path(relative_path: str) -> tuple[str, str, list[str]] | None:
+    """Splits a path in the huggingface cache layout: models--Org--Name/snapshots/<hash>/rest into (repo dir, hash, rest)."""
+    parts = relative_path.split(os.sep)
+    for i in range(len(parts) - 3):
+        if parts[i].startswith("models--") and parts[i + 1] == "snapshots":
+            return os.sep.join(parts[:i + 1]), parts[i + 2], parts[i + 3:]
+    return None
+
+
+class HFCacheIndex:
+    """
+    Maps the basenames and repo relative paths of the files (and directories, for sharded models)
+    in a huggingface cache to their path in the newest snapshot of each repo. Built from the model
+    catalog of the cache directory, so it is rebuilt when a snapshot or refs directory changes.
+    """
+    def __init__(self, catalog: ModelCatalog):
+        self.catalog = catalog
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def current_snapshot(self, cache_dir: str, repo: str, snapshots, dirs: dict[str, float]) -> str:
+        try:
+            with open(os.path.join(cache_dir, repo, "refs", "main")) as f:
+                ref = f.read().strip()
+            if ref in snapshots:
+                return ref
+        except OSError:
+            pass
+        return max(snapshots, key=lambda s: (dirs.get(os.path.join(cache_dir, repo, "snapshots", s), 0.0), s))
+
+    def refs_mtimes(self, cache_dir: str, repos) -> dict[str, float]:
+        out = {}
+        for repo in repos:
+            try:
+                out[repo] = os.path.getmtime(os.path.join(cache_dir, repo, "refs", "main"))
+            except OSError:
+                out[repo] = None
+        return out
+
+    def build(self, cache_dir: str, files: list[str], dirs: dict[str, float]):
+        repos = {}
+        other_files = []
+        for f in files:
+            parsed = parse_hf_cache_path(f)
+            if parsed is not None:
+                repo, snapshot, rest = parsed
+                repos.setdefault(repo, {}).setdefault(snapshot, []).append(rest)
+            elif not any(part.startswith("models--") for part in f.split(os.sep)):
+                other_files.append(f)
+
+        relative = {}
+        basenames = {}
+        def add(relative_path, full_path):
+            relative.setdefault(relative_path, full_path)
+            basenames.setdefault(os.path.basename(relative_path), full_path)
+
+        # Files before directories and repos before anything else, each in sorted order so the result is deterministic.
+        repo_dirs = []
+        for repo in sorted(repos):
+            snapshot = self.current_snapshot(cache_dir, repo, repos[repo].keys(), dirs)
+            snapshot_dir = os.path.join(cache_dir, repo, "snapshots", snapshot)
+            for rest in sorted(repos[repo][snapshot]):
+                add(os.path.join(*rest), os.path.join(snapshot_dir, *rest))
+                for i in range(1, len(rest)):
+                    repo_dirs.append((os.path.join(*rest[:i]), os.path.join(snapshot_dir, *rest[:i])))
+        for relative_path, full_path in repo_dirs:
+            add(relative_path, full_path)
+        for f in sorted(other_files):
+            add(f, os.path.join(cache_dir, f))
+        for d in sorted(dirs):
+            relative_path = os.path.relpath(d, cache_dir)
+            if relative_path != "." and not any(part.startswith("models--") for part in relative_path.split(os.sep)):
+                add(relative_path, d)
+        return relative, basenames, self.refs_mtimes(cache_dir, repos)
+
+    def lookup(self, cache_dir: str, filename: str) -> str | None:
+        """Path of filename (relative to the repo or the cache) or of a file/directory with the same basename."""
+        if not os.path.isdir(cache_dir):
+            return None
+        result = self.catalog.index(cache_dir, HF_CACHE_EXCLUDED_DIR_NAMES)
+        with self.lock:
+            cached = self.indexes.get(cache_dir, None)
+            now = time.monotonic()
+            if cached is not None and cached[0] is result and now - cached[1] >= self.catalog.refresh_interval:
+                # refs/main is rewritten in place when a repo is updated to an existing snapshot.
+                if self.refs_mtimes(cache_dir, cached[2][2]) != cached[2][2]:
+                    cached = None
+                else:
+                    cached = (result, now, cached[2])
+                    self.indexes[cache_dir] = cached
+            if cached is None or cached[0] is not result:
+                cached = (result, now, self.build(cache_dir, result[0], result[1]))
+                self.indexes[cache_dir] = cached
+            relative, basenames, _ = cached[2]
+        return relative.get(filename, None) or basenames.get(os.path.basename(filename), None)
+
+
+hf_cache_index = HFCacheIndex(model_catalog)
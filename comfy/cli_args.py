@@ -51,6 +51,7 @@ parser.add_argument("--auto-launch", action="store_true", help="Automatically la
 parser.add_argument("--disable-auto-launch", action="store_true", help="Disable auto launching the browser.")
 parser.add_argument("--cuda-device", type=int, default=None, metavar="DEVICE_ID", help="Set the id of the cuda device this instance will use. All other devices will not be visible.")
 parser.add_argument("--default-device", type=int, default=None, metavar="DEFAULT_DEVICE_ID", help="Set the id of the default device, all other devices will stay visible.")
+parser.add_argument("--multi-gpu", action="store_true", help="Run one prompt worker per visible CUDA device so queued prompts execute on all GPUs at the same time. Prompts are sent to the device that already has their models loaded when possible.")
 cm_group = parser.add_mutually_exclusive_group()
 cm_group.add_argument("--cuda-malloc", action="store_true", help="Enable cudaMallocAsync (enabled by default for torch 2.0 and up).")
 cm_group.add_argument("--disable-cuda-malloc", action="store_true", help="Disable cudaMallocAsync.")
@@ -106,6 +107,16 @@ cache_group.add_argument("--cache-classic", action="store_true", help="Use the o
 cache_group.add_argument("--cache-lru", type=int, default=0, help="Use LRU caching with a maximum of N node results cached. May use more RAM/VRAM.")
 cache_group.add_argument("--cache-none", action="store_true", help="Reduced RAM/VRAM usage at the expense of executing every node for each run.")
 cache_group.add_argument("--cache-ram", nargs='?', const=4.0, type=float, default=0, help="Use RAM pressure caching with the specified headroom threshold. If available RAM drops below the threhold the cache remove large items to free RAM. Default 4GB")
+parser.add_argument("--cache-disk", type=str, default=None, metavar="PATH", help="Write the tensor node outputs (latents, conditioning, images...) evicted from the memory cache to this directory as a second cache tier, they are loaded back when needed again, also after a restart. Not used with --cache-none.")
+parser.add_argument("--cache-disk-size", type=float, default=10.0, metavar="GB", help="Maximum size of the --cache-disk directory in GB, the least recently used entries get deleted when it is exceeded.")
+
+parser.add_argument("--parallel-node-workers", type=int, default=0, metavar="N", help="Run nodes marked as thread safe (image loading/resizing, LoRA loading...) in a pool of N threads so independent branches of a workflow execute concurrently with the GPU nodes. Disabled by default.")
+parser.add_argument("--image-save-workers", type=int, default=4, metavar="N", help="Compress and write the images of a batch saved by SaveImage/PreviewImage in a pool of N threads. 0 saves them one by one on the node's thread.")
+parser.add_argument("--batch-prompts", type=int, default=1, metavar="N", help="Run up to N queued prompts that are the same workflow with only different texts and seeds (the same txt2img workflow queued by several users...) together, with their sampling merged into batched model calls. Disabled (1) by default.")
+parser.add_argument("--fair-share-queue", action="store_true", help="Run the queued prompts of the different client ids in turns (weighted round robin) instead of in the order they were queued, so a client queueing many prompts doesn't make everyone else wait.")
+parser.add_argument("--client-weight", type=str, nargs='+', default=[], metavar="CLIENT_ID=WEIGHT", help="With --fair-share-queue, the share of the runs given to these client ids, for example --client-weight api=2 runs two prompts of the api client for one of every other client. Default 1.")
+parser.add_argument("--model-affinity-window", type=int, default=0, metavar="N", help="Run queued prompts that use the models already loaded before the ones queued ahead of them that use other models, looking at the next N queued prompts (at most 64), to avoid swapping models back and forth. A prompt is never passed over more than N times. Disabled (0) by default.")
+parser.add_argument("--prefetch-models", type=float, nargs="?", const=8.0, default=0, metavar="GB", help="While a prompt executes, read the model files of the next queued prompts into the OS file cache so loading them doesn't wait on the disk. The value is the maximum GB read ahead, 8 when not given. Disabled by default.")
 
 attn_group = parser.add_mutually_exclusive_group()
 attn_group.add_argument("--use-split-cross-attention", action="store_true", help="Use the split cross attention optimization. Ignored when xformers is used.")
@@ -144,6 +155,10 @@ parser.add_argument("--force-non-blocking", action="store_true", help="Force Com
 
 parser.add_argument("--default-hashing-function", type=str, choices=['md5', 'sha1', 'sha256', 'sha512'], default='sha256', help="Allows you to choose the hash function to use for duplicate filename / contents comparison. Default is sha256.")
 
+parser.add_argument("--merged-weight-cache-gb", type=float, default=0, metavar="GB", help="Size of the cache (in the offload device memory) of weights with LoRAs applied, loading a model again with the same LoRAs copies them from it instead of recalculating them. Each weight calculated is copied to it, so only use it when the merged weights of the models fit. Disabled (0) by default.")
+parser.add_argument("--text-encoder-cache-gb", type=float, default=1.0, metavar="GB", help="Size of the cache (in RAM) of text encoder outputs, encoding a prompt again with the same text encoder and LoRAs reuses the output instead of running the text encoder. 0 disables it. Default is 1.")
+parser.add_argument("--batched-lora-merge", action="store_true", help="Merge plain LoRAs into the weights with one batched matrix multiplication per group of weights of the same shape, with the LoRAs of a weight concatenated, instead of one multiplication per LoRA and weight.")
+parser.add_argument("--runtime-lora", action="store_true", help="Apply plain LoRAs as an extra low rank term in the forward of the layers instead of merging them into the weights. Models with different LoRAs then share the same loaded weights and switching LoRAs doesn't reload the model, at the cost of slightly slower sampling.")
 parser.add_argument("--disable-smart-memory", action="store_true", help="Force ComfyUI to agressively offload to regular ram instead of keeping models in vram when it can.")
 parser.add_argument("--deterministic", action="store_true", help="Make pytorch use slower deterministic algorithms when it can. Note that this might not make images deterministic in all cases.")
 
@@ -159,6 +174,7 @@ parser.add_argument("--disable-pinned-memory", action="store_true", help="Disabl
 
 parser.add_argument("--mmap-torch-files", action="store_true", help="Use mmap when loading ckpt/pt files.")
 parser.add_argument("--disable-mmap", action="store_true", help="Don't use mmap when loading safetensors.")
+parser.add_argument("--weight-pool", action="store_true", help="Share the weights of a model file between the loaders that load it instead of loading a separate copy each time. The loaders then get clones of the same model and clip and the same vae and clip vision objects, so a node that modifies one of them in place changes it for every loader of the file.")
 
 parser.add_argument("--dont-print-server", action="store_true", help="Don't print server output.")
 parser.add_argument("--quick-test-for-ci", action="store_true", help="Quick test for CI.")
@@ -22,8 +22,12 @@ import comfy.model_management
 import comfy.model_base
 import comfy.weight_adapter as weight_adapter
 import logging
+import math
 import torch
 
+# Maximum size of the diffs calculated together by LowRankDiffBatches.
+LORA_BATCH_MEMORY = 256 * 1024 * 1024
+
 LORA_CLIP_MAP = {
     "mlp.fc1": "mlp_fc1",
     "mlp.fc2": "mlp_fc2",
@@ -430,3 +434,97 @@ def calculate_weight(patches, weight, key, intermediate_dtype=torch.float32, ori
             weight = old_weight
 
     return weight
+
+def low_rank_factors(patches, weight_shape):
+    """
+    The LoRAs of patches as a list of (up, down, scale) when they are all plain LoRAs (no DoRA, LoCon mid
+    weights, offsets, functions or model strength), None otherwise. up @ down * scale is the diff of each one.
+    """
+    out_dim = weight_shape[0]
+    in_dim = math.prod(weight_shape[1:])
+    factors = []
+    for strength, v, strength_model, offset, function in patches:
+        if type(v) is not weight_adapter.LoRAAdapter or strength_model != 1.0 or offset is not None or function is not None:
+            return None
+        mat1, mat2, alpha, mid, dora_scale, reshape = v.weights
+        if mid is not None or dora_scale is not None or reshape is not None:
+            return None
+        rank = mat2.shape[0]
+        if mat1.shape[0] != out_dim or mat1[0].numel() != rank or mat2[0].numel() != in_dim:
+            return None
+        if strength != 0.0:
+            factors.append((mat1, mat2, strength * (alpha / rank if alpha is not None else 1.0)))
+    if len(factors) == 0:
+        return None
+    return factors
+
+
+def runtime_lora_weights(patches, weight_shape, device, dtype):
+    """
+    The plain LoRAs of patches concatenated along the rank into one (down, up) pair for comfy.ops.apply_runtime_loras,
+    with the scales folded into up and down shaped like the kernel for conv layers. None if low_rank_factors is.
+    """
+    factors = low_rank_factors(patches, weight_shape)
+    if factors is None:
+        return None
+    kernel = tuple(weight_shape[1:])
+    down = torch.cat([comfy.model_management.cast_to_device(mat2, device, torch.float32).reshape((mat2.shape[0],) + kernel) for _, mat2, _ in factors])
+    up = torch.cat([comfy.model_management.cast_to_device(mat1, device, torch.float32).reshape(weight_shape[0], -1) * scale for mat1, _, scale in factors], dim=1)
+    up = up.reshape(up.shape + (1,) * len(kernel[1:]))
+    return down.to(dtype), up.to(dtype)
+
+
+class LowRankDiffBatches:
+    """
+    Calculates the diffs of the keys patched with plain LoRAs in batches instead of one key and one LoRA
+    at a time: the LoRAs of a key are concatenated along the rank and the keys with the same weight shape
+    (zero padded to the largest rank) are multiplied with one torch.bmm. keys are the order the diffs
+    will be requested in, a batch is calculated when its first key is requested.
+    """
+    def __init__(self, patches, keys, shapes, device, intermediate_dtype=torch.float32, max_batch_memory=LORA_BATCH_MEMORY):
+        self.device = device
+        self.intermediate_dtype = intermediate_dtype
+        self.max_batch_memory = max_batch_memory
+        self.pending = {}
+        for key in keys:
+            factors = low_rank_factors(patches[key], shapes[key])
+            if factors is not None:
+                self.pending[key] = (shapes[key], factors)
+        self.diffs = {}
+
+    def pop(self, key):
+        """The diff of key in intermediate_dtype, None if it isn't only patched with plain LoRAs."""
+        if key not in self.diffs:
+            if key not in self.pending:
+                return None
+            self.calculate_batch(key)
+        return self.diffs.pop(key)
+
+    def discard(self, key):
+        """For a key whose weight was found elsewhere (merged weight cache): frees its diff or leaves it out of the next batches."""
+        self.pending.pop(key, None)
+        self.diffs.pop(key, None)
+
+    def calculate_batch(self, key):
+        shape = self.pending[key][0]
+        batch_size = max(1, self.max_batch_memory // (math.prod(shape) * self.intermediate_dtype.itemsize))
+        batch = [k for k, v in self.pending.items() if v[0] == shape][:batch_size]
+        if key not in batch:
+            batch[-1] = key
+
+        out_dim = shape[0]
+        in_dim = math.prod(shape[1:])
+        rank = max(sum(f[1].shape[0] for f in self.pending[k][1]) for k in batch)
+        up = torch.zeros((len(batch), out_dim, rank), dtype=self.intermediate_dtype, device=self.device)
+        down = torch.zeros((len(batch), rank, in_dim), dtype=self.intermediate_dtype, device=self.device)
+        for i, k in enumerate(batch):
+            r = 0
+            for mat1, mat2, scale in self.pending.pop(k)[1]:
+                size = mat2.shape[0]
+                up[i, :, r:r + size] = comfy.model_management.cast_to_device(mat1, self.device, self.intermediate_dtype).reshape(out_dim, size) * scale
+                down[i, r:r + size] = comfy.model_management.cast_to_device(mat2, self.device, self.intermediate_dtype).reshape(size, in_dim)
+                r += size
+        diffs = torch.bmm(up, down)
+        del up, down
+        for i, k in enumerate(batch):
+            self.diffs[k] = diffs[i].reshape(shape)
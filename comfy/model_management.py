@@ -26,6 +26,9 @@ import importlib
 import platform
 import weakref
 import gc
+import threading
+import functools
+import contextvars
 
 class VRAMState(Enum):
     DISABLED = 0    #No vram present: no need to move models to vram
@@ -187,6 +190,17 @@ def get_torch_device():
         else:
             return torch.device(torch.cuda.current_device())
 
+def set_thread_torch_device(device):
+    """The current cuda device is per thread, so this makes get_torch_device() return device in the calling thread."""
+    if is_device_cuda(device):
+        torch.cuda.set_device(device)
+
+def get_all_torch_devices():
+    """Devices used by the --multi-gpu prompt workers, only CUDA devices are supported."""
+    if not directml_enabled and (is_nvidia() or is_amd()):
+        return [torch.device("cuda", i) for i in range(torch.cuda.device_count())]
+    return [get_torch_device()]
+
 def get_total_memory(dev=None, torch_total_too=False):
     global directml_enabled
     if dev is None:
@@ -447,6 +461,15 @@ except:
 
 
 current_loaded_models = []
+# Prompt workers on different devices (--multi-gpu) load and unload models concurrently.
+model_management_lock = threading.RLock()
+
+def with_model_management_lock(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with model_management_lock:
+            return func(*args, **kwargs)
+    return wrapper
 
 def module_size(module):
     module_mem = 0
@@ -578,6 +601,7 @@ def extra_reserved_memory():
 def minimum_inference_memory():
     return (1024 * 1024 * 1024) * 0.8 + extra_reserved_memory()
 
+@with_model_management_lock
 def free_memory(memory_required, device, keep_loaded=[]):
     cleanup_models_gc()
     unloaded_model = []
@@ -615,6 +639,7 @@ def free_memory(memory_required, device, keep_loaded=[]):
                 soft_empty_cache()
     return unloaded_models
 
+@with_model_management_lock
 def load_models_gpu(models, memory_required=0, force_patch_weights=False, minimum_memory_required=None, force_full_load=False):
     cleanup_models_gc()
     global vram_state
@@ -698,13 +723,22 @@ def load_models_gpu(models, memory_required=0, force_patch_weights=False, minimu
         if vram_set_state == VRAMState.NO_VRAM:
             lowvram_model_memory = 0.1
 
-        loaded_model.model_load(lowvram_model_memory, force_patch_weights=force_patch_weights)
+        # The weights are transferred without the lock so the workers of other devices (--multi-gpu) load at the same time.
+        model_management_lock.release()
+        try:
+            loaded_model.model_load(lowvram_model_memory, force_patch_weights=force_patch_weights)
+        finally:
+            model_management_lock.acquire()
         current_loaded_models.insert(0, loaded_model)
     return
 
 def load_model_gpu(model):
     return load_models_gpu([model])
 
+def loaded_models_on_device(device):
+    with model_management_lock:
+        return [m.model for m in current_loaded_models if m.device == device and m.model is not None]
+
 def loaded_models(only_currently_used=False):
     output = []
     for m in current_loaded_models:
@@ -736,6 +770,7 @@ def cleanup_models_gc():
 
 
 
+@with_model_management_lock
 def cleanup_models():
     to_delete = []
     for i in range(len(current_loaded_models)):
@@ -1525,30 +1560,57 @@ def unload_all_models():
 
 
 #TODO: might be cleaner to put this somewhere else
-import threading
-
 class InterruptProcessingException(Exception):
     pass
 
 interrupt_processing_mutex = threading.RLock()
 
-interrupt_processing = False
-def interrupt_current_processing(value=True):
-    global interrupt_processing
+# Incremented by each interrupt of every prompt, the prompts running have seen the interrupts up to their interrupt_count.
+interrupt_count = 0
+# The prompts interrupted on their own by /interrupt with a prompt_id.
+interrupted_prompt_ids = set()
+
+class ProcessingState:
+    """The interrupt state of the prompt running in a context, --multi-gpu and --batch-prompts run several at once."""
+    def __init__(self, prompt_id=None):
+        self.prompt_id = prompt_id
+        self.interrupt_count = interrupt_count
+
+# The state of the code running outside of a prompt is shared.
+current_processing_state = contextvars.ContextVar("current_processing_state", default=ProcessingState())
+
+def set_processing_prompt(prompt_id):
+    """Called when prompt_id starts executing in this context, the interrupts sent before don't apply to it."""
+    with interrupt_processing_mutex:
+        interrupted_prompt_ids.discard(prompt_id)
+        current_processing_state.set(ProcessingState(prompt_id))
+
+def interrupt_current_processing(value=True, prompt_id=None):
+    """Interrupts every prompt running or only prompt_id, value=False clears the interrupts of this context's prompt."""
+    global interrupt_count
     global interrupt_processing_mutex
     with interrupt_processing_mutex:
-        interrupt_processing = value
+        if prompt_id is not None:
+            if value:
+                interrupted_prompt_ids.add(prompt_id)
+            else:
+                interrupted_prompt_ids.discard(prompt_id)
+        elif value:
+            interrupt_count += 1
+        else:
+            state = current_processing_state.get()
+            state.interrupt_count = interrupt_count
+            interrupted_prompt_ids.discard(state.prompt_id)
 
 def processing_interrupted():
-    global interrupt_processing
     global interrupt_processing_mutex
     with interrupt_processing_mutex:
-        return interrupt_processing
+        state = current_processing_state.get()
+        return state.interrupt_count != interrupt_count or state.prompt_id in interrupted_prompt_ids
 
 def throw_exception_if_processing_interrupted():
-    global interrupt_processing
     global interrupt_processing_mutex
     with interrupt_processing_mutex:
-        if interrupt_processing:
-            interrupt_processing = False
+        if processing_interrupted():
+            interrupt_current_processing(False)
             raise InterruptProcessingException()
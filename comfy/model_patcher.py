@@ -23,7 +23,9 @@ import copy
 import inspect
 import logging
 import math
+import threading
 import uuid
+import weakref
 from typing import Callable, Optional
 
 import torch
@@ -32,8 +34,10 @@ import comfy.float
 import comfy.hooks
 import comfy.lora
 import comfy.model_management
+import comfy.ops
 import comfy.patcher_extension
 import comfy.utils
+from comfy.cli_args import args
 from comfy.comfy_types import UnetWrapperFunction
 from comfy.quant_ops import QuantizedTensor
 from comfy.patcher_extension import CallbacksMP, PatcherInjection, WrappersMP
@@ -107,6 +111,9 @@ def wipe_lowvram_weight(m):
     if hasattr(m, "bias_function"):
         m.bias_function = []
 
+def has_runtime_loras(m):
+    return len(getattr(m, "runtime_loras", [])) > 0
+
 def move_weight_functions(m, device):
     if device is None:
         return 0
@@ -212,6 +219,85 @@ class MemoryCounter:
     def decrement(self, used: int):
         self.value -= used
 
+class MergedWeightCache:
+    """
+    LRU cache of weights with their patches (LoRAs...) applied, stored on the offload device so loading
+    a model again with a patch set that was already applied to it is a copy instead of recalculating the
+    patches. Keyed by the model, the weight key, the ordered patches with their strengths and the dtypes.
+    The entries hold a reference to their patches so the ids in the keys can't be reused.
+
+    The weights of one patch set of a model (a group) are only added while they fit in max_size, a
+    model with more merged weights than that keeps the first ones cached instead of evicting its own
+    entries on every load.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        # group -> size of its entries
+        self.group_sizes = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.models_freed = False
+
+    def cache_key(self, model, key, patches, dtype, compute_dtype):
+        signature = tuple((p[0], id(p[1]), p[2], p[3], id(p[4])) for p in patches)
+        return (id(model), key, signature, dtype, compute_dtype)
+
+    def get(self, model, cache_key):
+        with self.lock:
+            entry = self.entries.get(cache_key, None)
+            if entry is None or entry[0]() is not model:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(cache_key)
+            self.hits += 1
+            return entry[2]
+
+    def _remove(self, cache_key):
+        entry = self.entries.pop(cache_key)
+        self.size -= entry[3]
+        group_size = self.group_sizes[entry[4]] - entry[3]
+        if group_size > 0:
+            self.group_sizes[entry[4]] = group_size
+        else:
+            self.group_sizes.pop(entry[4])
+
+    def put(self, model, cache_key, patches, weight, device, group):
+        """group identifies the patch set of the model (model id and patches_uuid)."""
+        size = weight.nelement() * weight.element_size()
+        with self.lock:
+            if self.models_freed:
+                self.models_freed = False
+                for k in [k for k, entry in self.entries.items() if entry[0]() is None]:
+                    self._remove(k)
+            if cache_key in self.entries:
+                self._remove(cache_key)
+            if self.group_sizes.get(group, 0) + size > self.max_size:
+                return
+        weight = weight.to(device, copy=True)
+        with self.lock:
+            if cache_key in self.entries:
+                self._remove(cache_key)
+            self.entries[cache_key] = (weakref.ref(model, self.model_freed), list(patches), weight, size, group)
+            self.size += size
+            self.group_sizes[group] = self.group_sizes.get(group, 0) + size
+            while self.size > self.max_size:
+                self._remove(next(iter(self.entries)))
+
+    def model_freed(self, ref):
+        self.models_freed = True
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "size": self.size, "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+merged_weight_cache = MergedWeightCache(int(args.merged_weight_cache_gb * (1024 ** 3)))
+
+# model.current_weight_patches_uuid of weights loaded without any patches merged because they are all runtime LoRAs.
+RUNTIME_LORA_WEIGHTS = "runtime_lora"
+
 class ModelPatcher:
     def __init__(self, model, load_device, offload_device, size=0, weight_inplace_update=False):
         self.size = size
@@ -266,6 +352,9 @@ class ModelPatcher:
         if not hasattr(self.model, 'current_weight_patches_uuid'):
             self.model.current_weight_patches_uuid = None
 
+        if not hasattr(self.model, 'current_runtime_loras_uuid'):
+            self.model.current_runtime_loras_uuid = None
+
         if not hasattr(self.model, 'model_offload_buffer_memory'):
             self.model.model_offload_buffer_memory = 0
 
@@ -608,7 +697,7 @@ class ModelPatcher:
                         sd.pop(k)
             return sd
 
-    def patch_weight_to_device(self, key, device_to=None, inplace_update=False):
+    def patch_weight_to_device(self, key, device_to=None, inplace_update=False, lora_diffs=None):
         if key not in self.patches:
             return
 
@@ -619,16 +708,36 @@ class ModelPatcher:
             self.backup[key] = collections.namedtuple('Dimension', ['weight', 'inplace_update'])(weight.to(device=self.offload_device, copy=inplace_update), inplace_update)
 
         temp_dtype = comfy.model_management.lora_compute_dtype(device_to)
-        if device_to is not None:
-            temp_weight = comfy.model_management.cast_to_device(weight, device_to, temp_dtype, copy=True)
+        cache_key = None
+        out_weight = None
+        if merged_weight_cache.max_size > 0:
+            cache_key = merged_weight_cache.cache_key(self.model, key, self.patches[key], weight.dtype, temp_dtype)
+            out_weight = merged_weight_cache.get(self.model, cache_key)
+
+        if out_weight is not None:
+            if lora_diffs is not None:
+                lora_diffs.discard(key)
+            out_weight = out_weight.to(device_to if device_to is not None else weight.device, copy=True)
         else:
-            temp_weight = weight.to(temp_dtype, copy=True)
-        if convert_func is not None:
-            temp_weight = convert_func(temp_weight, inplace=True)
+            if device_to is not None:
+                temp_weight = comfy.model_management.cast_to_device(weight, device_to, temp_dtype, copy=True)
+            else:
+                temp_weight = weight.to(temp_dtype, copy=True)
+            if convert_func is not None:
+                temp_weight = convert_func(temp_weight, inplace=True)
+
+            lora_diff = lora_diffs.pop(key) if lora_diffs is not None else None
+            if lora_diff is not None:
+                out_weight = temp_weight.add_(lora_diff.to(temp_weight.dtype))
+                del lora_diff
+            else:
+                out_weight = comfy.lora.calculate_weight(self.patches[key], temp_weight, key)
+            if set_func is None:
+                out_weight = comfy.float.stochastic_rounding(out_weight, weight.dtype, seed=string_to_seed(key))
+            if cache_key is not None:
+                merged_weight_cache.put(self.model, cache_key, self.patches[key], out_weight, self.offload_device, (id(self.model), self.patches_uuid))
 
-        out_weight = comfy.lora.calculate_weight(self.patches[key], temp_weight, key)
         if set_func is None:
-            out_weight = comfy.float.stochastic_rounding(out_weight, weight.dtype, seed=string_to_seed(key))
             if inplace_update:
                 comfy.utils.copy_to_param(self.model, key, out_weight)
             else:
@@ -636,6 +745,60 @@ class ModelPatcher:
         else:
             set_func(out_weight, inplace_update=inplace_update, seed=string_to_seed(key))
 
+    def runtime_lora_keys(self):
+        """
+        The weight keys whose patches are applied as an extra low rank term in the forward of their comfy.ops
+        layer instead of being merged into the weight (--runtime-lora): plain LoRAs on layers that support it.
+        """
+        keys = set()
+        if not args.runtime_lora:
+            return keys
+        for key, patches in self.patches.items():
+            if not key.endswith(".weight") or key in self.weight_wrapper_patches:
+                continue
+            weight, set_func, convert_func = get_key_weight(self.model, key)
+            if set_func is not None or convert_func is not None:
+                continue
+            m = comfy.utils.get_attr(self.model, key[:-len(".weight")])
+            if comfy.ops.supports_runtime_loras(m) and comfy.lora.low_rank_factors(patches, weight.shape) is not None:
+                keys.add(key)
+        return keys
+
+    def weight_patches_uuid(self, force_patch_weights=False):
+        """
+        What the loaded weights are recorded as in model.current_weight_patches_uuid. When all the patches are
+        runtime LoRAs the weights are the unpatched ones, the same for all these clones so switching between them
+        doesn't reload the weights.
+        """
+        if not args.runtime_lora or force_patch_weights or self.force_cast_weights or len(self.weight_wrapper_patches) > 0 or len(self.hook_patches) > 0:
+            return self.patches_uuid
+        if self.runtime_lora_keys() != self.patches.keys():
+            return self.patches_uuid
+        return RUNTIME_LORA_WEIGHTS
+
+    def patch_runtime_loras(self, force_patch_weights=False):
+        """Sets the runtime_loras of the layers to the runtime LoRAs of this clone, none when the patches get merged anyway."""
+        keys = set()
+        if not force_patch_weights:
+            keys = self.runtime_lora_keys()
+        runtime_loras_uuid = self.patches_uuid if len(keys) > 0 else None
+        if self.model.current_runtime_loras_uuid == runtime_loras_uuid:
+            return
+        self.unpatch_runtime_loras()
+        dtype = getattr(self.model, "manual_cast_dtype", None) or self.model_dtype()
+        if dtype is None or dtype.itemsize < 2:
+            dtype = comfy.model_management.lora_compute_dtype(self.load_device)
+        for key in keys:
+            m = comfy.utils.get_attr(self.model, key[:-len(".weight")])
+            m.runtime_loras = [comfy.lora.runtime_lora_weights(self.patches[key], m.weight.shape, self.load_device, dtype)]
+        self.model.current_runtime_loras_uuid = runtime_loras_uuid
+
+    def unpatch_runtime_loras(self):
+        for m in self.model.modules():
+            if "runtime_loras" in m.__dict__:
+                del m.runtime_loras
+        self.model.current_runtime_loras_uuid = None
+
     def pin_weight_to_device(self, key):
         weight, set_func, convert_func = get_key_weight(self.model, key)
         if comfy.model_management.pin_memory(weight):
@@ -684,6 +847,7 @@ class ModelPatcher:
     def load(self, device_to=None, lowvram_model_memory=0, force_patch_weights=False, full_load=False):
         with self.use_ejected():
             self.unpatch_hooks()
+            self.patch_runtime_loras(force_patch_weights)
             mem_counter = 0
             patch_counter = 0
             lowvram_counter = 0
@@ -720,7 +884,7 @@ class ModelPatcher:
                         m.weight_function = []
                         m.bias_function = []
 
-                    if weight_key in self.patches:
+                    if weight_key in self.patches and not has_runtime_loras(m):
                         if force_patch_weights:
                             self.patch_weight_to_device(weight_key)
                         else:
@@ -760,6 +924,12 @@ class ModelPatcher:
                 mem_counter += move_weight_functions(m, device_to)
 
             load_completely.sort(reverse=True)
+            lora_diffs = None
+            if args.batched_lora_merge and device_to is not None:
+                keys = ["{}.{}".format(x[1], param) for x in load_completely if getattr(x[2], "comfy_patched_weights", False) != True for param in x[3] if param != "weight" or not has_runtime_loras(x[2])]
+                keys = [key for key in keys if key in self.patches]
+                lora_diffs = comfy.lora.LowRankDiffBatches(self.patches, keys, {key: get_key_weight(self.model, key)[0].shape for key in keys}, device_to)
+
             for x in load_completely:
                 n = x[1]
                 m = x[2]
@@ -771,7 +941,9 @@ class ModelPatcher:
                 for param in params:
                     key = "{}.{}".format(n, param)
                     self.unpin_weight(key)
-                    self.patch_weight_to_device(key, device_to=device_to)
+                    if param == "weight" and has_runtime_loras(m):
+                        continue
+                    self.patch_weight_to_device(key, device_to=device_to, lora_diffs=lora_diffs)
                 if comfy.model_management.is_device_cuda(device_to):
                     torch.cuda.synchronize()
 
@@ -801,7 +973,7 @@ class ModelPatcher:
             self.model.device = device_to
             self.model.model_loaded_weight_memory = mem_counter
             self.model.model_offload_buffer_memory = offload_buffer
-            self.model.current_weight_patches_uuid = self.patches_uuid
+            self.model.current_weight_patches_uuid = self.weight_patches_uuid(force_patch_weights)
 
             for callback in self.get_all_callbacks(CallbacksMP.ON_LOAD):
                 callback(self, device_to, lowvram_model_memory, force_patch_weights, full_load)
@@ -815,6 +987,8 @@ class ModelPatcher:
                 if k not in self.object_patches_backup:
                     self.object_patches_backup[k] = old
 
+            self.patch_runtime_loras(force_patch_weights)
+
             if lowvram_model_memory == 0:
                 full_load = True
             else:
@@ -849,6 +1023,7 @@ class ModelPatcher:
 
             self.model.current_weight_patches_uuid = None
             self.backup.clear()
+            self.unpatch_runtime_loras()
 
             if device_to is not None:
                 self.model.to(device_to)
@@ -914,7 +1089,7 @@ class ModelPatcher:
                         m.to(device_to)
                         module_mem += move_weight_functions(m, device_to)
                         if lowvram_possible:
-                            if weight_key in self.patches:
+                            if weight_key in self.patches and not has_runtime_loras(m):
                                 if force_patch_weights:
                                     self.patch_weight_to_device(weight_key)
                                 else:
@@ -953,7 +1128,7 @@ class ModelPatcher:
 
     def partially_load(self, device_to, extra_memory=0, force_patch_weights=False):
         with self.use_ejected(skip_and_inject_on_exit_only=True):
-            unpatch_weights = self.model.current_weight_patches_uuid is not None and (self.model.current_weight_patches_uuid != self.patches_uuid or force_patch_weights)
+            unpatch_weights = self.model.current_weight_patches_uuid is not None and (self.model.current_weight_patches_uuid != self.weight_patches_uuid() or force_patch_weights)
             # TODO: force_patch_weights should not unload + reload full model
             used = self.model.model_loaded_weight_memory
             self.unpatch_model(self.offload_device, unpatch_weights=unpatch_weights)
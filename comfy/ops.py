@@ -146,6 +146,23 @@ class CastWeightBiasOp:
     comfy_cast_weights = False
     weight_function = []
     bias_function = []
+    runtime_loras = []
+
+
+def apply_runtime_loras(s, input, x):
+    """
+    Adds the unmerged LoRAs in s.runtime_loras, (down, up) pairs set by the ModelPatcher (--runtime-lora),
+    to the output x of the layer s: x + up(down(input)) without touching the weight.
+    """
+    for down, up in s.runtime_loras:
+        down = cast_to_input(down, input, copy=False)
+        up = cast_to_input(up, input, copy=False)
+        if up.ndim == 2:
+            x += torch.nn.functional.linear(torch.nn.functional.linear(input, down), up)
+        else:
+            conv = getattr(torch.nn.functional, "conv{}d".format(up.ndim - 2))
+            x += conv(s._conv_forward(input, down, None), up)
+    return x
 
 class disable_weight_init:
     class Linear(torch.nn.Linear, CastWeightBiasOp):
@@ -156,11 +173,13 @@ class disable_weight_init:
             weight, bias, offload_stream = cast_bias_weight(self, input, offloadable=True)
             x = torch.nn.functional.linear(input, weight, bias)
             uncast_bias_weight(self, weight, bias, offload_stream)
+            if len(self.runtime_loras) > 0:
+                x = apply_runtime_loras(self, input, x)
             return x
 
         def forward(self, *args, **kwargs):
             run_every_op()
-            if self.comfy_cast_weights or len(self.weight_function) > 0 or len(self.bias_function) > 0:
+            if self.comfy_cast_weights or len(self.weight_function) > 0 or len(self.bias_function) > 0 or len(self.runtime_loras) > 0:
                 return self.forward_comfy_cast_weights(*args, **kwargs)
             else:
                 return super().forward(*args, **kwargs)
@@ -173,11 +192,13 @@ class disable_weight_init:
             weight, bias, offload_stream = cast_bias_weight(self, input, offloadable=True)
             x = self._conv_forward(input, weight, bias)
             uncast_bias_weight(self, weight, bias, offload_stream)
+            if len(self.runtime_loras) > 0:
+                x = apply_runtime_loras(self, input, x)
             return x
 
         def forward(self, *args, **kwargs):
             run_every_op()
-            if self.comfy_cast_weights or len(self.weight_function) > 0 or len(self.bias_function) > 0:
+            if self.comfy_cast_weights or len(self.weight_function) > 0 or len(self.bias_function) > 0 or len(self.runtime_loras) > 0:
                 return self.forward_comfy_cast_weights(*args, **kwargs)
             else:
                 return super().forward(*args, **kwargs)
@@ -190,11 +211,13 @@ class disable_weight_init:
             weight, bias, offload_stream = cast_bias_weight(self, input, offloadable=True)
             x = self._conv_forward(input, weight, bias)
             uncast_bias_weight(self, weight, bias, offload_stream)
+            if len(self.runtime_loras) > 0:
+                x = apply_runtime_loras(self, input, x)
             return x
 
         def forward(self, *args, **kwargs):
             run_every_op()
-            if self.comfy_cast_weights or len(self.weight_function) > 0 or len(self.bias_function) > 0:
+            if self.comfy_cast_weights or len(self.weight_function) > 0 or len(self.bias_function) > 0 or len(self.runtime_loras) > 0:
                 return self.forward_comfy_cast_weights(*args, **kwargs)
             else:
                 return super().forward(*args, **kwargs)
@@ -216,11 +239,13 @@ class disable_weight_init:
             weight, bias, offload_stream = cast_bias_weight(self, input, offloadable=True)
             x = self._conv_forward(input, weight, bias)
             uncast_bias_weight(self, weight, bias, offload_stream)
+            if len(self.runtime_loras) > 0:
+                x = apply_runtime_loras(self, input, x)
             return x
 
         def forward(self, *args, **kwargs):
             run_every_op()
-            if self.comfy_cast_weights or len(self.weight_function) > 0 or len(self.bias_function) > 0:
+            if self.comfy_cast_weights or len(self.weight_function) > 0 or len(self.bias_function) > 0 or len(self.runtime_loras) > 0:
                 return self.forward_comfy_cast_weights(*args, **kwargs)
             else:
                 return super().forward(*args, **kwargs)
@@ -370,6 +395,16 @@ class disable_weight_init:
             raise ValueError(f"unsupported dimensions: {dims}")
 
 
+RUNTIME_LORA_OPS = (disable_weight_init.Linear, disable_weight_init.Conv1d, disable_weight_init.Conv2d, disable_weight_init.Conv3d)
+
+def supports_runtime_loras(m):
+    """If the layer m applies m.runtime_loras: the ops above (and manual_cast) unless a subclass replaces their forward."""
+    for op in RUNTIME_LORA_OPS:
+        if isinstance(m, op):
+            return type(m).forward is op.forward and type(m).forward_comfy_cast_weights is op.forward_comfy_cast_weights and getattr(m, "groups", 1) == 1
+    return False
+
+
 class manual_cast(disable_weight_init):
     class Linear(disable_weight_init.Linear):
         comfy_cast_weights = True
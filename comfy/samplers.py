@@ -12,11 +12,14 @@ import collections
 from comfy import model_management
 import math
 import logging
+import threading
+import weakref
 import comfy.sampler_helpers
 import comfy.model_patcher
 import comfy.patcher_extension
 import comfy.hooks
 import comfy.context_windows
+import comfy.conds
 import comfy.utils
 import scipy.stats
 import numpy
@@ -206,6 +209,87 @@ def calc_cond_batch(model: BaseModel, conds: list[list[dict]], x_in: torch.Tenso
         return _calc_cond_batch_outer(model, conds, x_in, timestep, model_options)
     return handler.execute(_calc_cond_batch_outer, model, conds, x_in, timestep, model_options)
 
+def crossattn_lengths(conditioning: dict) -> tuple:
+    return tuple((k, v.cond.shape[1]) for k, v in sorted(conditioning.items()) if isinstance(v, comfy.conds.CONDCrossAttn))
+
+# Per model: the memory estimates of the batch shapes it ran, the same every step, and the last plan.
+_cond_batch_state: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+MEMORY_ESTIMATE_CACHE_SIZE = 4096
+
+def batch_memory_required(model: BaseModel, to_run: list[tuple[tuple,int]], batch: list[int], estimates: dict | None = None) -> float:
+    """model.memory_required for running the batch indices of to_run in one model call, cached by shapes in estimates."""
+    first_shape = to_run[batch[0]][0].input_x.shape
+    input_shape = [len(batch) * first_shape[0]] + list(first_shape)[1:]
+    cond_shapes = collections.defaultdict(list)
+    for x in batch:
+        for k, v in to_run[x][0].conditioning.items():
+            cond_shapes[k].append(v.size())
+
+    key = None
+    if estimates is not None:
+        try:
+            key = (tuple(input_shape), tuple((k, tuple(tuple(s) for s in v)) for k, v in sorted(cond_shapes.items())))
+            hash(key)
+        except TypeError:
+            key = None
+        if key is not None and key in estimates:
+            return estimates[key]
+    memory = model.memory_required(input_shape, cond_shapes=cond_shapes)
+    if key is not None:
+        if len(estimates) >= MEMORY_ESTIMATE_CACHE_SIZE:
+            estimates.clear()
+        estimates[key] = memory
+    return memory
+
+def plan_cond_batches(model: BaseModel, to_run: list[tuple[tuple,int]], free_memory: float) -> list[list[int]]:
+    """
+    Splits to_run into the batches that run in one model call each, as lists of indices into to_run.
+    The items that can be concatenated with each other (can_concat_cond) are packed first fit into
+    as few batches as fit in free_memory. When they don't all fit in one, the items with the same
+    cross attention lengths are packed together so the conds are only padded (repeated to the lcm of
+    their lengths) when that saves a model call. A single item that doesn't fit still gets its
+    batch. The memory estimates of the batch shapes are cached per model, the plan is logged when
+    it changes.
+    """
+    state = _cond_batch_state.get(model, None)
+    dtypes = (model.get_dtype(), getattr(model, "manual_cast_dtype", None))
+    if state is None or state["dtypes"] != dtypes:
+        state = {"dtypes": dtypes, "estimates": {}, "plan": None}
+        _cond_batch_state[model] = state
+
+    groups: list[list[int]] = []
+    for x in range(len(to_run)):
+        for group in groups:
+            if can_concat_cond(to_run[x][0], to_run[group[0]][0]):
+                group.append(x)
+                break
+        else:
+            groups.append([x])
+
+    batches = []
+    for group in groups:
+        # Latest first, in the order the batches were always concatenated.
+        group = group[::-1]
+        if len(group) > 1 and batch_memory_required(model, to_run, group, state["estimates"]) * 1.5 < free_memory:
+            batches.append(group)
+            continue
+        group.sort(key=lambda x: crossattn_lengths(to_run[x][0].conditioning))
+        group_batches = []
+        for x in group:
+            for batch in group_batches:
+                if batch_memory_required(model, to_run, batch + [x], state["estimates"]) * 1.5 < free_memory:
+                    batch.append(x)
+                    break
+            else:
+                group_batches.append([x])
+        batches += group_batches
+
+    plan = [len(batch) for batch in batches]
+    if plan != state["plan"]:
+        state["plan"] = plan
+        logging.debug("Conds batch plan: {} model calls for {} conds, batch sizes {}".format(len(plan), len(to_run), plan))
+    return batches
+
 def _calc_cond_batch_outer(model: BaseModel, conds: list[list[dict]], x_in: torch.Tensor, timestep, model_options):
     executor = comfy.patcher_extension.WrapperExecutor.new_executor(
         _calc_cond_batch,
@@ -213,6 +297,12 @@ def _calc_cond_batch_outer(model: BaseModel, conds: list[list[dict]], x_in: torc
     )
     return executor.execute(model, conds, x_in, timestep, model_options)
 
+_model_call_batcher = threading.local()
+
+def set_model_call_batcher(batcher):
+    """Makes the model calls of the samplers running on this thread go through batcher.apply_model (see comfy_execution.prompt_batching)."""
+    _model_call_batcher.batcher = batcher
+
 def _calc_cond_batch(model: BaseModel, conds: list[list[dict]], x_in: torch.Tensor, timestep, model_options):
     out_conds = []
     out_counts = []
@@ -249,31 +339,8 @@ def _calc_cond_batch(model: BaseModel, conds: list[list[dict]], x_in: torch.Tens
 
     # run every hooked_to_run separately
     for hooks, to_run in hooked_to_run.items():
-        while len(to_run) > 0:
-            first = to_run[0]
-            first_shape = first[0][0].shape
-            to_batch_temp = []
-            for x in range(len(to_run)):
-                if can_concat_cond(to_run[x][0], first[0]):
-                    to_batch_temp += [x]
-
-            to_batch_temp.reverse()
-            to_batch = to_batch_temp[:1]
-
-            free_memory = model_management.get_free_memory(x_in.device)
-            for i in range(1, len(to_batch_temp) + 1):
-                batch_amount = to_batch_temp[:len(to_batch_temp)//i]
-                input_shape = [len(batch_amount) * first_shape[0]] + list(first_shape)[1:]
-                cond_shapes = collections.defaultdict(list)
-                for tt in batch_amount:
-                    cond = {k: v.size() for k, v in to_run[tt][0].conditioning.items()}
-                    for k, v in to_run[tt][0].conditioning.items():
-                        cond_shapes[k].append(v.size())
-
-                if model.memory_required(input_shape, cond_shapes=cond_shapes) * 1.5 < free_memory:
-                    to_batch = batch_amount
-                    break
-
+        free_memory = model_management.get_free_memory(x_in.device)
+        for to_batch in plan_cond_batches(model, to_run, free_memory):
             input_x = []
             mult = []
             c = []
@@ -283,7 +350,7 @@ def _calc_cond_batch(model: BaseModel, conds: list[list[dict]], x_in: torch.Tens
             control = None
             patches = None
             for x in to_batch:
-                o = to_run.pop(x)
+                o = to_run[x]
                 p = o[0]
                 input_x.append(p.input_x)
                 mult.append(p.mult)
@@ -322,6 +389,8 @@ def _calc_cond_batch(model: BaseModel, conds: list[list[dict]], x_in: torch.Tens
 
             if 'model_function_wrapper' in model_options:
                 output = model_options['model_function_wrapper'](model.apply_model, {"input": input_x, "timestep": timestep_, "c": c, "cond_or_uncond": cond_or_uncond}).chunk(batch_chunks)
+            elif getattr(_model_call_batcher, "batcher", None) is not None and 'control' not in c:
+                output = _model_call_batcher.batcher.apply_model(model, input_x, timestep_, c).chunk(batch_chunks)
             else:
                 output = model.apply_model(input_x, timestep_, **c).chunk(batch_chunks)
 
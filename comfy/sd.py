@@ -5,6 +5,7 @@ from enum import Enum
 import logging
 
 from comfy import model_management
+from comfy.cli_args import args
 from comfy.utils import ProgressBar
 from .ldm.models.autoencoder import AutoencoderKL, AutoencodingEngine
 from .ldm.cascade.stage_a import StageA
@@ -23,6 +24,10 @@ import comfy.pixel_space_convert
 import yaml
 import math
 import os
+import collections
+import hashlib
+import threading
+import weakref
 
 import comfy.utils
 
@@ -30,6 +35,7 @@ from . import clip_vision
 from . import gligen
 from . import diffusers_convert
 from . import model_detection
+from . import weight_pool
 
 from . import sd1_clip
 from . import sdxl_clip
@@ -98,6 +104,109 @@ def load_lora_for_models(model, clip, lora, strength_model, strength_clip):
     return (new_modelpatcher, new_clip)
 
 
+def tokens_key(tokens):
+    """Hashable content of tokenizer output, the tensors in it (embeddings, images...) are hashed. None if it contains other objects."""
+    def key(obj):
+        if isinstance(obj, (int, float, str, bool, type(None))):
+            return obj
+        if isinstance(obj, torch.Tensor):
+            h = hashlib.blake2b(memoryview(obj.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy()), digest_size=16)
+            return ("__tensor__", str(obj.dtype), tuple(obj.shape), h.hexdigest())
+        if isinstance(obj, (list, tuple)):
+            return tuple(key(o) for o in obj)
+        if isinstance(obj, dict):
+            return ("__dict__",) + tuple(sorted((k, key(v)) for k, v in obj.items()))
+        raise TypeError("can't hash {} in tokens".format(type(obj).__name__))
+
+    try:
+        return key(tokens)
+    except TypeError:
+        return None
+
+def map_tensors(obj, func):
+    if isinstance(obj, torch.Tensor):
+        return func(obj)
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(map_tensors(o, func) for o in obj)
+    if isinstance(obj, dict):
+        return {k: map_tensors(v, func) for k, v in obj.items()}
+    return obj
+
+class TextEncoderCache:
+    """
+    LRU cache of text encoder outputs (cond, pooled output and extra outputs) on the CPU, so encoding
+    the same prompt again with the same text encoder skips the encoder, across workflows and even when
+    the node outputs upstream of the text encode changed. Keyed by the text encoder model, the patches
+    (LoRAs...) of the CLIP patcher, the clip options and the tokens.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.models_freed = False
+
+    def cache_key(self, clip: CLIP, tokens, unprojected):
+        """
+        None when the output can't be cached: disabled, hooks, object patches or model_options (custom
+        nodes changing the encoder through them) on the patcher or tokens that can't be hashed.
+        """
+        patcher = clip.patcher
+        if self.max_size <= 0 or patcher.forced_hooks is not None or len(patcher.hook_patches) > 0 or len(patcher.object_patches) > 0 or len(patcher.weight_wrapper_patches) > 0:
+            return None
+        if any(k != "transformer_options" or len(v) > 0 for k, v in patcher.model_options.items()):
+            return None
+        key = tokens_key(tokens)
+        if key is None:
+            return None
+        return (id(clip.cond_stage_model), patcher.patches_uuid, clip.layer_idx, unprojected, key)
+
+    def get(self, model, cache_key):
+        with self.lock:
+            entry = self.entries.get(cache_key, None)
+            if entry is None or entry[0]() is not model:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(cache_key)
+            self.hits += 1
+            output = entry[1]
+        device = model_management.intermediate_device()
+        return map_tensors(output, lambda t: t.to(device))
+
+    def put(self, model, cache_key, output):
+        size = 0
+        def to_cpu(t):
+            nonlocal size
+            size += t.nelement() * t.element_size()
+            return t.detach().to("cpu", copy=True)
+        output = map_tensors(output, to_cpu)
+        if size > self.max_size:
+            return
+        with self.lock:
+            if self.models_freed:
+                self.models_freed = False
+                for k in [k for k, entry in self.entries.items() if entry[0]() is None]:
+                    self.size -= self.entries.pop(k)[2]
+            old = self.entries.pop(cache_key, None)
+            if old is not None:
+                self.size -= old[2]
+            self.entries[cache_key] = (weakref.ref(model, self.model_freed), output, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, old = self.entries.popitem(last=False)
+                self.size -= old[2]
+
+    def model_freed(self, ref):
+        self.models_freed = True
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "size": self.size, "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+text_encoder_cache = TextEncoderCache(int(args.text_encoder_cache_gb * (1024 ** 3)))
+
 class CLIP:
     def __init__(self, target=None, embedding_directory=None, no_init=False, tokenizer_data={}, parameters=0, state_dict=[], model_options={}):
         if no_init:
@@ -169,6 +278,7 @@ class CLIP:
         n.tokenizer_options = self.tokenizer_options.copy()
         n.use_clip_schedule = self.use_clip_schedule
         n.apply_hooks_to_conds = self.apply_hooks_to_conds
+        n.parent = self
         return n
 
     def get_ram_usage(self):
@@ -264,9 +374,17 @@ class CLIP:
         if return_pooled == "unprojected":
             self.cond_stage_model.set_clip_options({"projected_pooled": False})
 
-        self.load_model()
-        self.cond_stage_model.set_clip_options({"execution_device": self.patcher.load_device})
-        o = self.cond_stage_model.encode_token_weights(tokens)
+        cache_key = text_encoder_cache.cache_key(self, tokens, return_pooled == "unprojected")
+        o = None
+        if cache_key is not None:
+            o = text_encoder_cache.get(self.cond_stage_model, cache_key)
+
+        if o is None:
+            self.load_model()
+            self.cond_stage_model.set_clip_options({"execution_device": self.patcher.load_device})
+            o = self.cond_stage_model.encode_token_weights(tokens)
+            if cache_key is not None:
+                text_encoder_cache.put(self.cond_stage_model, cache_key, o)
         cond, pooled = o[:2]
         if return_dict:
             out = {"cond": cond, "pooled_output": pooled}
@@ -1300,11 +1418,16 @@ def load_checkpoint(config_path=None, ckpt_path=None, output_vae=True, output_cl
     return (model, clip, vae)
 
 def load_checkpoint_guess_config(ckpt_path, output_vae=True, output_clip=True, output_clipvision=False, embedding_directory=None, output_model=True, model_options={}, te_model_options={}):
-    sd, metadata = comfy.utils.load_torch_file(ckpt_path, return_metadata=True)
-    out = load_state_dict_guess_config(sd, output_vae, output_clip, output_clipvision, embedding_directory, output_model, model_options, te_model_options=te_model_options, metadata=metadata)
-    if out is None:
-        raise RuntimeError("ERROR: Could not detect model type of: {}\n{}".format(ckpt_path, model_detection_error_hint(ckpt_path, sd)))
-    return out
+    def load():
+        sd, metadata = comfy.utils.load_torch_file(ckpt_path, return_metadata=True)
+        out = load_state_dict_guess_config(sd, output_vae, output_clip, output_clipvision, embedding_directory, output_model, model_options, te_model_options=te_model_options, metadata=metadata)
+        if out is None:
+            raise RuntimeError("ERROR: Could not detect model type of: {}\n{}".format(ckpt_path, model_detection_error_hint(ckpt_path, sd)))
+        return out
+
+    # Each device worker (--multi-gpu) loads its own copy.
+    options = ("checkpoint", str(model_management.get_torch_device()), weight_pool.options_key(model_options), weight_pool.options_key(te_model_options), embedding_directory)
+    return weight_pool.weight_pool.load(ckpt_path, options, (output_model, output_clip, output_vae, output_clipvision), load)
 
 def load_state_dict_guess_config(sd, output_vae=True, output_clip=True, output_clipvision=False, embedding_directory=None, output_model=True, model_options={}, te_model_options={}, metadata=None):
     clip = None
@@ -1499,12 +1622,16 @@ def load_diffusion_model_state_dict(sd, model_options={}, metadata=None):
 
 
 def load_diffusion_model(unet_path, model_options={}):
-    sd, metadata = comfy.utils.load_torch_file(unet_path, return_metadata=True)
-    model = load_diffusion_model_state_dict(sd, model_options=model_options, metadata=metadata)
-    if model is None:
-        logging.error("ERROR UNSUPPORTED DIFFUSION MODEL {}".format(unet_path))
-        raise RuntimeError("ERROR: Could not detect model type of: {}\n{}".format(unet_path, model_detection_error_hint(unet_path, sd)))
-    return model
+    def load():
+        sd, metadata = comfy.utils.load_torch_file(unet_path, return_metadata=True, stream_sources=True)
+        model = load_diffusion_model_state_dict(sd, model_options=model_options, metadata=metadata)
+        if model is None:
+            logging.error("ERROR UNSUPPORTED DIFFUSION MODEL {}".format(unet_path))
+            raise RuntimeError("ERROR: Could not detect model type of: {}\n{}".format(unet_path, model_detection_error_hint(unet_path, sd)))
+        return (model,)
+
+    options = ("diffusion_model", str(model_management.get_torch_device()), weight_pool.options_key(model_options))
+    return weight_pool.weight_pool.load(unet_path, options, (True,), load)[0]
 
 def load_unet(unet_path, dtype=None):
     logging.warning("The load_unet function has been deprecated and will be removed please switch to: load_diffusion_model")
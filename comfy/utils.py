@@ -30,6 +30,10 @@ from torch.nn.functional import interpolate
 from einops import rearrange
 from comfy.cli_args import args
 import json
+import glob
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 
 MMAP_TORCH_FILES = args.mmap_torch_files
 DISABLE_MMAP = args.disable_mmap
@@ -55,29 +59,111 @@ if hasattr(torch.serialization, "add_safe_globals"):  # TODO: this was added in
 else:
     logging.info("Warning, you are using an old pytorch version and some ckpt/pt files might be loaded unsafely. Upgrading to 2.4 or above is recommended.")
 
-def load_torch_file(ckpt, safe_load=False, device=None, return_metadata=False):
+SHARD_FILE_PATTERN = re.compile(r'-\d{5}-of-(\d{5})\.safetensors$', re.IGNORECASE)
+
+def get_sharded_safetensors_files(path):
+    """
+    Returns the shard files of a sharded safetensors model or None if path isn't one. path can be the
+    model directory (as listed by folder_paths.filter_sharded_models) or its *.safetensors.index.json,
+    a single *-00001-of-00004.safetensors shard loads as a file of its own.
+    """
+    index_file = None
+    if os.path.isdir(path):
+        index_files = sorted(glob.glob(os.path.join(glob.escape(path), "*.safetensors.index.json")))
+        if len(index_files) > 0:
+            index_file = index_files[0]
+        else:
+            shards = sorted(f for f in os.listdir(path) if SHARD_FILE_PATTERN.search(f))
+            return [os.path.join(path, f) for f in shards] if len(shards) > 0 else None
+    elif path.lower().endswith(".safetensors.index.json"):
+        index_file = path
+    else:
+        return None
+
+    with open(index_file, "r", encoding="utf-8") as f:
+        weight_map = json.load(f).get("weight_map", {})
+    directory = os.path.dirname(index_file)
+    return [os.path.join(directory, f) for f in sorted(set(weight_map.values()))]
+
+def safetensors_load_error(e, ckpt):
+    if len(e.args) > 0 and isinstance(e.args[0], str):
+        message = e.args[0]
+        if "HeaderTooLarge" in message:
+            return ValueError("{}\n\nFile path: {}\n\nThe safetensors file is corrupt or invalid. Make sure this is actually a safetensors file and not a ckpt or pt or other filetype.".format(message, ckpt))
+        if "MetadataIncompleteBuffer" in message:
+            return ValueError("{}\n\nFile path: {}\n\nThe safetensors file is corrupt/incomplete. Check the file size and make sure you have copied/downloaded it correctly.".format(message, ckpt))
+    return e
+
+def load_sharded_safetensors(shard_files, device=None, dtype=None, return_metadata=False, max_workers=None, stream_sources=False):
+    """
+    Loads the shards of a model in parallel threads. Each shard is memory mapped and its tensors are
+    converted to dtype/device one at a time, so the peak RAM usage is one tensor instead of the
+    whole model when loading to the GPU or to another dtype. stream_sources is the same as for
+    load_torch_file.
+    """
     if device is None:
         device = torch.device("cpu")
+    if max_workers is None:
+        # Reading shards from network storage is I/O bound, so this doesn't follow the cpu count.
+        max_workers = min(len(shard_files), 8)
+
+    def load_shard(shard_file):
+        out = {}
+        try:
+            with safetensors.safe_open(shard_file, framework="pt", device="cpu") as f:
+                for k in f.keys():
+                    tensor = f.get_tensor(k)
+                    if dtype is not None or device.type != "cpu":
+                        tensor = tensor.to(device=device, dtype=dtype)
+                    elif DISABLE_MMAP and not stream_sources:
+                        tensor = tensor.to(device=device, copy=True)
+                    out[k] = tensor
+                metadata = f.metadata()
+            if stream_sources and dtype is None and device.type == "cpu":
+                set_safetensors_sources(out, shard_file)
+            return out, metadata
+        except Exception as e:
+            raise safetensors_load_error(e, shard_file)
+
+    sd = {}
     metadata = None
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix="load_shard") as executor:
+        for shard_sd, shard_metadata in executor.map(load_shard, shard_files):
+            if metadata is None:
+                metadata = shard_metadata
+            for k in shard_sd:
+                if k in sd:
+                    logging.warning("Duplicate key {} in the shards of {}".format(k, os.path.dirname(shard_files[0])))
+            sd.update(shard_sd)
+    return (sd, metadata) if return_metadata else sd
+
+def load_torch_file(ckpt, safe_load=False, device=None, return_metadata=False, stream_sources=False):
+    """
+    stream_sources is for the diffusion model loaders: the safetensors tensors loaded to the cpu get
+    a safetensors_source for load_state_dict_streaming and stay memory mapped with --disable-mmap,
+    since load_state_dict_streaming reads them from the file instead of through the mapping.
+    """
+    if device is None:
+        device = torch.device("cpu")
+    metadata = None
+    shard_files = get_sharded_safetensors_files(ckpt)
+    if shard_files is not None:
+        return load_sharded_safetensors(shard_files, device=device, return_metadata=return_metadata, stream_sources=stream_sources)
     if ckpt.lower().endswith(".safetensors") or ckpt.lower().endswith(".sft"):
         try:
             with safetensors.safe_open(ckpt, framework="pt", device=device.type) as f:
                 sd = {}
                 for k in f.keys():
                     tensor = f.get_tensor(k)
-                    if DISABLE_MMAP:  # TODO: Not sure if this is the best way to bypass the mmap issues
+                    if DISABLE_MMAP and not stream_sources:  # TODO: Not sure if this is the best way to bypass the mmap issues
                         tensor = tensor.to(device=device, copy=True)
                     sd[k] = tensor
                 if return_metadata:
                     metadata = f.metadata()
+            if stream_sources and device.type == "cpu":
+                set_safetensors_sources(sd, ckpt)
         except Exception as e:
-            if len(e.args) > 0:
-                message = e.args[0]
-                if "HeaderTooLarge" in message:
-                    raise ValueError("{}\n\nFile path: {}\n\nThe safetensors file is corrupt or invalid. Make sure this is actually a safetensors file and not a ckpt or pt or other filetype.".format(message, ckpt))
-                if "MetadataIncompleteBuffer" in message:
-                    raise ValueError("{}\n\nFile path: {}\n\nThe safetensors file is corrupt/incomplete. Check the file size and make sure you have copied/downloaded it correctly.".format(message, ckpt))
-            raise e
+            raise safetensors_load_error(e, ckpt)
     else:
         torch_args = {}
         if MMAP_TORCH_FILES:
@@ -100,6 +186,84 @@ def load_torch_file(ckpt, safe_load=False, device=None, return_metadata=False):
                 sd = pl_sd
     return (sd, metadata) if return_metadata else sd
 
+def set_safetensors_sources(sd, safetensors_path):
+    """
+    Records the byte range in safetensors_path of each memory mapped tensor of sd so
+    load_state_dict_streaming can read it from the file instead of through the mapping. The
+    tensor version and data pointer are recorded too: a tensor modified in place since then
+    isn't read from the file again.
+    """
+    header = safetensors_header(safetensors_path)
+    if header is None:
+        return
+    data_start = 8 + len(header)
+    for k, v in json.loads(header).items():
+        tensor = sd.get(k, None)
+        if tensor is not None and k != "__metadata__":
+            start, end = v["data_offsets"]
+            tensor.safetensors_source = (safetensors_path, data_start + start, data_start + end, tensor._version, tensor.data_ptr())
+
+def read_safetensors_source(tensor, files):
+    """A copy of a tensor with a safetensors_source read from the file, files caches the open file objects."""
+    source = getattr(tensor, "safetensors_source", None)
+    if source is None:
+        return tensor
+    path, start, end, version, data_ptr = source
+    if tensor._version != version or tensor.data_ptr() != data_ptr or tensor.nelement() * tensor.element_size() != end - start:
+        # Changed since it was loaded (in place conversion...), the file doesn't have this data.
+        return tensor
+    out = torch.empty(tensor.shape, dtype=tensor.dtype)
+    if end > start:
+        f = files.get(path, None)
+        if f is None:
+            f = open(path, "rb")
+            files[path] = f
+        f.seek(start)
+        if f.readinto(memoryview(out.reshape(-1).view(torch.uint8).numpy())) != end - start:
+            return tensor
+    return out
+
+def load_state_dict_streaming(module, state_dict, strict=False):
+    """
+    Same as module.load_state_dict(state_dict, strict) but the weights of each layer are only read
+    from their safetensors file (see set_safetensors_sources) right before that layer loads them and
+    are freed right after. With --disable-mmap this replaces the copy of the whole file in RAM, so
+    loading peaks at the model plus its largest layer instead of twice the model. With mmap the file
+    goes through the page cache either way and the peak isn't lower.
+    """
+    files = {}
+
+    def stream_layer(load):
+        def _load_from_state_dict(state_dict, prefix, *args, **kwargs):
+            keys = [k for k in state_dict.keys() if k.startswith(prefix) and "." not in k[len(prefix):]]
+            for k in keys:
+                state_dict[k] = read_safetensors_source(state_dict[k], files)
+            try:
+                return load(state_dict, prefix, *args, **kwargs)
+            finally:
+                # The children of the layer only get the keys with their own prefix.
+                for k in keys:
+                    state_dict.pop(k, None)
+        return _load_from_state_dict
+
+    modules = list(module.modules())
+    # Instance overrides of _load_from_state_dict that were there before, restored after.
+    overrides = {}
+    try:
+        for m in modules:
+            if "_load_from_state_dict" in m.__dict__:
+                overrides[m] = m.__dict__["_load_from_state_dict"]
+            m._load_from_state_dict = stream_layer(m._load_from_state_dict)
+        return module.load_state_dict(state_dict, strict=strict)
+    finally:
+        for m in modules:
+            if m in overrides:
+                m._load_from_state_dict = overrides[m]
+            else:
+                m.__dict__.pop("_load_from_state_dict", None)
+        for f in files.values():
+            f.close()
+
 def save_torch_file(sd, ckpt, metadata=None):
     if metadata is not None:
         safetensors.torch.save_file(sd, ckpt, metadata=metadata)
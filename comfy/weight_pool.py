@@ -0,0 +1,115 @@
+import logging
+import os
+import threading
+import weakref
+
+from comfy.cli_args import args
+
+
+def file_key(path):
+    """Identifies the contents of a model file (or of the directory of a sharded model)."""
+    path = os.path.realpath(path)
+    st = os.stat(path)
+    return (path, st.st_mtime_ns, st.st_size)
+
+
+def options_key(options):
+    """Hashable version of a model_options dict, values that aren't plain data compare by repr (so by identity for functions)."""
+    if options is None:
+        return None
+    return tuple(sorted((k, repr(v)) for k, v in options.items()))
+
+
+def object_size(obj):
+    patcher = getattr(obj, "patcher", obj)
+    if hasattr(patcher, "model_size"):
+        return patcher.model_size()
+    return 0
+
+
+def share(obj):
+    """What a caller of the loader gets: a clone sharing the weights for models that support patches, the object itself otherwise."""
+    if hasattr(obj, "clone"):
+        return obj.clone()
+    return obj
+
+
+class WeightPool:
+    """
+    Process wide pool of the models loaded by the comfy.sd loaders, keyed by the model file and its
+    mtime plus the load options (dtype...). Loading a file that is already loaded hands out clones of
+    the same ModelPatcher/CLIP, so every loader and prompt shares one copy of the weights and patches
+    (LoRAs...) are applied to the clone as usual instead of to a second copy of the model.
+    The pool only holds weak references: an entry goes away with the last clone of its models.
+
+    Only used with --weight-pool: the VAE and CLIP vision models have no clones, every loader of the
+    file gets the same object, so modifying one in place changes it for the others.
+    """
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.bytes_saved = 0
+
+    def get(self, key, outputs):
+        """The shared outputs stored for key, None if one of the requested outputs wasn't loaded or was freed."""
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None:
+                return None
+            objects = []
+            for wanted, (loaded, ref) in zip(outputs, entry):
+                obj = None
+                if wanted:
+                    if not loaded:
+                        return None
+                    if ref is not None:
+                        obj = ref()
+                        if obj is None:
+                            return None
+                objects.append(obj)
+            saved = sum(object_size(o) for o in objects if o is not None)
+            self.hits += 1
+            self.bytes_saved += saved
+        logging.info("Sharing the already loaded weights of {} ({:.2f} MB)".format(key[0][0], saved / (1024 * 1024)))
+        return tuple(share(o) if o is not None else None for o in objects)
+
+    def put(self, key, outputs, objects):
+        with self.lock:
+            self.entries = {k: entry for k, entry in self.entries.items() if any(ref is not None and ref() is not None for _, ref in entry)}
+            self.entries[key] = tuple((wanted, weakref.ref(o) if o is not None else None) for wanted, o in zip(outputs, objects))
+        return tuple(share(o) if o is not None else None for o in objects)
+
+    def load(self, path, options, outputs, load_function):
+        """
+        Returns the result of load_function(), a tuple of models where outputs says which ones were
+        requested, for the model file at path. Shared with the previous load of the same file with
+        the same options if its models are still alive.
+        """
+        if not args.weight_pool:
+            return load_function()
+        try:
+            key = (file_key(path), options)
+        except OSError:
+            return load_function()
+        out = self.get(key, outputs)
+        if out is None:
+            out = self.put(key, outputs, load_function())
+        return out
+
+    def stats(self):
+        with self.lock:
+            models = []
+            for (file, options), entry in self.entries.items():
+                alive = [ref() for _, ref in entry if ref is not None]
+                alive = [o for o in alive if o is not None]
+                if len(alive) > 0:
+                    models.append({"path": file[0], "size": sum(object_size(o) for o in alive)})
+            return {"models": models, "hits": self.hits, "bytes_saved": self.bytes_saved}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+weight_pool = WeightPool()
@@ -1,9 +1,10 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
 from fractions import Fraction
-from typing import Optional, Union, IO
+from typing import Iterator, Optional, Union, IO
 import io
 import av
+import torch
 from .._util import VideoContainer, VideoCodec, VideoComponents
 
 class VideoInput(ABC):
@@ -34,6 +35,34 @@ class VideoInput(ABC):
         """
         pass
 
+    def iter_frames(
+        self,
+        chunk_size: int = 16,
+        start: int = 0,
+        end: Optional[int] = None,
+        stride: int = 1,
+        dtype: torch.dtype = torch.float32,
+        device: Optional[torch.device] = None,
+        background: bool = False,
+    ) -> Iterator[torch.Tensor]:
+        """
+        Iterates over the frames start, start + stride... (up to end, excluded) as (chunk_size, H, W, 3)
+        image tensors (the last one may be smaller), in [0, 1] or as 0-255 values for torch.uint8.
+
+        Default implementation slices the images of `get_components()`. Subclasses that can decode
+        frames on demand (e.g. `VideoFromFile`) override this so the whole video is never in memory,
+        background then decodes the next chunk on a thread while the current one is used.
+
+        Returns:
+            Iterator over chunks of frames
+        """
+        images = self.get_components().images[start:end:stride]
+        for i in range(0, images.shape[0], chunk_size):
+            chunk = images[i:i + chunk_size]
+            if dtype == torch.uint8 and chunk.dtype != torch.uint8:
+                chunk = (chunk * 255).round().clamp(0, 255)
+            yield chunk.to(device=device, dtype=dtype)
+
     def get_stream_source(self) -> Union[str, io.BytesIO]:
         """
         Get a streamable source for the video. This allows processing without
@@ -1,7 +1,8 @@
-from .video_types import VideoFromFile, VideoFromComponents
+from .video_types import VideoFromFile, VideoFromComponents, VideoEncoder
 
 __all__ = [
     # Implementations
     "VideoFromFile",
     "VideoFromComponents",
+    "VideoEncoder",
 ]
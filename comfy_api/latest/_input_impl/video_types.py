@@ -2,16 +2,23 @@ from __future__ import annotations
 from av.container import InputContainer
 from av.subtitles.stream import SubtitleStream
 from fractions import Fraction
-from typing import Optional
+from typing import Iterator, Optional
 from .._input import AudioInput, VideoInput
 import av
 import io
 import json
 import numpy as np
 import math
+import queue
+import threading
 import torch
 from .._util import VideoContainer, VideoCodec, VideoComponents
 
+# Frames decoded at a time when a whole video is converted to an images tensor.
+DECODE_CHUNK_SIZE = 16
+# Frames converted to uint8 at a time when encoding images.
+ENCODE_CHUNK_SIZE = 16
+
 
 def container_to_output_format(container_format: str | None) -> str | None:
     """
@@ -52,6 +59,229 @@ def get_open_write_kwargs(
     return open_kwargs
 
 
+def decode_video_chunks(container: InputContainer, chunk_size: int, start: int = 0, end: Optional[int] = None, stride: int = 1) -> Iterator[np.ndarray]:
+    """
+    Decodes the frames start, start + stride... (up to end, excluded) of the first video stream of
+    container, yielding them chunk_size at a time as uint8 (N, H, W, 3) arrays.
+    """
+    stream = container.streams.video[0]
+    # Frame and slice threading in the decoder, the decoded frames are the same.
+    stream.thread_type = "AUTO"
+    frames = []
+    for i, frame in enumerate(container.decode(stream)):
+        if end is not None and i >= end:
+            break
+        if i < start or (i - start) % stride != 0:
+            continue
+        frames.append(frame.to_ndarray(format='rgb24'))  # shape: (H, W, 3)
+        if len(frames) == chunk_size:
+            yield np.stack(frames)
+            frames = []
+    if len(frames) > 0:
+        yield np.stack(frames)
+
+
+def frames_to_tensor(frames: np.ndarray, dtype: torch.dtype, device: Optional[torch.device]) -> torch.Tensor:
+    """uint8 frames to an images tensor of dtype on device, converted there instead of going through float32 on the CPU."""
+    images = torch.from_numpy(frames).to(device=device)
+    if dtype == torch.uint8:
+        return images
+    return images.to(dtype).div_(255.0)
+
+
+def decode_audio(container: InputContainer) -> Optional[AudioInput]:
+    """The audio of container, None when it has no audio stream."""
+    audio = None
+    try:
+        container.seek(0)  # Reset the container to the beginning
+        for stream in container.streams:
+            if stream.type != 'audio':
+                continue
+            assert isinstance(stream, av.AudioStream)
+            audio_frames = []
+            for packet in container.demux(stream):
+                for frame in packet.decode():
+                    assert isinstance(frame, av.AudioFrame)
+                    audio_frames.append(frame.to_ndarray())  # shape: (channels, samples)
+            if len(audio_frames) > 0:
+                audio_data = np.concatenate(audio_frames, axis=1)  # shape: (channels, total_samples)
+                audio_tensor = torch.from_numpy(audio_data).unsqueeze(0)  # shape: (1, channels, total_samples)
+                audio = AudioInput({
+                    "waveform": audio_tensor,
+                    "sample_rate": int(stream.sample_rate) if stream.sample_rate else 1,
+                })
+    except StopIteration:
+        pass  # No audio stream
+    return audio
+
+
+def iterate_in_background(iterator: Iterator, max_ahead: int = 1) -> Iterator:
+    """Runs iterator on a thread, at most max_ahead items ahead of the consumer."""
+    items = queue.Queue(maxsize=max_ahead)
+    stop = threading.Event()
+    done = object()
+
+    def put(item, error=None) -> bool:
+        """False when the consumer stopped."""
+        while not stop.is_set():
+            try:
+                items.put((item, error), timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterator:
+                if not put(item):
+                    return
+            put(done)
+        except BaseException as e:
+            put(done, e)
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+
+    thread = threading.Thread(target=produce, daemon=True, name="video_decode")
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class VideoEncoder:
+    """
+    Encodes a video from images as they are produced, e.g. chunk by chunk by a VAE decode, instead
+    of from the whole images tensor at the end. Images are converted to uint8 on the device they are
+    on and only those are copied to the CPU, the frames are encoded and muxed on a background thread
+    while the next images are produced. At most max_pending chunks wait to be encoded.
+
+        with VideoEncoder(path, frame_rate, "h264", container_options={"movflags": "use_metadata_tags"}) as encoder:
+            for images in chunks:
+                encoder.write(images)
+    """
+    def __init__(
+        self,
+        path: str | io.BytesIO,
+        frame_rate: Fraction,
+        codec: str,
+        pix_fmt: str = "yuv420p",
+        bit_rate: Optional[int] = None,
+        codec_options: Optional[dict[str, str]] = None,
+        container_format: Optional[str] = None,
+        container_options: Optional[dict[str, str]] = None,
+        metadata: Optional[dict[str, str]] = None,
+        audio: Optional[AudioInput] = None,
+        max_pending: int = 2,
+    ):
+        self.frame_rate = frame_rate
+        self.audio = audio
+        open_kwargs = {}
+        if container_format is not None:
+            open_kwargs["format"] = container_format
+        if container_options is not None:
+            open_kwargs["options"] = container_options
+        self.output = av.open(path, mode="w", **open_kwargs)
+        # Add metadata before writing any streams
+        if metadata is not None:
+            for key, value in metadata.items():
+                self.output.metadata[key] = value
+
+        self.video_stream = self.output.add_stream(codec, rate=frame_rate)
+        self.video_stream.pix_fmt = pix_fmt
+        if bit_rate is not None:
+            self.video_stream.bit_rate = bit_rate
+        if codec_options is not None:
+            self.video_stream.options = codec_options
+        self.audio_stream: Optional[av.AudioStream] = None
+        if audio is not None:
+            self.audio_stream = self.output.add_stream('aac', rate=int(audio['sample_rate']))
+
+        self.frame_count = 0
+        self.error: Optional[BaseException] = None
+        self.chunks = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self.encode, daemon=True, name="video_encode")
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, images: torch.Tensor):
+        """Queues images, a (N, H, W, C) tensor of floats in [0, 1] on any device, to be encoded."""
+        if self.error is not None:
+            raise self.error
+        if self.frame_count == 0:
+            self.video_stream.width = images.shape[2]
+            self.video_stream.height = images.shape[1]
+        for i in range(0, images.shape[0], ENCODE_CHUNK_SIZE):
+            frames = (images[i:i + ENCODE_CHUNK_SIZE, :, :, :3] * 255).clamp(0, 255).to(torch.uint8).cpu().numpy()  # shape: (N, H, W, 3)
+            self.chunks.put(frames)
+            self.frame_count += frames.shape[0]
+
+    def encode(self):
+        while True:
+            frames = self.chunks.get()
+            if frames is None:
+                return
+            if self.error is not None:
+                # Keep taking chunks so write doesn't block, they are dropped.
+                continue
+            try:
+                for img in frames:
+                    frame = av.VideoFrame.from_ndarray(img, format='rgb24')
+                    # The encoder converts the frame to the pix_fmt of the stream
+                    self.output.mux(self.video_stream.encode(frame))
+            except BaseException as e:
+                self.error = e
+
+    def close(self):
+        """Encodes the remaining frames and the audio and closes the file."""
+        self.chunks.put(None)
+        self.thread.join()
+        try:
+            if self.error is not None:
+                raise self.error
+
+            # Flush video
+            self.output.mux(self.video_stream.encode(None))
+
+            if self.audio_stream is not None:
+                audio_sample_rate = int(self.audio['sample_rate'])
+                waveform = self.audio['waveform']
+                waveform = waveform[:, :, :math.ceil((audio_sample_rate / self.frame_rate) * self.frame_count)]
+                frame = av.AudioFrame.from_ndarray(waveform.movedim(2, 1).reshape(1, -1).float().numpy(), format='flt', layout='mono' if waveform.shape[1] == 1 else 'stereo')
+                frame.sample_rate = audio_sample_rate
+                frame.pts = 0
+                self.output.mux(self.audio_stream.encode(frame))
+
+                # Flush encoder
+                self.output.mux(self.audio_stream.encode(None))
+        finally:
+            self.output.close()
+
+    def abort(self):
+        """Stops encoding, the file is left incomplete."""
+        self.error = self.error or RuntimeError("Video encoding was aborted")
+        self.chunks.put(None)
+        self.thread.join()
+        self.output.close()
+
+
 class VideoFromFile(VideoInput):
     """
     Class representing video input from a file.
@@ -198,43 +428,51 @@ class VideoFromFile(VideoInput):
         with av.open(self.__file, mode='r') as container:
             return container.format.name
 
-    def get_components_internal(self, container: InputContainer) -> VideoComponents:
-        # Get video frames
-        frames = []
-        for frame in container.decode(video=0):
-            img = frame.to_ndarray(format='rgb24')  # shape: (H, W, 3)
-            img = torch.from_numpy(img) / 255.0  # shape: (H, W, 3)
-            frames.append(img)
+    def iter_frames(
+        self,
+        chunk_size: int = 16,
+        start: int = 0,
+        end: Optional[int] = None,
+        stride: int = 1,
+        dtype: torch.dtype = torch.float32,
+        device: Optional[torch.device] = None,
+        background: bool = False,
+    ) -> Iterator[torch.Tensor]:
+        """
+        Decodes the frames chunk_size at a time as they are iterated over, see `VideoInput.iter_frames`.
+        Frames before start are decoded and skipped.
+        """
+        def decode():
+            if isinstance(self.__file, io.BytesIO):
+                self.__file.seek(0)
+            with av.open(self.__file, mode='r') as container:
+                yield from decode_video_chunks(container, chunk_size, start, end, stride)
+
+        chunks = decode()
+        if background:
+            chunks = iterate_in_background(chunks)
+        for frames in chunks:
+            yield frames_to_tensor(frames, dtype, device)
 
-        images = torch.stack(frames) if len(frames) > 0 else torch.zeros(0, 3, 0, 0)
+    def get_components_internal(self, container: InputContainer) -> VideoComponents:
+        # Get video frames, kept as uint8 until the float32 images tensor is allocated once.
+        chunks = list(decode_video_chunks(container, DECODE_CHUNK_SIZE))
+        frame_count = sum(chunk.shape[0] for chunk in chunks)
+        if frame_count > 0:
+            images = torch.empty((frame_count,) + chunks[0].shape[1:], dtype=torch.float32)
+            i = 0
+            while len(chunks) > 0:
+                chunk = chunks.pop(0)
+                images[i:i + chunk.shape[0]].copy_(torch.from_numpy(chunk)).div_(255.0)
+                i += chunk.shape[0]
+        else:
+            images = torch.zeros(0, 3, 0, 0)
 
         # Get frame rate
         video_stream = next(s for s in container.streams if s.type == 'video')
         frame_rate = Fraction(video_stream.average_rate) if video_stream and video_stream.average_rate else Fraction(1)
 
-        # Get audio if available
-        audio = None
-        try:
-            container.seek(0)  # Reset the container to the beginning
-            for stream in container.streams:
-                if stream.type != 'audio':
-                    continue
-                assert isinstance(stream, av.AudioStream)
-                audio_frames = []
-                for packet in container.demux(stream):
-                    for frame in packet.decode():
-                        assert isinstance(frame, av.AudioFrame)
-                        audio_frames.append(frame.to_ndarray())  # shape: (channels, samples)
-                if len(audio_frames) > 0:
-                    audio_data = np.concatenate(audio_frames, axis=1)  # shape: (channels, total_samples)
-                    audio_tensor = torch.from_numpy(audio_data).unsqueeze(0)  # shape: (1, channels, total_samples)
-                    audio = AudioInput({
-                        "waveform": audio_tensor,
-                        "sample_rate": int(stream.sample_rate) if stream.sample_rate else 1,
-                    })
-        except StopIteration:
-            pass  # No audio stream
-
+        audio = decode_audio(container)
         metadata = container.metadata
         return VideoComponents(images=images, audio=audio, frame_rate=frame_rate, metadata=metadata)
 
@@ -264,14 +502,15 @@ class VideoFromFile(VideoInput):
                 reuse_streams = False
 
             if not reuse_streams:
-                components = self.get_components_internal(container)
-                video = VideoFromComponents(components)
-                return video.save_to(
-                    path,
-                    format=format,
-                    codec=codec,
-                    metadata=metadata
-                )
+                # Decoded frames go to the encoder chunk by chunk instead of through a whole images tensor.
+                video_stream = container.streams.video[0]
+                frame_rate = Fraction(video_stream.average_rate) if video_stream.average_rate else Fraction(1)
+                audio = decode_audio(container)
+                container.seek(0)
+                with VideoFromComponents.encoder(path, frame_rate, audio, format, codec, metadata) as encoder:
+                    for frames in decode_video_chunks(container, DECODE_CHUNK_SIZE):
+                        encoder.write(frames_to_tensor(frames, torch.float32, None))
+                return
 
             streams = container.streams
 
@@ -332,52 +571,36 @@ class VideoFromComponents(VideoInput):
         codec: VideoCodec = VideoCodec.AUTO,
         metadata: Optional[dict] = None
     ):
+        with self.encoder(path, self.__components.frame_rate, self.__components.audio, format, codec, metadata) as encoder:
+            encoder.write(self.__components.images)
+
+    @staticmethod
+    def encoder(
+        path: str | io.BytesIO,
+        frame_rate: Fraction,
+        audio: Optional[AudioInput] = None,
+        format: VideoContainer = VideoContainer.AUTO,
+        codec: VideoCodec = VideoCodec.AUTO,
+        metadata: Optional[dict] = None
+    ) -> VideoEncoder:
+        """
+        A `VideoEncoder` writing the video `save_to` writes, for nodes that save images as they are
+        produced instead of building the video from all of them first.
+        """
         if format != VideoContainer.AUTO and format != VideoContainer.MP4:
             raise ValueError("Only MP4 format is supported for now")
         if codec != VideoCodec.AUTO and codec != VideoCodec.H264:
             raise ValueError("Only H264 codec is supported for now")
-        extra_kwargs = {}
+        container_format = None
         if isinstance(format, VideoContainer) and format != VideoContainer.AUTO:
-            extra_kwargs["format"] = format.value
-        with av.open(path, mode='w', options={'movflags': 'use_metadata_tags'}, **extra_kwargs) as output:
-            # Add metadata before writing any streams
-            if metadata is not None:
-                for key, value in metadata.items():
-                    output.metadata[key] = json.dumps(value)
-
-            frame_rate = Fraction(round(self.__components.frame_rate * 1000), 1000)
-            # Create a video stream
-            video_stream = output.add_stream('h264', rate=frame_rate)
-            video_stream.width = self.__components.images.shape[2]
-            video_stream.height = self.__components.images.shape[1]
-            video_stream.pix_fmt = 'yuv420p'
-
-            # Create an audio stream
-            audio_sample_rate = 1
-            audio_stream: Optional[av.AudioStream] = None
-            if self.__components.audio:
-                audio_sample_rate = int(self.__components.audio['sample_rate'])
-                audio_stream = output.add_stream('aac', rate=audio_sample_rate)
-
-            # Encode video
-            for i, frame in enumerate(self.__components.images):
-                img = (frame * 255).clamp(0, 255).byte().cpu().numpy() # shape: (H, W, 3)
-                frame = av.VideoFrame.from_ndarray(img, format='rgb24')
-                frame = frame.reformat(format='yuv420p')  # Convert to YUV420P as required by h264
-                packet = video_stream.encode(frame)
-                output.mux(packet)
-
-            # Flush video
-            packet = video_stream.encode(None)
-            output.mux(packet)
-
-            if audio_stream and self.__components.audio:
-                waveform = self.__components.audio['waveform']
-                waveform = waveform[:, :, :math.ceil((audio_sample_rate / frame_rate) * self.__components.images.shape[0])]
-                frame = av.AudioFrame.from_ndarray(waveform.movedim(2, 1).reshape(1, -1).float().numpy(), format='flt', layout='mono' if waveform.shape[1] == 1 else 'stereo')
-                frame.sample_rate = audio_sample_rate
-                frame.pts = 0
-                output.mux(audio_stream.encode(frame))
-
-                # Flush encoder
-                output.mux(audio_stream.encode(None))
+            container_format = format.value
+        return VideoEncoder(
+            path,
+            Fraction(round(frame_rate * 1000), 1000),
+            'h264',
+            pix_fmt='yuv420p',
+            container_format=container_format,
+            container_options={'movflags': 'use_metadata_tags'},
+            metadata=None if metadata is None else {key: json.dumps(value) for key, value in metadata.items()},
+            audio=audio,
+        )
@@ -1238,6 +1238,8 @@ class Schema:
     """Flags a node as not idempotent; when True, the node will run and not reuse the cached outputs when identical inputs are provided on a different node in the graph."""
     enable_expand: bool=False
     """Flags a node as expandable, allowing NodeOutput to include 'expand' property."""
+    thread_safe: bool=False
+    """Flags a node as thread safe; when True and --parallel-node-workers is set, execute runs in a worker thread concurrently with independent nodes. Must not load models, sample or expand the graph."""
 
     def validate(self):
         '''Validate the schema:
@@ -1669,6 +1671,15 @@ class _ComfyNodeBaseInternal(_ComfyNodeInternal):
             cls.GET_SCHEMA()
         return cls._NOT_IDEMPOTENT
 
+    _THREAD_SAFE = None
+    @final
+    @classproperty
+    def THREAD_SAFE(cls):  # noqa
+        # Per class, a subclass doesn't get the value of the class it extends.
+        if "_THREAD_SAFE" not in cls.__dict__:
+            cls.GET_SCHEMA()
+        return cls._THREAD_SAFE
+
     @final
     @classmethod
     def INPUT_TYPES(cls, include_hidden=True, return_schema=False, live_inputs=None) -> dict[str, dict] | tuple[dict[str, dict], Schema, V3Data]:
@@ -1716,6 +1727,8 @@ class _ComfyNodeBaseInternal(_ComfyNodeInternal):
             cls._INPUT_IS_LIST = schema.is_input_list
         if cls._NOT_IDEMPOTENT is None:
             cls._NOT_IDEMPOTENT = schema.not_idempotent
+        if "_THREAD_SAFE" not in cls.__dict__:
+            cls._THREAD_SAFE = schema.thread_safe
 
         if cls._RETURN_TYPES is None:
             output = []
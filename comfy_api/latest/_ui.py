@@ -19,6 +19,7 @@ from PIL import Image as PILImage
 from PIL.PngImagePlugin import PngInfo
 
 import folder_paths
+import node_helpers
 
 # used for image preview
 from comfy.cli_args import args
@@ -143,16 +144,9 @@ class ImageSaveHelper:
         full_output_folder, filename, counter, subfolder, _ = folder_paths.get_save_image_path(
             filename_prefix, _get_directory_by_folder_type(folder_type), images[0].shape[1], images[0].shape[0]
         )
-        results = []
         metadata = ImageSaveHelper._create_png_metadata(cls)
-        for batch_number, image_tensor in enumerate(images):
-            img = ImageSaveHelper._convert_tensor_to_pil(image_tensor)
-            filename_with_batch_num = filename.replace("%batch_num%", str(batch_number))
-            file = f"{filename_with_batch_num}_{counter:05}_.png"
-            img.save(os.path.join(full_output_folder, file), pnginfo=metadata, compress_level=compress_level)
-            results.append(SavedResult(file, subfolder, folder_type))
-            counter += 1
-        return results
+        files = node_helpers.save_png_images(images, full_output_folder, filename, counter, pnginfo=metadata, compress_level=compress_level)
+        return [SavedResult(file, subfolder, folder_type) for file in files]
 
     @staticmethod
     def get_save_images_ui(images, filename_prefix: str, cls: Type[ComfyNode] | None, compress_level=4) -> SavedImages:
@@ -1,9 +1,11 @@
-import bisect
 import gc
+import heapq
 import itertools
+import math
 import psutil
 import time
 import torch
+import weakref
 from typing import Sequence, Mapping, Dict
 from comfy_execution.graph import DynamicPrompt
 from abc import ABC, abstractmethod
@@ -11,6 +13,8 @@ from abc import ABC, abstractmethod
 import nodes
 
 from comfy_execution.graph_utils import is_link
+from comfy_execution.disk_cache import signature_digest
+from comfy_execution.fingerprint import fingerprint as fingerprint_object
 
 NODE_CLASS_CONTAINS_UNIQUE_ID: Dict[str, bool] = {}
 
@@ -60,8 +64,12 @@ def to_hashable(obj):
     elif isinstance(obj, Sequence):
         return frozenset(zip(itertools.count(), [to_hashable(i) for i in obj]))
     else:
-        # TODO - Support other objects like tensors?
-        return Unhashable()
+        # Tensors, dataclasses, objects implementing __comfy_hash__ or with a registered
+        # fingerprinter are hashed by content.
+        fingerprint = fingerprint_object(obj)
+        if fingerprint is None:
+            return Unhashable()
+        return to_hashable(fingerprint)
 
 class CacheKeySetID(CacheKeySet):
     def __init__(self, dynprompt, node_ids, is_changed_cache):
@@ -78,11 +86,22 @@ class CacheKeySetID(CacheKeySet):
             self.keys[node_id] = (node_id, node["class_type"])
             self.subcache_keys[node_id] = (node_id, node["class_type"])
 
+# Per prompt memo of node signatures shared by every cache (and subcache) keyed on the
+# same DynamicPrompt so each node is only hashed once per prompt.
+PROMPT_SIGNATURES: "weakref.WeakKeyDictionary[DynamicPrompt, Dict[type, Dict[str, object]]]" = weakref.WeakKeyDictionary()
+
+# Hashable immediate signature and digest last computed for each node id. Lets a resubmitted
+# graph reuse digests without re-serializing and re-hashing nodes that didn't change.
+SIGNATURE_MEMO_MAX_SIZE = 16384
+
 class CacheKeySetInputSignature(CacheKeySet):
+    signature_memo: Dict[tuple, tuple] = {}
+
     def __init__(self, dynprompt, node_ids, is_changed_cache):
         super().__init__(dynprompt, node_ids, is_changed_cache)
         self.dynprompt = dynprompt
         self.is_changed_cache = is_changed_cache
+        self.signatures = PROMPT_SIGNATURES.setdefault(dynprompt, {}).setdefault(type(self), {})
 
     def include_node_id_in_input(self) -> bool:
         return False
@@ -97,54 +116,78 @@ class CacheKeySetInputSignature(CacheKeySet):
             self.keys[node_id] = await self.get_node_signature(self.dynprompt, node_id)
             self.subcache_keys[node_id] = (node_id, node["class_type"])
 
+    # Signatures are computed bottom-up as a digest over the node's own inputs and the digests
+    # of the nodes it links to, so every node in the graph is hashed exactly once no matter
+    # how many descendants share it. Nodes whose signature can't be compared (NaN IS_CHANGED,
+    # unhashable inputs, missing nodes, cycles) get a unique Unhashable key that only matches
+    # itself, and so does everything downstream of them.
     async def get_node_signature(self, dynprompt, node_id):
-        signature = []
-        ancestors, order_mapping = self.get_ordered_ancestry(dynprompt, node_id)
-        signature.append(await self.get_immediate_node_signature(dynprompt, node_id, order_mapping))
-        for ancestor_id in ancestors:
-            signature.append(await self.get_immediate_node_signature(dynprompt, ancestor_id, order_mapping))
-        return to_hashable(signature)
-
-    async def get_immediate_node_signature(self, dynprompt, node_id, ancestor_order_mapping):
+        signatures = self.signatures
+        if node_id in signatures:
+            return signatures[node_id]
+        stack = [node_id]
+        expanded = set()
+        while len(stack) > 0:
+            current = stack[-1]
+            if current in signatures:
+                stack.pop()
+                continue
+            pending = [ancestor_id for ancestor_id in self.get_linked_ancestors(dynprompt, current) if ancestor_id not in signatures]
+            if len(pending) > 0:
+                if current in expanded:
+                    # We came back to this node with unresolved ancestors, so it is part of a cycle.
+                    signatures[current] = Unhashable()
+                    stack.pop()
+                else:
+                    expanded.add(current)
+                    stack.extend(pending)
+                continue
+            stack.pop()
+            signatures[current] = await self.get_immediate_node_signature(dynprompt, current, signatures)
+        return signatures[node_id]
+
+    def get_linked_ancestors(self, dynprompt, node_id):
+        if not dynprompt.has_node(node_id):
+            return []
+        inputs = dynprompt.get_node(node_id)["inputs"]
+        return [inputs[key][0] for key in sorted(inputs.keys()) if is_link(inputs[key])]
+
+    async def get_immediate_node_signature(self, dynprompt, node_id, signatures):
         if not dynprompt.has_node(node_id):
             # This node doesn't exist -- we can't cache it.
-            return [float("NaN")]
+            return Unhashable()
         node = dynprompt.get_node(node_id)
         class_type = node["class_type"]
         class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
-        signature = [class_type, await self.is_changed_cache.get(node_id)]
-        if self.include_node_id_in_input() or (hasattr(class_def, "NOT_IDEMPOTENT") and class_def.NOT_IDEMPOTENT) or include_unique_id_in_input(class_type):
-            signature.append(node_id)
+        is_changed = await self.is_changed_cache.get(node_id)
+        include_node_id = self.include_node_id_in_input() or (hasattr(class_def, "NOT_IDEMPOTENT") and class_def.NOT_IDEMPOTENT) or include_unique_id_in_input(class_type)
         inputs = node["inputs"]
+        for key in inputs:
+            if is_link(inputs[key]) and isinstance(signatures[inputs[key][0]], Unhashable):
+                return Unhashable()
+
+        signature = [class_type, is_changed]
+        if include_node_id:
+            signature.append(node_id)
         for key in sorted(inputs.keys()):
             if is_link(inputs[key]):
                 (ancestor_id, ancestor_socket) = inputs[key]
-                ancestor_index = ancestor_order_mapping[ancestor_id]
-                signature.append((key,("ANCESTOR", ancestor_index, ancestor_socket)))
+                signature.append((key, ("ANCESTOR", signatures[ancestor_id], ancestor_socket)))
             else:
                 signature.append((key, inputs[key]))
-        return signature
-
-    # This function returns a list of all ancestors of the given node. The order of the list is
-    # deterministic based on which specific inputs the ancestor is connected by.
-    def get_ordered_ancestry(self, dynprompt, node_id):
-        ancestors = []
-        order_mapping = {}
-        self.get_ordered_ancestry_internal(dynprompt, node_id, ancestors, order_mapping)
-        return ancestors, order_mapping
-
-    def get_ordered_ancestry_internal(self, dynprompt, node_id, ancestors, order_mapping):
-        if not dynprompt.has_node(node_id):
-            return
-        inputs = dynprompt.get_node(node_id)["inputs"]
-        input_keys = sorted(inputs.keys())
-        for key in input_keys:
-            if is_link(inputs[key]):
-                ancestor_id = inputs[key][0]
-                if ancestor_id not in order_mapping:
-                    ancestors.append(ancestor_id)
-                    order_mapping[ancestor_id] = len(ancestors) - 1
-                    self.get_ordered_ancestry_internal(dynprompt, ancestor_id, ancestors, order_mapping)
+        signature = to_hashable(signature)
+
+        memo_key = (node_id, type(self))
+        memo = self.signature_memo.get(memo_key, None)
+        if memo is not None and memo[0] == signature:
+            return memo[1]
+        digest = signature_digest(signature)
+        if digest is None:
+            return Unhashable()
+        if len(self.signature_memo) >= SIGNATURE_MEMO_MAX_SIZE:
+            self.signature_memo.clear()
+        self.signature_memo[memo_key] = (signature, digest)
+        return digest
 
 class BasicCache:
     def __init__(self, key_class):
@@ -154,6 +197,18 @@ class BasicCache:
         self.cache_key_set: CacheKeySet
         self.cache = {}
         self.subcaches = {}
+        self.disk_cache = None
+        self.shared_caches = []
+
+    def set_disk_cache(self, disk_cache):
+        self.disk_cache = disk_cache
+
+    def set_shared_caches(self, caches):
+        """
+        The output caches of the other executors of a prompt batch: their entries for the same input
+        signature (the loaders...) are used instead of running the node again in this executor.
+        """
+        self.shared_caches = caches
 
     async def set_prompt(self, dynprompt, node_ids, is_changed_cache):
         self.dynprompt = dynprompt
@@ -176,8 +231,14 @@ class BasicCache:
             if key not in preserve_keys:
                 to_remove.append(key)
         for key in to_remove:
+            self._spill(key)
             del self.cache[key]
 
+    def _spill(self, key):
+        """Writes an entry evicted from memory to the disk tier, when there is one."""
+        if self.disk_cache is not None and key is not None:
+            self.disk_cache.store(key, self.cache[key])
+
     def _clean_subcaches(self):
         preserve_subcaches = set(self.cache_key_set.get_used_subcache_keys())
 
@@ -207,6 +268,16 @@ class BasicCache:
         cache_key = self.cache_key_set.get_data_key(node_id)
         if cache_key in self.cache:
             return self.cache[cache_key]
+        shared = next((cache for cache in self.shared_caches if cache_key in cache.cache), None) if cache_key is not None else None
+        if shared is not None:
+            value = shared.cache[cache_key]
+            self.cache[cache_key] = value
+            return value
+        elif self.disk_cache is not None and cache_key is not None:
+            value = self.disk_cache.load(cache_key)
+            if value is not None:
+                self.cache[cache_key] = value
+            return value
         else:
             return None
 
@@ -215,6 +286,7 @@ class BasicCache:
         subcache = self.subcaches.get(subcache_key, None)
         if subcache is None:
             subcache = BasicCache(self.key_class)
+            subcache.set_disk_cache(self.disk_cache)
             self.subcaches[subcache_key] = subcache
         await subcache.set_prompt(self.dynprompt, children_ids, self.is_changed_cache)
         return subcache
@@ -287,6 +359,9 @@ class NullCache:
     def poll(self, **kwargs):
         pass
 
+    def set_shared_caches(self, caches):
+        pass
+
     def get(self, node_id):
         return None
 
@@ -316,6 +391,7 @@ class LRUCache(BasicCache):
             self.min_generation += 1
             to_remove = [key for key in self.cache if self.used_generation[key] < self.min_generation]
             for key in to_remove:
+                self._spill(key)
                 del self.cache[key]
                 del self.used_generation[key]
                 if key in self.children:
@@ -364,22 +440,142 @@ RAM_CACHE_DEFAULT_RAM_USAGE = 0.1
 
 RAM_CACHE_OLD_WORKFLOW_OOM_MULTIPLIER = 1.3
 
+#Storage kinds that live in host RAM and are scored at a 50% discount as they are likely
+#to be high value intermediates. GPU storage is reported but doesn't count towards RAM.
+
+RAM_CACHE_HOST_STORAGE = ("cpu", "pinned", "mmap")
+RAM_CACHE_TENSOR_DISCOUNT = 0.5
+
+def _tensor_storage(tensor):
+    if tensor.device.type != "cpu":
+        kind = tensor.device.type
+    else:
+        kind = "cpu"
+    try:
+        storage = tensor.untyped_storage()
+        if kind == "cpu":
+            if getattr(storage, "filename", None) is not None:
+                kind = "mmap"
+            elif tensor.is_pinned():
+                kind = "pinned"
+        return (tensor.device, storage.data_ptr()), kind, storage.nbytes()
+    except Exception:
+        #Tensor subclasses (quantized weights...) may not have a plain storage.
+        return ("tensor", id(tensor)), kind, tensor.numel() * tensor.element_size()
+
+def estimate_memory_usage(outputs):
+    """
+    Returns the bytes held by a cache entry's outputs by storage kind (cpu, pinned, mmap,
+    cuda...) plus "objects" for things like models that report their own get_ram_usage().
+    Tensor storages and objects referenced several times are only counted once.
+    """
+    usage = {}
+    seen = set()
+    def scan(obj):
+        if isinstance(obj, (str, bytes, int, float, bool, type(None))):
+            return
+        if id(obj) in seen:
+            return
+        seen.add(id(obj))
+        if isinstance(obj, torch.Tensor):
+            storage_key, kind, nbytes = _tensor_storage(obj)
+            if storage_key not in seen:
+                seen.add(storage_key)
+                usage[kind] = usage.get(kind, 0) + nbytes
+        elif isinstance(obj, Mapping):
+            for v in obj.values():
+                scan(v)
+        elif isinstance(obj, (list, tuple)):
+            for v in obj:
+                scan(v)
+        elif hasattr(obj, "get_ram_usage"):
+            usage["objects"] = usage.get("objects", 0) + obj.get_ram_usage()
+    scan(outputs)
+    return usage
+
 class RAMPressureCache(LRUCache):
 
     def __init__(self, key_class):
         super().__init__(key_class, 0)
         self.timestamps = {}
+        # cache_key -> (node_id, class_type, usage by storage kind, ram usage score)
+        self.entry_usage = {}
+        # Lazily invalidated max-heap of eviction candidates, an item is stale when its
+        # score/timestamp no longer match the entry (it was touched or removed since).
+        self.eviction_heap = []
+        self.heap_counter = itertools.count()
 
     def clean_unused(self):
         self._clean_subcaches()
 
+    def _oom_priority(self, key):
+        #OOM score is RAM_CACHE_OLD_WORKFLOW_OOM_MULTIPLIER ** (generation - used_generation) * ram_usage.
+        #The current generation scales every score by the same amount so the order only
+        #depends on when the entry was last used, which is what lets us keep a heap.
+        return math.log(self.entry_usage[key][3]) - self.used_generation[key] * math.log(RAM_CACHE_OLD_WORKFLOW_OOM_MULTIPLIER)
+
+    def _push(self, key):
+        if key not in self.entry_usage or key not in self.cache:
+            return
+        #In the case where we have no information on the node ram usage at all,
+        #break OOM score ties on the last touch timestamp (pure LRU)
+        priority = self._oom_priority(key)
+        heapq.heappush(self.eviction_heap, (-priority, self.timestamps[key], next(self.heap_counter), key))
+        if len(self.eviction_heap) > 4 * len(self.cache) + 64:
+            self._rebuild_heap()
+
+    def _rebuild_heap(self):
+        self.eviction_heap = [(-self._oom_priority(key), self.timestamps[key], next(self.heap_counter), key) for key in self.cache if key in self.entry_usage]
+        heapq.heapify(self.eviction_heap)
+
+    def _account(self, node_id, key, value):
+        usage = estimate_memory_usage(value.outputs)
+        ram_usage = RAM_CACHE_DEFAULT_RAM_USAGE + usage.get("objects", 0)
+        for kind in RAM_CACHE_HOST_STORAGE:
+            ram_usage += usage.get(kind, 0) * RAM_CACHE_TENSOR_DISCOUNT
+        class_type = self.dynprompt.get_node(node_id)["class_type"] if self.dynprompt.has_node(node_id) else None
+        self.entry_usage[key] = (node_id, class_type, usage, ram_usage)
+        self._push(key)
+
+    def _mark_used(self, node_id):
+        super()._mark_used(node_id)
+        cache_key = self.cache_key_set.get_data_key(node_id)
+        if cache_key is not None and cache_key in self.cache:
+            self._push(cache_key)
+
     def set(self, node_id, value):
-        self.timestamps[self.cache_key_set.get_data_key(node_id)] = time.time()
+        key = self.cache_key_set.get_data_key(node_id)
+        self.timestamps[key] = time.time()
         super().set(node_id, value)
+        self._account(node_id, key, value)
 
     def get(self, node_id):
-        self.timestamps[self.cache_key_set.get_data_key(node_id)] = time.time()
-        return super().get(node_id)
+        key = self.cache_key_set.get_data_key(node_id)
+        self.timestamps[key] = time.time()
+        value = super().get(node_id)
+        if value is not None and key not in self.entry_usage:
+            #Entries promoted from the disk tier skip set()
+            self._account(node_id, key, value)
+        return value
+
+    def _remove(self, key):
+        del self.cache[key]
+        self.entry_usage.pop(key, None)
+        self.timestamps.pop(key, None)
+
+    def memory_usage(self):
+        """
+        Returns the estimated bytes held by every cached node output, largest first, along
+        with totals per storage kind. Safe to call from other threads.
+        """
+        entries = []
+        totals = {}
+        for key, (node_id, class_type, usage, ram_usage) in dict(self.entry_usage).items():
+            entries.append({"node_id": node_id, "class_type": class_type, "bytes": usage, "total": sum(usage.values()), "ram_score": ram_usage})
+            for kind, nbytes in usage.items():
+                totals[kind] = totals.get(kind, 0) + nbytes
+        entries.sort(key=lambda x: x["total"], reverse=True)
+        return {"totals": totals, "nodes": entries}
 
     def poll(self, ram_headroom):
         def _ram_gb():
@@ -391,33 +587,10 @@ class RAMPressureCache(LRUCache):
         if _ram_gb() > ram_headroom:
             return
 
-        clean_list = []
-
-        for key, (outputs, _), in self.cache.items():
-            oom_score =  RAM_CACHE_OLD_WORKFLOW_OOM_MULTIPLIER ** (self.generation - self.used_generation[key])
-
-            ram_usage = RAM_CACHE_DEFAULT_RAM_USAGE
-            def scan_list_for_ram_usage(outputs):
-                nonlocal ram_usage
-                if outputs is None:
-                    return
-                for output in outputs:
-                    if isinstance(output, list):
-                        scan_list_for_ram_usage(output)
-                    elif isinstance(output, torch.Tensor) and output.device.type == 'cpu':
-                        #score Tensors at a 50% discount for RAM usage as they are likely to
-                        #be high value intermediates
-                        ram_usage += (output.numel() * output.element_size()) * 0.5
-                    elif hasattr(output, "get_ram_usage"):
-                        ram_usage += output.get_ram_usage()
-            scan_list_for_ram_usage(outputs)
-
-            oom_score *= ram_usage
-            #In the case where we have no information on the node ram usage at all,
-            #break OOM score ties on the last touch timestamp (pure LRU)
-            bisect.insort(clean_list, (oom_score, self.timestamps[key], key))
-
-        while _ram_gb() < ram_headroom * RAM_CACHE_HYSTERESIS and clean_list:
-            _, _, key = clean_list.pop()
-            del self.cache[key]
+        while _ram_gb() < ram_headroom * RAM_CACHE_HYSTERESIS and self.eviction_heap:
+            neg_priority, timestamp, _, key = heapq.heappop(self.eviction_heap)
+            if key not in self.cache or key not in self.entry_usage or timestamp != self.timestamps.get(key, None) or -neg_priority != self._oom_priority(key):
+                continue
+            self._spill(key)
+            self._remove(key)
             gc.collect()
@@ -0,0 +1,133 @@
+import os
+import weakref
+from typing import Callable, Dict, List, Optional
+
+import folder_paths
+from comfy_execution.fair_queue import item_priority
+
+# Number of queued prompts (in queue order) considered when picking one for a worker.
+SCHEDULER_LOOKAHEAD = 8
+
+
+def prompt_model_files(prompt) -> frozenset:
+    """Model files referenced by a prompt: string inputs with a model file extension (checkpoints, LoRAs, VAEs...)."""
+    files = set()
+    for node in prompt.values():
+        for value in node.get("inputs", {}).values():
+            if isinstance(value, str) and os.path.splitext(value)[1].lower() in folder_paths.supported_pt_extensions:
+                files.add(value)
+    return frozenset(files)
+
+
+def _default_loaded_models(device):
+    import comfy.model_management
+    return comfy.model_management.loaded_models_on_device(device)
+
+
+class DeviceWorker:
+    """
+    A prompt worker executing on one device. Remembers which models were on its device after it ran
+    prompts using a model file, the file counts as loaded as long as one of those models still is.
+    """
+    def __init__(self, device, loaded_models: Callable[[object], List] = _default_loaded_models):
+        self.device = device
+        self.loaded_models = loaded_models
+        self.idle = False
+        # Replaced instead of modified so other workers can read it while scheduling.
+        self.model_files = {}
+
+    def record_prompt(self, model_files):
+        loaded = self.loaded_models(self.device)
+        updated = {f: models for f, models in self.model_files.items() if len(models) > 0}
+        for f in model_files:
+            updated[f] = weakref.WeakSet(loaded)
+        self.model_files = updated
+
+    def affinity(self, model_files) -> int:
+        """Number of the model files that are already loaded on this worker's device."""
+        model_files = [self.model_files.get(f, None) for f in model_files]
+        model_files = [models for models in model_files if models]
+        if len(model_files) == 0:
+            return 0
+        loaded = set(id(m) for m in self.loaded_models(self.device))
+        return sum(1 for models in model_files if any(id(m) in loaded for m in models))
+
+
+class DeviceScheduler:
+    """
+    Hands queued prompts to a pool of DeviceWorkers (one executor per device), preferring the worker
+    whose device already has the models of the prompt loaded so they don't get loaded on every device.
+    With a single worker this reorders the queue so prompts using the loaded models run first instead
+    of swapping models back and forth (--model-affinity-window). With a fairness_window, a prompt is
+    passed over by at most that many prompts queued after it.
+    """
+    def __init__(self, workers: List[DeviceWorker], lookahead=SCHEDULER_LOOKAHEAD, fairness_window: Optional[int] = None):
+        self.workers = workers
+        self.lookahead = lookahead
+        self.fairness_window = fairness_window
+        # prompt_id -> number of times a prompt queued after it was run first.
+        self.passed_over: Dict[str, int] = {}
+        self.prompts = 0
+        self.reordered = 0
+        self.swaps_avoided = 0
+        self.model_loads = 0
+
+    def select(self, worker: DeviceWorker, queue) -> Optional[tuple]:
+        """
+        Called by PromptQueue.get with the queued items in the order they would run. Returns the queued
+        item worker should run, or None when every candidate is better suited for another idle worker.
+        """
+        # Prompts don't get ahead of a higher priority class.
+        priority = item_priority(queue[0])
+        candidates = [item for item in queue[:self.lookahead] if item_priority(item) == priority]
+        choices = candidates
+        if self.fairness_window is not None:
+            starved = [item for item in candidates if self.passed_over.get(item[1], 0) >= self.fairness_window]
+            if len(starved) > 0:
+                choices = starved[:1]
+
+        best = None
+        for item in choices:
+            model_files = prompt_model_files(item[2])
+            score = worker.affinity(model_files)
+            if any(w is not worker and w.idle and w.affinity(model_files) > score for w in self.workers):
+                continue
+            # Ties keep the queue order.
+            if best is None or score > best[0]:
+                best = (score, item, len(model_files))
+        if best is None:
+            return None
+        score, item, file_count = best
+        worker.idle = False
+        index = next(i for i, x in enumerate(candidates) if x is item)
+
+        self.prompts += 1
+        if score < file_count:
+            self.model_loads += 1
+        if index > 0:
+            self.reordered += 1
+            if worker.affinity(prompt_model_files(candidates[0][2])) < score:
+                self.swaps_avoided += 1
+        passed_over = {}
+        for other in candidates[:index]:
+            passed_over[other[1]] = self.passed_over.get(other[1], 0) + 1
+        for other in candidates[index + 1:]:
+            if other[1] in self.passed_over:
+                passed_over[other[1]] = self.passed_over[other[1]]
+        self.passed_over = passed_over
+        return item
+
+    def stats(self) -> Dict[str, int]:
+        """
+        How many prompts were run, how many ran before prompts queued ahead of them, how many of those
+        reused the loaded models when the prompt next in queue order would have loaded others, and how
+        many prompts had to load at least one of their model files.
+        """
+        return {"prompts": self.prompts, "reordered": self.reordered, "swaps_avoided": self.swaps_avoided, "model_loads": self.model_loads}
+
+    def get(self, queue, worker: DeviceWorker, timeout=None):
+        worker.idle = True
+        return queue.get(timeout=timeout, select=lambda items: self.select(worker, items))
+
+    def task_done(self, worker: DeviceWorker, item):
+        worker.record_prompt(prompt_model_files(item[2]))
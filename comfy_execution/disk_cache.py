@@ -0,0 +1,242 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import safetensors
+import safetensors.torch
+import torch
+
+# Bump this when the on-disk layout changes so stale entries are ignored instead of misread.
+DISK_CACHE_FORMAT_VERSION = "1"
+
+DISK_CACHE_EXTENSION = ".safetensors"
+
+# Signature digests are memoized since the keys are large nested frozensets.
+DISK_CACHE_MAX_DIGESTS = 4096
+
+
+class NotPersistable(Exception):
+    pass
+
+
+def _stable_repr(obj):
+    # frozensets (as produced by to_hashable) iterate in a hash-seed dependent order, so
+    # the elements are sorted to get a representation that is stable across processes.
+    if isinstance(obj, frozenset):
+        return "{" + ",".join(sorted(_stable_repr(x) for x in obj)) + "}"
+    elif isinstance(obj, tuple):
+        return "(" + ",".join(_stable_repr(x) for x in obj) + ")"
+    elif isinstance(obj, float):
+        if obj != obj:
+            # NaN signatures never compare equal in memory, they must never match on disk either.
+            raise NotPersistable()
+        return repr(obj)
+    elif isinstance(obj, (int, str, bool, bytes, type(None))):
+        return repr(obj)
+    raise NotPersistable()
+
+
+def signature_digest(cache_key):
+    """
+    Returns a hex digest for a cache key that is stable across restarts, or None if the
+    key contains anything that can't be compared across processes (Unhashable, NaN...).
+    """
+    try:
+        data = _stable_repr(cache_key)
+    except NotPersistable:
+        return None
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _flatten(obj, tensors):
+    if isinstance(obj, torch.Tensor):
+        if tensors is None or obj.is_sparse or obj.layout != torch.strided or type(obj) is not torch.Tensor:
+            raise NotPersistable()
+        name = "t{}".format(len(tensors))
+        t = obj.detach().to("cpu").contiguous()
+        # safetensors refuses tensors that share storage so views of an already stored tensor get copied.
+        if any(x.untyped_storage().data_ptr() == t.untyped_storage().data_ptr() for x in tensors.values()):
+            t = t.clone()
+        tensors[name] = t
+        return {"__tensor__": name}
+    elif isinstance(obj, (int, float, str, bool, type(None))):
+        return obj
+    elif isinstance(obj, list):
+        return [_flatten(x, tensors) for x in obj]
+    elif isinstance(obj, tuple):
+        return {"__tuple__": [_flatten(x, tensors) for x in obj]}
+    elif isinstance(obj, dict):
+        if not all(isinstance(k, str) for k in obj.keys()) or "__tensor__" in obj or "__tuple__" in obj:
+            raise NotPersistable()
+        return {k: _flatten(v, tensors) for k, v in obj.items()}
+    raise NotPersistable()
+
+
+def _unflatten(obj, tensors):
+    if isinstance(obj, list):
+        return [_unflatten(x, tensors) for x in obj]
+    elif isinstance(obj, dict):
+        if "__tensor__" in obj:
+            return tensors[obj["__tensor__"]]
+        if "__tuple__" in obj:
+            return tuple(_unflatten(x, tensors) for x in obj["__tuple__"])
+        return {k: _unflatten(v, tensors) for k, v in obj.items()}
+    return obj
+
+
+class DiskCache:
+    """
+    Second cache tier for node outputs. The entries evicted from the memory cache are written as
+    safetensors files named by the digest of their input signature, so they can be loaded back after
+    an eviction or a restart. The entries still in memory when the process exits aren't written.
+    Only outputs made of tensors, primitives, lists, tuples and str keyed dicts are persisted;
+    anything else (models, VAEs, custom objects) stays memory only.
+    """
+    def __init__(self, directory, max_bytes, entry_factory=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entry_factory = entry_factory if entry_factory is not None else (lambda ui, outputs: (ui, outputs))
+        self.lock = threading.RLock()
+        self.index = {}
+        self.total_bytes = 0
+        self.digests = {}
+        os.makedirs(self.directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        # Warm start: index whatever a previous run left behind without loading any tensors.
+        for root, _, files in os.walk(self.directory):
+            for f in files:
+                path = os.path.join(root, f)
+                if f.endswith(".tmp"):
+                    # Leftover from a write that was interrupted by a crash or shutdown.
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                    continue
+                if not f.endswith(DISK_CACHE_EXTENSION):
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                self.index[f[:-len(DISK_CACHE_EXTENSION)]] = (st.st_size, st.st_mtime)
+                self.total_bytes += st.st_size
+        if len(self.index) > 0:
+            logging.info("Disk cache: found {} entries ({:.2f} GB) in {}".format(len(self.index), self.total_bytes / (1024**3), self.directory))
+        self._evict()
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest + DISK_CACHE_EXTENSION)
+
+    def _digest(self, cache_key):
+        if cache_key in self.digests:
+            return self.digests[cache_key]
+        digest = signature_digest(cache_key)
+        if len(self.digests) >= DISK_CACHE_MAX_DIGESTS:
+            self.digests.clear()
+        self.digests[cache_key] = digest
+        return digest
+
+    def __contains__(self, cache_key):
+        digest = self._digest(cache_key)
+        return digest is not None and digest in self.index
+
+    def _serialize(self, entry):
+        ui, outputs = entry
+        tensors = {}
+        structure = {"ui": _flatten(ui, None), "outputs": _flatten(outputs, tensors)}
+        metadata = {"format": DISK_CACHE_FORMAT_VERSION, "structure": json.dumps(structure)}
+        return tensors, metadata
+
+    def _write(self, digest, tensors, metadata):
+        path = self._path(digest)
+        tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            safetensors.torch.save_file(tensors, tmp_path, metadata=metadata)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except Exception as e:
+            logging.warning("Disk cache: failed to write entry {}: {}".format(digest, e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        with self.lock:
+            old = self.index.get(digest, None)
+            if old is not None:
+                self.total_bytes -= old[0]
+            self.index[digest] = (size, time.time())
+            self.total_bytes += size
+            self._evict()
+        return True
+
+    def store(self, cache_key, entry):
+        """
+        Writes a cache entry that is evicted from memory, on the calling thread since the memory
+        copy is dropped right after. Entries already on disk aren't written again.
+        """
+        digest = self._digest(cache_key)
+        if digest is None:
+            return False
+        with self.lock:
+            if digest in self.index:
+                return False
+        try:
+            tensors, metadata = self._serialize(entry)
+        except (NotPersistable, TypeError, ValueError):
+            return False
+        return self._write(digest, tensors, metadata)
+
+    def load(self, cache_key):
+        digest = self._digest(cache_key)
+        if digest is None or digest not in self.index:
+            return None
+        path = self._path(digest)
+        try:
+            with safetensors.safe_open(path, framework="pt", device="cpu") as f:
+                metadata = f.metadata() or {}
+                if metadata.get("format", None) != DISK_CACHE_FORMAT_VERSION:
+                    raise ValueError("unsupported format {}".format(metadata.get("format", None)))
+                tensors = {k: f.get_tensor(k) for k in f.keys()}
+            structure = json.loads(metadata["structure"])
+        except Exception as e:
+            logging.warning("Disk cache: dropping unreadable entry {}: {}".format(digest, e))
+            self._remove(digest)
+            return None
+        with self.lock:
+            if digest in self.index:
+                self.index[digest] = (self.index[digest][0], time.time())
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return self.entry_factory(_unflatten(structure["ui"], None), _unflatten(structure["outputs"], tensors))
+
+    def _remove(self, digest):
+        with self.lock:
+            info = self.index.pop(digest, None)
+            if info is not None:
+                self.total_bytes -= info[0]
+        try:
+            os.remove(self._path(digest))
+        except OSError:
+            pass
+
+    def _evict(self):
+        with self.lock:
+            if self.total_bytes <= self.max_bytes:
+                return
+            # Least recently written/used entries go first.
+            for digest, _ in sorted(self.index.items(), key=lambda x: x[1][1]):
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self._remove(digest)
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.index), "bytes": self.total_bytes, "max_bytes": self.max_bytes}
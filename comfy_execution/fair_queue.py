@@ -0,0 +1,132 @@
+import bisect
+import heapq
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# Priority classes settable with the "priority" of a /prompt, every queued prompt of a class runs before the next one.
+PRIORITY_CLASSES = {"high": 0, "normal": 1, "low": 2}
+DEFAULT_PRIORITY = "normal"
+
+
+def parse_client_weights(values) -> Dict[str, float]:
+    """Parses the CLIENT_ID=WEIGHT values of --client-weight."""
+    weights = {}
+    for value in values:
+        client_id, sep, weight = value.rpartition("=")
+        if sep == "" or float(weight) <= 0:
+            raise ValueError("invalid --client-weight {}, expected CLIENT_ID=WEIGHT with a positive weight".format(value))
+        weights[client_id] = float(weight)
+    return weights
+
+
+def item_priority(item) -> int:
+    return PRIORITY_CLASSES.get(item[3].get("priority", DEFAULT_PRIORITY), PRIORITY_CLASSES[DEFAULT_PRIORITY])
+
+
+def item_client(item) -> Optional[str]:
+    return item[3].get("client_id", None)
+
+
+class QueueSnapshot(NamedTuple):
+    """The running and pending (in the order they will run) queue items at one version of a PromptQueue, never modified."""
+    version: int
+    running: Tuple[tuple, ...]
+    pending: Tuple[tuple, ...]
+
+
+class PendingPrompts:
+    """
+    The queued items of a PromptQueue. Items run by priority class, then by number within a class, or with
+    fair_share in weighted round robin across client_ids so one client queueing hundreds of prompts doesn't
+    starve the others: each client has a virtual time advanced by 1 / weight for each of its prompts that
+    runs and the client with the lowest one goes next (stride scheduling). A client without queued prompts
+    can't save up turns, it starts again at the current virtual time. The prompts of a client run in number
+    order, so front (negative number) prompts are the next ones of their client.
+    """
+    def __init__(self, fair_share=False, weights: Optional[Dict[str, float]] = None):
+        self.fair_share = fair_share
+        self.weights = dict(weights or {})
+        # (priority, client_id) -> items sorted by number, only non empty lists.
+        self.lists: Dict[Tuple[int, Optional[str]], List[tuple]] = {}
+        self.passes: Dict[Optional[str], float] = {}
+        self.virtual_time = 0.0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter(self.order())
+
+    def weight(self, client_id) -> float:
+        return self.weights.get(client_id, 1.0)
+
+    def client_pass(self, client_id) -> float:
+        return max(self.passes.get(client_id, self.virtual_time), self.virtual_time)
+
+    def add(self, item):
+        key = (item_priority(item), item_client(item))
+        items = self.lists.setdefault(key, [])
+        if len(items) == 0 or items[-1][0] <= item[0]:
+            items.append(item)
+        else:
+            items.insert(bisect.bisect_right([x[0] for x in items], item[0]), item)
+        self.count += 1
+
+    def remove(self, item):
+        """Removes a queued item without it counting as run for its client."""
+        key = (item_priority(item), item_client(item))
+        items = self.lists[key]
+        for i, x in enumerate(items):
+            if x is item:
+                items.pop(i)
+                break
+        else:
+            raise ValueError("item not in the queue")
+        if len(items) == 0:
+            del self.lists[key]
+        self.count -= 1
+
+    def take(self, item):
+        """Removes an item that is about to run, advancing the virtual time of its client."""
+        self.remove(item)
+        if not self.fair_share:
+            return
+        client_id = item_client(item)
+        start = self.client_pass(client_id)
+        self.virtual_time = start
+        self.passes[client_id] = start + 1.0 / self.weight(client_id)
+        # Clients behind the virtual time are the same as unknown ones.
+        self.passes = {c: p for c, p in self.passes.items() if p > self.virtual_time}
+
+    def clear(self):
+        self.lists = {}
+        self.count = 0
+
+    def order(self, max_items=None) -> List[tuple]:
+        """The first max_items (all when None) queued items in the order they will run if nothing else gets queued."""
+        if max_items is None:
+            max_items = self.count
+        out = []
+        passes = {}
+        for priority in sorted(set(p for p, _ in self.lists)):
+            if len(out) >= max_items:
+                break
+            lists = [(client_id, items) for (p, client_id), items in self.lists.items() if p == priority]
+            if not self.fair_share:
+                merged = heapq.merge(*[items for _, items in lists], key=lambda x: x[0])
+                for item in merged:
+                    if len(out) >= max_items:
+                        break
+                    out.append(item)
+                continue
+            # Ties in virtual time go to the lowest number.
+            heap = [(passes.get(client_id, self.client_pass(client_id)), items[0][0], i, 0) for i, (client_id, items) in enumerate(lists)]
+            heapq.heapify(heap)
+            while len(heap) > 0 and len(out) < max_items:
+                client_pass, _, i, index = heapq.heappop(heap)
+                client_id, items = lists[i]
+                out.append(items[index])
+                passes[client_id] = client_pass + 1.0 / self.weight(client_id)
+                if index + 1 < len(items):
+                    heapq.heappush(heap, (passes[client_id], items[index + 1][0], i, index + 1))
+        return out
@@ -0,0 +1,119 @@
+import dataclasses
+import hashlib
+import logging
+import weakref
+from typing import Any, Callable, Dict, Optional
+
+import torch
+
+# Tensors up to this size are hashed in full, larger float tensors only get a sampled hash
+# so hashing never dominates execution.
+FINGERPRINT_FULL_HASH_MAX_BYTES = 16 * 1024 * 1024
+
+# Number of evenly spaced chunks and chunk size used for the sampled hash of large tensors.
+FINGERPRINT_SAMPLE_CHUNKS = 256
+FINGERPRINT_SAMPLE_CHUNK_BYTES = 4096
+
+# Number of rows the reduction over the full tensor is split into for large float tensors.
+FINGERPRINT_REDUCTION_ROWS = 4096
+
+FINGERPRINTERS: Dict[type, Callable[[Any], Any]] = {}
+
+
+def register_fingerprinter(cls: type, fn: Callable[[Any], Any]):
+    """
+    Registers a function returning a content fingerprint for instances of cls (and subclasses).
+    The fingerprint can be any combination of primitives, lists, tuples and dicts; return None
+    if the object can't be fingerprinted. Classes you own can implement __comfy_hash__ instead.
+    """
+    FINGERPRINTERS[cls] = fn
+
+
+def _digest_bytes(data, h):
+    h.update(memoryview(data.numpy()))
+
+
+def _tensor_digest(tensor: torch.Tensor) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    raw = tensor.detach().contiguous().reshape(-1).view(torch.uint8)
+    if raw.numel() <= FINGERPRINT_FULL_HASH_MAX_BYTES or not tensor.is_floating_point():
+        # Integer/bool tensors (masks, token ids...) have no cheap reduction covering every
+        # element, so they always fall back to the full hash.
+        _digest_bytes(raw.cpu(), h)
+        return h.hexdigest()
+
+    # Sampled hash: evenly spaced chunks, gathered on the tensor's own device so only the
+    # samples get copied, plus row sums of the bytes read as int64 (about as fast as reading
+    # the memory once, and exact unlike a float sum) so changes between the samples still
+    # change the hash.
+    h.update(b"sampled")
+    stride = raw.numel() // FINGERPRINT_SAMPLE_CHUNKS
+    starts = torch.arange(FINGERPRINT_SAMPLE_CHUNKS, device=raw.device) * stride
+    index = (starts.unsqueeze(1) + torch.arange(FINGERPRINT_SAMPLE_CHUNK_BYTES, device=raw.device)).clamp_(max=raw.numel() - 1)
+    _digest_bytes(raw[index.reshape(-1)].cpu(), h)
+    _digest_bytes(raw[-FINGERPRINT_SAMPLE_CHUNK_BYTES:].cpu(), h)
+    if raw.storage_offset() % 8 != 0:
+        raw = raw.clone()
+    # The last bytes that don't fill a word are in the last sampled chunk.
+    words = raw[:raw.numel() - raw.numel() % 8].view(torch.int64)
+    rows = words.numel() - words.numel() % FINGERPRINT_REDUCTION_ROWS
+    sums = torch.cat((words[:rows].view(FINGERPRINT_REDUCTION_ROWS, -1).sum(dim=1), words[rows:].sum().reshape(1)))
+    _digest_bytes(sums.view(torch.uint8).cpu(), h)
+    return h.hexdigest()
+
+
+# Fingerprints are memoized per tensor object and invalidated by in-place modifications
+# (tensor._version), so the same constant tensor is only hashed once across prompts.
+_tensor_memo: Dict[int, tuple] = {}
+
+
+def _forget_tensor(key):
+    _tensor_memo.pop(key, None)
+
+
+def fingerprint_tensor(tensor: torch.Tensor):
+    if tensor.is_sparse or tensor.layout != torch.strided or tensor.is_meta:
+        return None
+    # Inference tensors don't track in-place modifications, so those are never memoized.
+    version = None if tensor.is_inference() else tensor._version
+    key = id(tensor)
+    memo = _tensor_memo.get(key, None)
+    if version is not None and memo is not None and memo[0]() is tensor and memo[1] == version:
+        return memo[2]
+    try:
+        digest = _tensor_digest(tensor)
+    except Exception as e:
+        logging.debug("Unable to fingerprint tensor: {}".format(e))
+        return None
+    result = ("__tensor__", str(tensor.dtype), tuple(tensor.shape), digest)
+    if version is not None:
+        _tensor_memo[key] = (weakref.ref(tensor, lambda _, key=key: _forget_tensor(key)), version, result)
+    return result
+
+
+def fingerprint_dataclass(obj):
+    return ("__dataclass__", type(obj).__module__, type(obj).__qualname__, {f.name: getattr(obj, f.name) for f in dataclasses.fields(obj)})
+
+
+register_fingerprinter(torch.Tensor, fingerprint_tensor)
+
+
+def fingerprint(obj) -> Optional[Any]:
+    """
+    Returns a content fingerprint made of plain values for obj, or None if the object
+    type isn't supported. Used by to_hashable so node inputs that are tensors or custom
+    objects can still be part of cache signatures.
+    """
+    comfy_hash = getattr(type(obj), "__comfy_hash__", None)
+    if comfy_hash is not None:
+        value = comfy_hash(obj)
+        if value is None:
+            return None
+        return ("__comfy_hash__", type(obj).__module__, type(obj).__qualname__, value)
+    for cls in type(obj).__mro__:
+        fn = FINGERPRINTERS.get(cls, None)
+        if fn is not None:
+            return fn(obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return fingerprint_dataclass(obj)
+    return None
@@ -5,6 +5,7 @@ import nodes
 import asyncio
 import inspect
 from comfy_execution.graph_utils import is_link, ExecutionBlocker
+from comfy_execution.parallel import runs_in_thread_pool
 from comfy.comfy_types.node_typing import ComfyNodeABC, InputTypeDict, InputTypeOptions
 
 # NOTE: ExecutionBlocker code got moved to graph_utils.py to prevent torch being imported too soon during unit tests
@@ -274,12 +275,12 @@ class ExecutionList(TopologicalSort):
                 return True
             return False
 
-        # If an available node is async, do that first.
+        # If an available node is async (or runs in the thread pool), do that first.
         # This will execute the asynchronous function earlier, reducing the overall time.
         def is_async(node_id):
             class_type = self.dynprompt.get_node(node_id)["class_type"]
             class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
-            return inspect.iscoroutinefunction(getattr(class_def, class_def.FUNCTION))
+            return inspect.iscoroutinefunction(getattr(class_def, class_def.FUNCTION)) or runs_in_thread_pool(class_def)
 
         for node_id in node_list:
             if is_output(node_id) or is_async(node_id):
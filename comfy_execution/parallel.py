@@ -0,0 +1,39 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from comfy.cli_args import args
+
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_thread_pool_lock = threading.Lock()
+
+
+def is_thread_safe(class_def) -> bool:
+    """
+    Nodes opt in by setting THREAD_SAFE = True (V1) or thread_safe=True in their schema (V3).
+    Their FUNCTION must not touch model_management (loading models to the GPU, sampling...)
+    or global state like GraphBuilder prefixes, since it may run concurrently with other nodes.
+    The V1 flag isn't inherited: a subclass of a thread safe node has to set it itself.
+    """
+    if "THREAD_SAFE" in class_def.__dict__:
+        return class_def.__dict__["THREAD_SAFE"] is True
+    # V3 nodes read it from their own schema through the THREAD_SAFE class property.
+    if hasattr(class_def, "_THREAD_SAFE"):
+        return getattr(class_def, "THREAD_SAFE", False) is True
+    return False
+
+
+def get_node_thread_pool() -> Optional[ThreadPoolExecutor]:
+    """Returns the pool thread safe nodes run in, or None when parallel node execution is disabled."""
+    global _thread_pool
+    if args.parallel_node_workers <= 0:
+        return None
+    if _thread_pool is None:
+        with _thread_pool_lock:
+            if _thread_pool is None:
+                _thread_pool = ThreadPoolExecutor(max_workers=args.parallel_node_workers, thread_name_prefix="comfy_node")
+    return _thread_pool
+
+
+def runs_in_thread_pool(class_def) -> bool:
+    return is_thread_safe(class_def) and args.parallel_node_workers > 0
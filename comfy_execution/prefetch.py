@@ -0,0 +1,131 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import psutil
+
+import folder_paths
+from comfy_execution.device_workers import prompt_model_files
+
+# Number of queued prompts (in the order they will run) whose model files are prefetched.
+PREFETCH_LOOKAHEAD = 2
+PREFETCH_CHUNK_SIZE = 16 * 1024 * 1024
+# Files aren't prefetched when that would leave less RAM available than this.
+PREFETCH_RAM_HEADROOM = 2 * 1024 * 1024 * 1024
+# Number of recently prefetched files that aren't read again.
+PREFETCHED_FILES = 64
+
+
+def resolve_model_path(name: str) -> Optional[str]:
+    """The full path of a model file name as a loader node would get it, None if no model folder has it."""
+    for folder_name, (_, extensions) in list(folder_paths.folder_names_and_paths.items()):
+        if len(folder_paths.supported_pt_extensions.intersection(extensions)) == 0:
+            continue
+        if name in folder_paths.get_filename_list(folder_name):
+            return folder_paths.get_full_path(folder_name, name)
+    return None
+
+
+def file_key(path: str) -> tuple:
+    st = os.stat(path)
+    return (os.path.realpath(path), st.st_mtime_ns, st.st_size)
+
+
+class ModelPrefetcher:
+    """
+    Reads the model files (checkpoints, LoRAs, VAEs...) of the next queued prompts while the current
+    one executes, so they are in the OS page cache when their loader nodes run and loading doesn't
+    start with seconds of disk I/O. The memory mapped loads of comfy.utils.load_torch_file then read
+    them from RAM. At most ram_budget bytes are read for the prompts that are next.
+    """
+    def __init__(self, ram_budget: int):
+        self.ram_budget = ram_budget
+        self.cond = threading.Condition()
+        self.pending: Optional[List[tuple]] = None
+        self.scheduled_ids = []
+        # file_key -> None, the most recently prefetched files.
+        self.prefetched: OrderedDict[tuple, None] = OrderedDict()
+        self.files = 0
+        self.bytes = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True, name="comfy_model_prefetch")
+        self.thread.start()
+
+    def schedule(self, items: List[tuple]):
+        """Called by the PromptQueue with the next queued items each time the queue changes while a prompt runs."""
+        with self.cond:
+            ids = [item[1] for item in items]
+            if ids == self.scheduled_ids:
+                return
+            self.scheduled_ids = ids
+            self.pending = items
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.pending is None:
+                    self.cond.wait()
+                items = self.pending
+                self.pending = None
+            try:
+                self.prefetch(items)
+            except Exception as e:
+                logging.warning(f"Unable to prefetch the models of the next queued prompt: {e}")
+
+    def model_paths(self, items: List[tuple]) -> List[str]:
+        paths = []
+        for item in items:
+            for name in sorted(prompt_model_files(item[2])):
+                path = resolve_model_path(name)
+                if path is not None and os.path.isfile(path) and path not in paths:
+                    paths.append(path)
+        return paths
+
+    def prefetch(self, items: List[tuple]) -> List[str]:
+        """Reads the model files of items that weren't prefetched recently, returns their paths."""
+        start = time.perf_counter()
+        budget = self.ram_budget
+        done = []
+        total = 0
+        for path in self.model_paths(items):
+            key = file_key(path)
+            if key in self.prefetched:
+                self.prefetched.move_to_end(key)
+                continue
+            size = key[2]
+            if size > budget or psutil.virtual_memory().available - size < PREFETCH_RAM_HEADROOM:
+                continue
+            if not self.read_file(path):
+                # The queue changed, what is next may be other files.
+                break
+            budget -= size
+            total += size
+            done.append(path)
+            self.prefetched[key] = None
+            while len(self.prefetched) > PREFETCHED_FILES:
+                self.prefetched.popitem(last=False)
+        if len(done) > 0:
+            self.files += len(done)
+            self.bytes += total
+            logging.info("Prefetched {} model files ({:.2f} GB) for the next queued prompt in {:.2f} seconds".format(len(done), total / (1024 ** 3), time.perf_counter() - start))
+        return done
+
+    def read_file(self, path: str) -> bool:
+        """Reads path into the page cache, False when stopped because other items were scheduled."""
+        buffer = bytearray(PREFETCH_CHUNK_SIZE)
+        with open(path, "rb", buffering=0) as f:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            while f.readinto(buffer) > 0:
+                if self.pending is not None:
+                    return False
+        return True
+
+    def stats(self):
+        return {"files": self.files, "bytes": self.bytes}
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import contextvars
 from typing import TypedDict, Dict, Optional, Tuple
 from typing_extensions import override
 from PIL import Image
@@ -319,18 +320,24 @@ class ProgressRegistry:
         for handler in self.handlers.values():
             handler.reset()
 
-# Global registry instance
+# Global registry instance, the one of the last prompt started for code running outside of an execution
 global_progress_registry: ProgressRegistry | None = None
 
+# Registry of the prompt executing in this context, prompts run at the same time with --multi-gpu or --batch-prompts
+current_progress_registry: contextvars.ContextVar[ProgressRegistry | None] = contextvars.ContextVar("current_progress_registry", default=None)
+
 def reset_progress_state(prompt_id: str, dynprompt: "DynamicPrompt") -> None:
     global global_progress_registry
 
     # Reset existing handlers if registry exists
-    if global_progress_registry is not None:
-        global_progress_registry.reset_handlers()
+    registry = current_progress_registry.get()
+    if registry is not None:
+        registry.reset_handlers()
 
     # Create new registry
-    global_progress_registry = ProgressRegistry(prompt_id, dynprompt)
+    registry = ProgressRegistry(prompt_id, dynprompt)
+    current_progress_registry.set(registry)
+    global_progress_registry = registry
 
 
 def add_progress_handler(handler: ProgressHandler) -> None:
@@ -341,6 +348,9 @@ def add_progress_handler(handler: ProgressHandler) -> None:
 
 def get_progress_state() -> ProgressRegistry:
     global global_progress_registry
+    registry = current_progress_registry.get()
+    if registry is not None:
+        return registry
     if global_progress_registry is None:
         from comfy_execution.graph import DynamicPrompt
 
@@ -0,0 +1,217 @@
+import logging
+import threading
+import traceback
+from typing import Callable, List, Optional
+
+import torch
+
+import comfy.model_management
+import comfy.samplers
+import nodes
+from comfy_execution.graph import get_input_info
+from comfy_execution.graph_utils import is_link
+
+# Number of queued prompts (in queue order) looked at for prompts to batch with the one being run.
+BATCH_LOOKAHEAD = 64
+
+# (class_type, input name) -> if the input may differ between prompts batched together.
+_varying_inputs = {}
+
+
+def input_may_vary(class_type, input_name) -> bool:
+    """Texts (prompts, file name prefixes...) and seeds may differ, the other widgets (models, samplers, sizes...) may not."""
+    key = (class_type, input_name)
+    if key not in _varying_inputs:
+        input_type, _, extra_info = get_input_info(nodes.NODE_CLASS_MAPPINGS[class_type], input_name)
+        _varying_inputs[key] = input_type == "STRING" or (extra_info or {}).get("control_after_generate", False) is True
+    return _varying_inputs[key]
+
+
+def batch_signature(prompt, outputs) -> Optional[tuple]:
+    """
+    Prompts with the same signature are the same graph with the same widget values except for texts and seeds,
+    so they can run as one batch. None when the prompt has nodes that don't exist.
+    """
+    graph = []
+    for node_id in sorted(prompt):
+        node = prompt[node_id]
+        class_type = node["class_type"]
+        if class_type not in nodes.NODE_CLASS_MAPPINGS:
+            return None
+        inputs = []
+        for name, value in sorted(node.get("inputs", {}).items()):
+            if is_link(value):
+                inputs.append((name, "link", value[0], value[1]))
+            elif input_may_vary(class_type, name):
+                inputs.append((name, "varying"))
+            else:
+                inputs.append((name, repr(value)))
+        graph.append((node_id, class_type, tuple(inputs)))
+    return (tuple(graph), tuple(sorted(outputs)))
+
+
+def batch_matcher(item) -> Callable:
+    """A match function for PromptQueue.get_matching picking the queued items that can run in a batch with item."""
+    signature = batch_signature(item[2], item[4])
+
+    def match(other):
+        return signature is not None and batch_signature(other[2], other[4]) == signature
+    return match
+
+
+class PromptServerView:
+    """
+    The PromptServer as seen by one of the PromptExecutors of a batch or of a device worker: its own client_id,
+    last_prompt_id and last_node_id so the websocket events of each prompt go to the client that queued it,
+    everything else is the server's.
+    """
+    def __init__(self, server):
+        self.server = server
+        self.client_id = None
+        self.last_prompt_id = None
+        self.last_node_id = None
+
+    def __getattr__(self, name):
+        return getattr(self.server, name)
+
+
+class BatchedCall:
+    def __init__(self, model, input_x, timestep, c):
+        self.model = model
+        self.input_x = input_x
+        self.timestep = timestep
+        self.c = c
+        self.output = None
+
+    def batch_key(self):
+        conds = tuple((k, v.shape[1:], v.dtype) if torch.is_tensor(v) else (k,) for k, v in sorted(self.c.items()))
+        return (id(self.model), self.input_x.shape[1:], self.input_x.dtype, tuple(torch.unique(self.timestep).tolist()), conds)
+
+
+class ModelCallBatcher:
+    """
+    Runs the prompts of a batch on their own threads, taking turns so only one of them executes at a time
+    like in the normal prompt worker. When a sampler calls the model, the thread waits for the other prompts
+    to reach their model call (or finish) and all the calls with the same model, shapes and timestep are
+    run as one call on the concatenated inputs, so the same graph queued by N users samples at batch size N.
+    """
+    def __init__(self, members):
+        self.cond = threading.Condition()
+        self.active = members
+        self.pending: List[BatchedCall] = []
+        self.calls = 0
+        self.batched_calls = 0
+
+    def run_member(self, function, *args):
+        comfy.samplers.set_model_call_batcher(self)
+        with self.cond:
+            try:
+                return function(*args)
+            finally:
+                self.active -= 1
+                self.run_pending()
+                comfy.samplers.set_model_call_batcher(None)
+
+    def apply_model(self, model, input_x, timestep, c):
+        call = BatchedCall(model, input_x, timestep, c)
+        with self.cond:
+            self.pending.append(call)
+            self.run_pending()
+            while call.output is None:
+                self.cond.wait()
+        if isinstance(call.output, BaseException):
+            raise call.output
+        return call.output
+
+    def run_pending(self):
+        """Runs the waiting model calls once every prompt still running is waiting, called with the lock held."""
+        if len(self.pending) == 0 or len(self.pending) < self.active:
+            return
+        groups = {}
+        for call in self.pending:
+            groups.setdefault(call.batch_key(), []).append(call)
+        self.pending = []
+        for calls in groups.values():
+            while len(calls) > 0:
+                batch = calls[:self.batch_size(calls)]
+                calls = calls[len(batch):]
+                try:
+                    outputs = self.run_batch(batch)
+                except Exception as e:
+                    outputs = [e] * len(batch)
+                for call, output in zip(batch, outputs):
+                    call.output = output
+        self.cond.notify_all()
+
+    def batch_size(self, calls):
+        """How many of calls fit in memory in one model call, same estimate as comfy.samplers._calc_cond_batch."""
+        first = calls[0]
+        free_memory = comfy.model_management.get_free_memory(first.input_x.device)
+        for count in range(len(calls), 1, -1):
+            input_shape = [sum(call.input_x.shape[0] for call in calls[:count])] + list(first.input_x.shape[1:])
+            cond_shapes = {k: [call.c[k].size() for call in calls[:count]] for k, v in first.c.items() if torch.is_tensor(v)}
+            if first.model.memory_required(input_shape, cond_shapes=cond_shapes) * 1.5 < free_memory:
+                return count
+        return 1
+
+    def run_batch(self, batch):
+        self.calls += 1
+        first = batch[0]
+        if len(batch) == 1:
+            return [first.model.apply_model(first.input_x, first.timestep, **first.c)]
+        self.batched_calls += 1
+        c = {}
+        for k, v in first.c.items():
+            if torch.is_tensor(v):
+                c[k] = torch.cat([call.c[k] for call in batch])
+            else:
+                c[k] = v
+        transformer_options = first.c.get("transformer_options", None)
+        if transformer_options is not None:
+            c["transformer_options"] = transformer_options.copy()
+            for k in ("cond_or_uncond", "uuids"):
+                if k in transformer_options:
+                    c["transformer_options"][k] = sum((call.c["transformer_options"][k] for call in batch), [])
+        output = first.model.apply_model(torch.cat([call.input_x for call in batch]), torch.cat([call.timestep for call in batch]), **c)
+        return output.split([call.input_x.shape[0] for call in batch])
+
+
+def execute_batch(executors, items, device=None):
+    """
+    Executes the queue items with executors[i] running items[i], each on its own thread, with the model
+    calls of their samplers merged by a ModelCallBatcher. Returns once all of them are done, a prompt that
+    failed has its executor's success set to False so its task_done reports the error, like a failed node.
+    The executors share their cached outputs, so the loaders run once for the whole batch and the model
+    calls of the prompts use the same model.
+    """
+    batcher = ModelCallBatcher(len(items))
+    members = executors[:len(items)]
+    for executor in members:
+        executor.caches.outputs.set_shared_caches([x.caches.outputs for x in members if x is not executor])
+
+    def run(executor, item):
+        if device is not None:
+            comfy.model_management.set_thread_torch_device(device)
+        prompt_id = item[1]
+        extra_data = item[3].copy()
+        for k in item[5]:
+            extra_data[k] = item[5][k]
+        executor.server.last_prompt_id = prompt_id
+        try:
+            batcher.run_member(executor.execute, item[2], prompt_id, extra_data, item[4])
+        except Exception as e:
+            logging.error("Prompt {} of a batch failed: {}".format(prompt_id, e))
+            logging.error(traceback.format_exc())
+            executor.success = False
+            executor.history_result = {"outputs": {}, "meta": {}}
+            executor.add_message("execution_error", {"prompt_id": prompt_id, "exception_message": str(e), "exception_type": type(e).__name__,
+                                                     "traceback": traceback.format_tb(e.__traceback__)}, broadcast=False)
+
+    threads = [threading.Thread(target=run, args=(executor, item), name="comfy_batch_{}".format(i)) for i, (executor, item) in enumerate(zip(executors, items))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for executor in members:
+        executor.caches.outputs.set_shared_caches([])
+    logging.info("Executed {} prompts as a batch, {} of {} model calls batched".format(len(items), batcher.batched_calls, batcher.calls))
@@ -18,6 +18,13 @@ current_executing_context: contextvars.ContextVar[Optional[ExecutionContext]] =
 def get_executing_context() -> Optional[ExecutionContext]:
     return current_executing_context.get(None)
 
+# The server (or PromptServerView) of the PromptExecutor running in this context. Prompts run at the same time
+# with --multi-gpu or --batch-prompts, each executor has its own client_id and last_node_id.
+current_execution_server: contextvars.ContextVar = contextvars.ContextVar("current_execution_server", default=None)
+
+def get_execution_server():
+    return current_execution_server.get(None)
+
 class CurrentNodeContext:
     """
     Context manager for setting the current executing node context.
@@ -0,0 +1,207 @@
+from __future__ import annotations
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional
+from comfy_api.latest import io, ComfyExtension
+from comfy_execution.caching import Unhashable, to_hashable
+import comfy.patcher_extension
+import comfy.model_patcher
+import logging
+import weakref
+import torch
+if TYPE_CHECKING:
+    from comfy.model_patcher import ModelPatcher
+    from comfy.samplers import CFGGuider
+
+
+def has_unhashable(obj) -> bool:
+    if isinstance(obj, Unhashable):
+        return True
+    if isinstance(obj, (frozenset, tuple)):
+        return any(has_unhashable(x) for x in obj)
+    return False
+
+
+def sampler_key(sampler):
+    """What makes a sampler take the same steps, None when it can't be hashed."""
+    sampler_function = getattr(sampler, "sampler_function", None)
+    if sampler_function is None:
+        return None
+    key = (type(sampler).__qualname__, getattr(sampler_function, "__module__", None), getattr(sampler_function, "__qualname__", None),
+           to_hashable(getattr(sampler, "extra_options", {})), to_hashable(getattr(sampler, "inpaint_options", {})))
+    if key[2] is None or has_unhashable(key):
+        return None
+    return key
+
+
+def guider_key(guider: CFGGuider):
+    """The type and plain settings (cfg...) of the guider."""
+    return (type(guider).__qualname__, tuple(sorted((k, v) for k, v in vars(guider).items() if isinstance(v, (bool, int, float, str)))))
+
+
+def step_cache_sample_wrapper(executor, *args, **kwargs):
+    """
+    This OUTER_SAMPLE wrapper starts a StepCacheRun for the sampling, the model calls of the run go through it.
+    """
+    guider: CFGGuider = executor.class_obj
+    orig_model_options = guider.model_options
+    step_cache: StepCacheHolder = orig_model_options["transformer_options"]["step_cache"]
+    noise, latent_image, sampler, sigmas, denoise_mask = args[:5]
+    seed = args[7] if len(args) > 7 else kwargs.get("seed", None)
+    run = step_cache.start_run(guider, noise, latent_image, sampler, sigmas, denoise_mask, seed)
+    if run is None:
+        return executor(*args, **kwargs)
+    try:
+        guider.model_options = comfy.model_patcher.create_model_options_clone(orig_model_options)
+        guider.model_options["transformer_options"]["step_cache_run"] = run
+        return executor(*args, **kwargs)
+    finally:
+        logging.info(f"StepCache - reused {run.reused}/{run.calls} model calls from previous runs.")
+        guider.model_options = orig_model_options
+
+
+def step_cache_predict_noise_wrapper(executor, *args, **kwargs):
+    model_options: dict = args[2]
+    run: Optional[StepCacheRun] = model_options["transformer_options"].get("step_cache_run", None)
+    if run is None:
+        return executor(*args, **kwargs)
+    x: torch.Tensor = args[0]
+    timestep: torch.Tensor = args[1]
+    key = run.next_key(timestep, executor.class_obj.conds)
+    output = run.holder.get(key)
+    if output is not None and output.shape == x.shape:
+        run.reused += 1
+        return output.to(x.device)
+    output = executor(*args, **kwargs)
+    if not run.unhashable:
+        run.holder.set(key, output)
+    return output
+
+
+class StepCacheRun:
+    """
+    The state of one sampling through a StepCacheHolder. Each model call is keyed by the key of the
+    call before it, so a call only matches when every earlier call of the run matched too: the
+    sampler then got the same outputs and calls the model with the same x.
+    """
+    def __init__(self, holder: StepCacheHolder, run_key, cond_keys: dict, sigmas: list[float]):
+        self.holder = holder
+        self.key = run_key
+        # uuid of each cond -> hashable content of the cond.
+        self.cond_keys = cond_keys
+        self.sigmas = sigmas
+        self.calls = 0
+        self.reused = 0
+        # Once a call has a cond that can't be hashed its key and the keys after it can't match, they aren't stored.
+        self.unhashable = False
+
+    def next_key(self, timestep: torch.Tensor, conds: dict):
+        """The key of the model call at timestep, the conds (processed, with their timestep ranges) active then and the sigmas up to the next one."""
+        self.calls += 1
+        t = timestep.tolist()
+        active = []
+        for name in sorted(conds):
+            for c in conds[name] or []:
+                if 'timestep_start' in c and t[0] > c['timestep_start']:
+                    continue
+                if 'timestep_end' in c and t[0] < c['timestep_end']:
+                    continue
+                # Conds process_conds added without an original are only equal to themselves.
+                cond_key = self.cond_keys.get(c.get('uuid', None), None)
+                if cond_key is None:
+                    cond_key = Unhashable()
+                    self.unhashable = True
+                active.append((name, cond_key))
+        reached = sum(1 for s in self.sigmas if s >= t[0])
+        self.key = (self.key, tuple(t), tuple(active), tuple(self.sigmas[:reached + 1]))
+        return self.key
+
+
+class StepCacheHolder:
+    """
+    The model outputs of the previous sampling runs of a model, up to max_bytes on the CPU. The holder
+    is kept in the model_options of the model, so it lives as long as the node output and is shared
+    with the models patched from it (the keys include which model patcher sampled).
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[tuple, torch.Tensor] = OrderedDict()
+        self.size = 0
+        # model patcher -> token in the run keys, a patcher that was freed can't match anymore.
+        self.patcher_tokens: weakref.WeakKeyDictionary[ModelPatcher, object] = weakref.WeakKeyDictionary()
+
+    def __deepcopy__(self, memo):
+        # Models cloned from the model share the holder instead of copying the outputs.
+        return self
+
+    def start_run(self, guider: CFGGuider, noise: torch.Tensor, latent_image: torch.Tensor, sampler, sigmas: torch.Tensor, denoise_mask: Optional[torch.Tensor], seed) -> Optional[StepCacheRun]:
+        """A run keyed by everything the first model call depends on, None when something can't be hashed."""
+        patcher = guider.model_patcher
+        token = self.patcher_tokens.get(patcher, None)
+        if token is None:
+            token = self.patcher_tokens[patcher] = object()
+        cond_keys = {}
+        for name in guider.conds:
+            for c in guider.conds[name] or []:
+                cond_keys[c['uuid']] = to_hashable({k: v for k, v in c.items() if k != 'uuid'})
+        run_key = (token, patcher.patches_uuid, guider_key(guider), sampler_key(sampler), seed, to_hashable(noise), to_hashable(latent_image),
+                   to_hashable(denoise_mask), len(sigmas))
+        if run_key[3] is None or has_unhashable(run_key) or any(has_unhashable(k) for k in cond_keys.values()):
+            logging.info("StepCache - the sampler, latent or conditioning can't be hashed (control nets, hooks...), not caching.")
+            return None
+        return StepCacheRun(self, run_key, cond_keys, sigmas.tolist())
+
+    def get(self, key) -> Optional[torch.Tensor]:
+        output = self.entries.get(key, None)
+        if output is not None:
+            self.entries.move_to_end(key)
+        return output
+
+    def set(self, key, output: torch.Tensor):
+        size = output.numel() * output.element_size()
+        if size > self.max_bytes:
+            return
+        replaced = self.entries.pop(key, None)
+        if replaced is not None:
+            self.size -= replaced.numel() * replaced.element_size()
+        self.entries[key] = output.detach().to("cpu", copy=True)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.numel() * evicted.element_size()
+
+
+class StepCacheNode(io.ComfyNode):
+    @classmethod
+    def define_schema(cls) -> io.Schema:
+        return io.Schema(
+            node_id="StepCache",
+            display_name="StepCache",
+            description="Keeps the model outputs of each sampling step so that a run sharing its first steps with a previous one (same model, seed, latent, sampler and sigmas, with for example only the conditioning of the last steps changed) reuses them and only samples the steps that differ. The results are the same as without it. Changing the cfg changes the whole run and changing the negative prompt the first step, so those runs reuse nothing.",
+            category="advanced/debug/model",
+            is_experimental=True,
+            inputs=[
+                io.Model.Input("model", tooltip="The model to add StepCache to."),
+                io.Float.Input("max_cache_gb", min=0.1, default=2.0, max=1024.0, step=0.1, tooltip="The RAM used for the model outputs of previous runs, the least recently used ones are dropped beyond it."),
+            ],
+            outputs=[
+                io.Model.Output(tooltip="The model with StepCache."),
+            ],
+        )
+
+    @classmethod
+    def execute(cls, model: io.Model.Type, max_cache_gb: float) -> io.NodeOutput:
+        model = model.clone()
+        model.model_options["transformer_options"]["step_cache"] = StepCacheHolder(int(max_cache_gb * 1024 * 1024 * 1024))
+        model.add_wrapper_with_key(comfy.patcher_extension.WrappersMP.OUTER_SAMPLE, "step_cache", step_cache_sample_wrapper)
+        model.add_wrapper_with_key(comfy.patcher_extension.WrappersMP.PREDICT_NOISE, "step_cache", step_cache_predict_noise_wrapper)
+        return io.NodeOutput(model)
+
+
+class StepCacheExtension(ComfyExtension):
+    async def get_node_list(self) -> list[type[io.ComfyNode]]:
+        return [
+            StepCacheNode,
+        ]
+
+def comfy_entrypoint():
+    return StepCacheExtension()
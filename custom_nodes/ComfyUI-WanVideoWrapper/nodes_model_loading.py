@@ -42,27 +42,16 @@ def load_sharded_model(model_dir, device="cpu", safe_load=True):
     Load a sharded model from a directory containing multiple safetensors files.
     Supports HuggingFace format: diffusion_pytorch_model-00001-of-00006.safetensors, etc.
     """
-    import glob
-    from safetensors.torch import load_file
-    
     if not os.path.isdir(model_dir):
         raise ValueError(f"Expected directory for sharded model, got: {model_dir}")
-    
-    # Find all shard files matching pattern: *-00001-of-*.safetensors
-    shard_pattern = os.path.join(model_dir, "*-[0-9][0-9][0-9][0-9][0-9]-of-*.safetensors")
-    shard_files = sorted(glob.glob(shard_pattern))
-    
+
+    shard_files = comfy.utils.get_sharded_safetensors_files(model_dir)
     if not shard_files:
         raise FileNotFoundError(f"No sharded model files found in {model_dir}")
-    
+
     log.info(f"Loading sharded model from {model_dir} ({len(shard_files)} shards)")
-    
-    # Load and merge all shards
-    state_dict = {}
-    for shard_file in tqdm(shard_files, desc="Loading shards"):
-        shard_state = load_file(shard_file, device=str(device))
-        state_dict.update(shard_state)
-    
+    # Shards are memory mapped and loaded in parallel
+    state_dict = comfy.utils.load_sharded_safetensors(shard_files, device=torch.device(device))
     log.info(f"Loaded {len(state_dict)} keys from {len(shard_files)} shards")
     return state_dict
 
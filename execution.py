@@ -1,5 +1,5 @@
+import contextvars
 import copy
-import heapq
 import inspect
 import logging
 import sys
@@ -14,6 +14,8 @@ import torch
 
 import comfy.model_management
 import nodes
+from app.history_store import HistoryStore
+from comfy.cli_args import args
 from comfy_execution.caching import (
     BasicCache,
     CacheKeySetID,
@@ -23,6 +25,9 @@ from comfy_execution.caching import (
     LRUCache,
     RAMPressureCache,
 )
+from comfy_execution.disk_cache import DiskCache
+from comfy_execution.fair_queue import PendingPrompts, QueueSnapshot, parse_client_weights
+from comfy_execution.prefetch import PREFETCH_LOOKAHEAD
 from comfy_execution.graph import (
     DynamicPrompt,
     ExecutionBlocker,
@@ -32,7 +37,8 @@ from comfy_execution.graph import (
 from comfy_execution.graph_utils import GraphBuilder, is_link
 from comfy_execution.validation import validate_node_input
 from comfy_execution.progress import get_progress_state, reset_progress_state, add_progress_handler, WebUIProgressHandler
-from comfy_execution.utils import CurrentNodeContext
+from comfy_execution.utils import CurrentNodeContext, current_execution_server
+from comfy_execution.parallel import get_node_thread_pool, is_thread_safe
 from comfy_api.internal import _ComfyNodeInternal, _NodeOutputInternal, first_real_override, is_class, make_locked_method_func
 from comfy_api.latest import io, _io
 
@@ -117,6 +123,9 @@ class CacheSet:
         else:
             self.init_classic_cache()
 
+        if cache_type != CacheType.NONE and cache_args and cache_args.get("disk", None):
+            self.init_disk_cache(cache_args["disk"], cache_args.get("disk_size", 10.0))
+
         self.all = [self.outputs, self.objects]
 
     # Performs like the old cache -- dump data ASAP
@@ -132,6 +141,10 @@ class CacheSet:
         self.outputs = RAMPressureCache(CacheKeySetInputSignature)
         self.objects = HierarchicalCache(CacheKeySetID)
 
+    def init_disk_cache(self, directory, max_size_gb):
+        self.outputs.set_disk_cache(DiskCache(directory, int(max_size_gb * (1024**3)), entry_factory=CacheEntry))
+        logging.info("Using disk cache tier in {} ({} GB).".format(directory, max_size_gb))
+
     def init_null_cache(self):
         self.outputs = NullCache()
         self.objects = NullCache()
@@ -142,6 +155,11 @@ class CacheSet:
         }
         return result
 
+    def memory_usage(self):
+        if hasattr(self.outputs, "memory_usage"):
+            return self.outputs.memory_usage()
+        return None
+
 SENSITIVE_EXTRA_DATA_KEYS = ("auth_token_comfy_org", "api_key_comfy_org")
 
 def get_input_data(inputs, class_def, unique_id, execution_list=None, dynprompt=None, extra_data={}):
@@ -225,7 +243,7 @@ async def resolve_map_node_over_list_results(results):
                 raise exc
         return [x.result() if isinstance(x, asyncio.Task) else x for x in results]
 
-async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, func, allow_interrupt=False, execution_block_cb=None, pre_execute_cb=None, v3_data=None):
+async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, func, allow_interrupt=False, execution_block_cb=None, pre_execute_cb=None, v3_data=None, thread_pool=None):
     # check if node wants the lists
     input_is_list = getattr(obj, "INPUT_IS_LIST", False)
 
@@ -274,11 +292,22 @@ async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, f
             # V1
             else:
                 f = getattr(obj, func)
-            if inspect.iscoroutinefunction(f):
+            if inspect.iscoroutinefunction(f) or thread_pool is not None:
                 async def async_wrapper(f, prompt_id, unique_id, list_index, args):
                     with CurrentNodeContext(prompt_id, unique_id, list_index):
                         return await f(**args)
-                task = asyncio.create_task(async_wrapper(f, prompt_id, unique_id, index, args=inputs))
+                async def thread_wrapper(f, prompt_id, unique_id, list_index, args):
+                    # Thread safe sync nodes run in the pool and are awaited like async nodes,
+                    # so independent ready nodes keep executing on this thread meanwhile.
+                    inference_mode = torch.is_inference_mode_enabled()
+                    def run():
+                        with torch.inference_mode(inference_mode), CurrentNodeContext(prompt_id, unique_id, list_index):
+                            return f(**args)
+                    return await asyncio.get_running_loop().run_in_executor(thread_pool, contextvars.copy_context().run, run)
+                if inspect.iscoroutinefunction(f):
+                    task = asyncio.create_task(async_wrapper(f, prompt_id, unique_id, index, args=inputs))
+                else:
+                    task = asyncio.create_task(thread_wrapper(f, prompt_id, unique_id, index, args=inputs))
                 # Give the task a chance to execute without yielding
                 await asyncio.sleep(0)
                 if task.done():
@@ -325,8 +354,8 @@ def merge_result_data(results, obj):
             output.append([o[i] for o in results])
     return output
 
-async def get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=None, pre_execute_cb=None, v3_data=None):
-    return_values = await _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, obj.FUNCTION, allow_interrupt=True, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, v3_data=v3_data)
+async def get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=None, pre_execute_cb=None, v3_data=None, thread_pool=None):
+    return_values = await _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, obj.FUNCTION, allow_interrupt=True, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, v3_data=v3_data, thread_pool=thread_pool)
     has_pending_task = any(isinstance(r, asyncio.Task) and not r.done() for r in return_values)
     if has_pending_task:
         return return_values, {}, False, has_pending_task
@@ -512,7 +541,8 @@ async def execute(server, dynprompt, caches, current_item, extra_data, executed,
             def pre_execute_cb(call_index):
                 # TODO - How to handle this with async functions without contextvars (which requires Python 3.12)?
                 GraphBuilder.set_default_prefix(unique_id, call_index, 0)
-            output_data, output_ui, has_subgraph, has_pending_tasks = await get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, v3_data=v3_data)
+            thread_pool = get_node_thread_pool() if is_thread_safe(class_def) else None
+            output_data, output_ui, has_subgraph, has_pending_tasks = await get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, v3_data=v3_data, thread_pool=thread_pool)
             if has_pending_tasks:
                 pending_async_nodes[unique_id] = output_data
                 unblock = execution_list.add_external_block(unique_id)
@@ -669,12 +699,13 @@ class PromptExecutor:
         asyncio.run(self.execute_async(prompt, prompt_id, extra_data, execute_outputs))
 
     async def execute_async(self, prompt, prompt_id, extra_data={}, execute_outputs=[]):
-        nodes.interrupt_processing(False)
+        comfy.model_management.set_processing_prompt(prompt_id)
 
         if "client_id" in extra_data:
             self.server.client_id = extra_data["client_id"]
         else:
             self.server.client_id = None
+        current_execution_server.set(self.server)
 
         self.status_messages = []
         self.add_message("execution_start", { "prompt_id": prompt_id}, broadcast=False)
@@ -1093,6 +1124,8 @@ async def validate_prompt(prompt_id, prompt, partial_execution_list: Union[list[
     return (True, None, list(good_outputs), node_errors)
 
 MAXIMUM_HISTORY_SIZE = 10000
+# Number of queued items (in the order they would run) a select function of PromptQueue.get chooses from.
+SELECT_LOOKAHEAD = 64
 
 class PromptQueue:
     def __init__(self, server):
@@ -1100,30 +1133,84 @@ class PromptQueue:
         self.mutex = threading.RLock()
         self.not_empty = threading.Condition(self.mutex)
         self.task_counter = 0
-        self.queue = []
+        self.queue = PendingPrompts(fair_share=args.fair_share_queue, weights=parse_client_weights(args.client_weight))
         self.currently_running = {}
-        self.history = {}
+        self.history = HistoryStore(MAXIMUM_HISTORY_SIZE)
         self.flags = {}
+        self.version = 0
+        self.snapshot = None
+        # With --prefetch-models, the ModelPrefetcher reading the model files of the next queued prompts.
+        self.prefetcher = None
+
+    def changed(self):
+        """Called with the mutex held after the queued or running items changed."""
+        self.version += 1
+        self.snapshot = None
+        if self.prefetcher is not None and len(self.currently_running) > 0:
+            self.prefetcher.schedule(self.queue.order(PREFETCH_LOOKAHEAD))
+        self.server.queue_updated()
+
+    def set_client_weight(self, client_id, weight):
+        """With --fair-share-queue a client with weight 2 runs two prompts for every prompt of a client with weight 1."""
+        with self.mutex:
+            self.queue.weights[client_id] = weight
+            self.changed()
 
     def put(self, item):
         with self.mutex:
-            heapq.heappush(self.queue, item)
-            self.server.queue_updated()
-            self.not_empty.notify()
-
-    def get(self, timeout=None):
+            self.queue.add(item)
+            self.changed()
+            # Wake every waiting worker, with a select function the first one might not take it.
+            self.not_empty.notify_all()
+
+    def get(self, timeout=None, select=None):
+        """
+        Pops the next item to execute. select (used by the multi device workers) gets the first
+        SELECT_LOOKAHEAD queued items in the order they would run and returns which item to run or
+        None to leave them all to other workers.
+        """
         with self.not_empty:
-            while len(self.queue) == 0:
-                self.not_empty.wait(timeout=timeout)
-                if timeout is not None and len(self.queue) == 0:
+            waited = False
+            while True:
+                if len(self.queue) > 0:
+                    candidates = self.queue.order(1 if select is None else SELECT_LOOKAHEAD)
+                    item = candidates[0] if select is None else select(candidates)
+                    if item is not None:
+                        break
+                if waited and timeout is not None:
                     return None
-            item = heapq.heappop(self.queue)
+                self.not_empty.wait(timeout=timeout)
+                waited = True
+            self.queue.take(item)
+            if len(self.queue) > 0 and select is not None:
+                # Items passed over for this worker may now go to another one.
+                self.not_empty.notify_all()
             i = self.task_counter
             self.currently_running[i] = copy.deepcopy(item)
             self.task_counter += 1
-            self.server.queue_updated()
+            self.changed()
             return (item, i)
 
+    def get_matching(self, match, max_items, lookahead=None):
+        """
+        Pops, without waiting, up to max_items of the queued items (the first lookahead ones in queue order)
+        for which match(item) is True. Used to run prompts together with one returned by get.
+        """
+        with self.mutex:
+            candidates = self.queue.order(lookahead)
+            items = [item for item in candidates if match(item)][:max_items]
+            if len(items) == 0:
+                return []
+            out = []
+            for item in items:
+                self.queue.take(item)
+                i = self.task_counter
+                self.currently_running[i] = copy.deepcopy(item)
+                self.task_counter += 1
+                out.append((item, i))
+            self.changed()
+            return out
+
     class ExecutionStatus(NamedTuple):
         status_str: Literal['success', 'error']
         completed: bool
@@ -1132,39 +1219,47 @@ class PromptQueue:
     def task_done(self, item_id, history_result,
                   status: Optional['PromptQueue.ExecutionStatus'], process_item=None):
         with self.mutex:
-            prompt = self.currently_running.pop(item_id)
-            if len(self.history) > MAXIMUM_HISTORY_SIZE:
-                self.history.pop(next(iter(self.history)))
+            prompt = self.currently_running[item_id]
 
-            status_dict: Optional[dict] = None
-            if status is not None:
-                status_dict = copy.deepcopy(status._asdict())
+        status_dict: Optional[dict] = None
+        if status is not None:
+            status_dict = copy.deepcopy(status._asdict())
 
-            if process_item is not None:
-                prompt = process_item(prompt)
+        if process_item is not None:
+            prompt = process_item(prompt)
 
-            self.history[prompt[1]] = {
-                "prompt": prompt,
-                "outputs": {},
-                'status': status_dict,
-            }
-            self.history[prompt[1]].update(history_result)
-            self.server.queue_updated()
+        entry = {
+            "prompt": prompt,
+            "outputs": {},
+            'status': status_dict,
+        }
+        entry.update(history_result)
+        # The database write doesn't hold the queue mutex. The prompt stays in the running items
+        # until it is in the history so clients always find it in one of them.
+        self.history.add(prompt[1], entry)
+        with self.mutex:
+            self.currently_running.pop(item_id)
+            self.changed()
+
+    def get_snapshot(self) -> QueueSnapshot:
+        """
+        The running and pending items, built once per change of the queue and shared by every reader
+        until the next one. Read-safe as long as queue items are immutable.
+        """
+        with self.mutex:
+            if self.snapshot is None:
+                self.snapshot = QueueSnapshot(self.version, tuple(self.currently_running.values()), tuple(self.queue.order()))
+            return self.snapshot
 
     # Note: slow
     def get_current_queue(self):
-        with self.mutex:
-            out = []
-            for x in self.currently_running.values():
-                out += [x]
-            return (out, copy.deepcopy(self.queue))
+        snapshot = self.get_snapshot()
+        return (list(snapshot.running), copy.deepcopy(list(snapshot.pending)))
 
     # read-safe as long as queue items are immutable
     def get_current_queue_volatile(self):
-        with self.mutex:
-            running = [x for x in self.currently_running.values()]
-            queued = copy.copy(self.queue)
-            return (running, queued)
+        snapshot = self.get_snapshot()
+        return (list(snapshot.running), list(snapshot.pending))
 
     def get_tasks_remaining(self):
         with self.mutex:
@@ -1172,56 +1267,38 @@ class PromptQueue:
 
     def wipe_queue(self):
         with self.mutex:
-            self.queue = []
-            self.server.queue_updated()
+            self.queue.clear()
+            self.changed()
 
     def delete_queue_item(self, function):
         with self.mutex:
-            for x in range(len(self.queue)):
-                if function(self.queue[x]):
-                    if len(self.queue) == 1:
-                        self.wipe_queue()
-                    else:
-                        self.queue.pop(x)
-                        heapq.heapify(self.queue)
-                    self.server.queue_updated()
+            for item in self.queue.order():
+                if function(item):
+                    self.queue.remove(item)
+                    self.changed()
                     return True
         return False
 
-    def get_history(self, prompt_id=None, max_items=None, offset=-1, map_function=None):
-        with self.mutex:
-            if prompt_id is None:
-                out = {}
-                i = 0
-                if offset < 0 and max_items is not None:
-                    offset = len(self.history) - max_items
-                for k in self.history:
-                    if i >= offset:
-                        p = self.history[k]
-                        if map_function is not None:
-                            p = map_function(p)
-                        out[k] = p
-                        if max_items is not None and len(out) >= max_items:
-                            break
-                    i += 1
-                return out
-            elif prompt_id in self.history:
-                p = self.history[prompt_id]
-                if map_function is None:
-                    p = copy.deepcopy(p)
-                else:
-                    p = map_function(p)
-                return {prompt_id: p}
-            else:
-                return {}
+    def get_history(self, prompt_id=None, max_items=None, offset=-1, map_function=None, before=None, after=None, client_id=None, since=None):
+        """
+        The history entry of prompt_id, or a page of the history (see HistoryStore.page) as a dict
+        ordered from the oldest entry. The entries must not be modified.
+        """
+        if prompt_id is None:
+            out = {}
+            for k, p in self.history.page(max_items=max_items, offset=offset, before=before, after=after, client_id=client_id, since=since):
+                out[k] = p if map_function is None else map_function(p)
+            return out
+        p = self.history.get(prompt_id)
+        if p is None:
+            return {}
+        return {prompt_id: p if map_function is None else map_function(p)}
 
     def wipe_history(self):
-        with self.mutex:
-            self.history = {}
+        self.history.clear()
 
     def delete_history_item(self, id_to_delete):
-        with self.mutex:
-            self.history.pop(id_to_delete, None)
+        self.history.delete(id_to_delete)
 
     def set_flag(self, name, data):
         with self.mutex:
@@ -8,6 +8,7 @@ from typing import Literal, List
 from collections.abc import Collection
 
 from comfy.cli_args import args
+from app.model_catalog import model_catalog, hf_cache_index
 
 supported_pt_extensions: set[str] = {'.ckpt', '.pt', '.pt2', '.bin', '.pth', '.safetensors', '.pkl', '.sft', '.gguf'}
 
@@ -22,7 +23,10 @@ else:
 models_dir = os.path.join(base_path, "models")
 
 # HF cache integration - add early so custom nodes can inherit these paths
-hf_cache_dir = os.environ.get("HF_HOME", "/media/zudva/cache/hf_cache")
+def get_hf_cache_dir() -> str:
+    return os.environ.get("HF_CACHE_DIR", None) or os.environ.get("HF_HOME", "/media/zudva/cache/hf_cache")
+
+hf_cache_dir = get_hf_cache_dir()
 hf_cache_exists = os.path.exists(hf_cache_dir)
 
 folder_names_and_paths["checkpoints"] = ([os.path.join(models_dir, "checkpoints")], supported_pt_extensions)
@@ -322,40 +326,9 @@ def recursive_search(directory: str, excluded_dir_names: list[str] | None=None)
     if not os.path.isdir(directory):
         return [], {}
 
-    if excluded_dir_names is None:
-        excluded_dir_names = []
-
-    result = []
-    dirs = {}
-
-    # Attempt to add the initial directory to dirs with error handling
-    try:
-        dirs[directory] = os.path.getmtime(directory)
-    except FileNotFoundError:
-        logging.warning(f"Warning: Unable to access {directory}. Skipping this path.")
-
     logging.debug("recursive file list on directory {}".format(directory))
-    dirpath: str
-    subdirs: list[str]
-    filenames: list[str]
-
-    for dirpath, subdirs, filenames in os.walk(directory, followlinks=True, topdown=True):
-        subdirs[:] = [d for d in subdirs if d not in excluded_dir_names]
-        for file_name in filenames:
-            try:
-                relative_path = os.path.relpath(os.path.join(dirpath, file_name), directory)
-                result.append(relative_path)
-            except:
-                logging.warning(f"Warning: Unable to access {file_name}. Skipping this file.")
-                continue
-
-        for d in subdirs:
-            path: str = os.path.join(dirpath, d)
-            try:
-                dirs[path] = os.path.getmtime(path)
-            except FileNotFoundError:
-                logging.warning(f"Warning: Unable to access {path}. Skipping this path.")
-                continue
+    # Served from the model catalog which only lists directories again when their mtime changed.
+    result, dirs = model_catalog.search(directory, excluded_dir_names)
     logging.debug("found {} files".format(len(result)))
     return result, dirs
 
@@ -435,6 +408,8 @@ def get_full_path(folder_name: str, filename: str) -> str | None:
     filename = os.path.relpath(os.path.join("/", filename), "/")
     for x in folders[0]:
         full_path = os.path.join(x, filename)
+        if model_catalog.contains(x, filename, [".git"]):
+            return full_path
         if os.path.isfile(full_path):
             return full_path
         elif os.path.isdir(full_path):
@@ -450,24 +425,12 @@ def get_full_path(folder_name: str, filename: str) -> str | None:
                 logging.warning("WARNING path {} exists but doesn't link anywhere, skipping.".format(full_path))
 
     # If not found in configured model folders, try HF cache directory as a fallback
-    try:
-        hf_cache = os.environ.get("HF_HOME", "/media/zudva/cache/hf_cache")
-        if hf_cache and os.path.isdir(hf_cache):
-            # Look for matching filename (file or directory) in HF cache
-            for dirpath, dirs, files in os.walk(hf_cache):
-                # Check if filename is a file
-                basename = os.path.basename(filename)
-                if basename in files:
-                    return os.path.join(dirpath, basename)
-                # Check if filename is a directory (for sharded models)
-                if basename in dirs:
-                    return os.path.join(dirpath, basename)
-                # Check for full path match with snapshots (e.g., models--Wan/snapshots/hash/high_noise_model)
-                candidate = os.path.join(dirpath, filename)
-                if os.path.isdir(candidate) or os.path.isfile(candidate):
-                    return candidate
-    except Exception:
-        pass
+    hf_cache = get_hf_cache_dir()
+    if hf_cache:
+        try:
+            return hf_cache_index.lookup(hf_cache, filename)
+        except Exception as e:
+            logging.warning("Unable to search the HF cache {}: {}".format(hf_cache, e))
 
     return None
 
@@ -518,17 +481,13 @@ def cached_filename_list_(folder_name: str) -> tuple[list[str], dict[str, float]
         return None
     out = filename_list_cache[folder_name]
 
-    for x in out[1]:
-        time_modified = out[1][x]
-        folder = x
-        if os.path.getmtime(folder) != time_modified:
-            return None
-
     folders = folder_names_and_paths[folder_name]
+    current = {}
     for x in folders[0]:
         if os.path.isdir(x):
-            if x not in out[1]:
-                return None
+            current.update(model_catalog.directory_mtimes(x, [".git"]))
+    if current != out[1]:
+        return None
 
     return out
 
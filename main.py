@@ -12,7 +12,9 @@ import utils.extra_config
 import logging
 import sys
 from comfy_execution.progress import get_progress_state
-from comfy_execution.utils import get_executing_context
+from comfy_execution.utils import get_executing_context, get_execution_server
+from comfy_execution.device_workers import DeviceScheduler, DeviceWorker
+from comfy_execution.prefetch import ModelPrefetcher
 from comfy_api import feature_flags
 
 
@@ -178,6 +180,7 @@ import comfy.utils
 
 import execution
 import server
+from comfy_execution import prompt_batching
 from protocol import BinaryEventTypes
 import nodes
 import comfy.model_management
@@ -197,7 +200,9 @@ def cuda_malloc_warning():
             logging.warning("\nWARNING: this card most likely does not support cuda-malloc, if you get \"CUDA error\" please run ComfyUI with: --disable-cuda-malloc\n")
 
 
-def prompt_worker(q, server_instance):
+def prompt_worker(q, server_instance, scheduler=None, worker=None):
+    if worker is not None:
+        comfy.model_management.set_thread_torch_device(worker.device)
     current_time: float = 0.0
     cache_type = execution.CacheType.CLASSIC
     if args.cache_lru > 0:
@@ -207,7 +212,15 @@ def prompt_worker(q, server_instance):
     elif args.cache_none:
         cache_type = execution.CacheType.NONE
 
-    e = execution.PromptExecutor(server_instance, cache_type=cache_type, cache_args={ "lru" : args.cache_lru, "ram" : args.cache_ram } )
+    cache_args = { "lru" : args.cache_lru, "ram" : args.cache_ram, "disk" : args.cache_disk, "disk_size" : args.cache_disk_size }
+    executor_server = server_instance
+    if scheduler is not None and len(scheduler.workers) > 1:
+        # The workers of the devices run prompts at the same time, each keeps its own client_id and last_node_id.
+        executor_server = prompt_batching.PromptServerView(server_instance)
+    e = execution.PromptExecutor(executor_server, cache_type=cache_type, cache_args=cache_args)
+    # With --batch-prompts, the executors of the other prompts of a batch.
+    executors = [e]
+    server_instance.prompt_executors.append(e)
     last_gc_collect = 0
     need_gc = False
     gc_collect_interval = 10.0
@@ -217,30 +230,47 @@ def prompt_worker(q, server_instance):
         if need_gc:
             timeout = max(gc_collect_interval - (current_time - last_gc_collect), 0.0)
 
-        queue_item = q.get(timeout=timeout)
+        if scheduler is not None:
+            queue_item = scheduler.get(q, worker, timeout=timeout)
+        else:
+            queue_item = q.get(timeout=timeout)
         if queue_item is not None:
             item, item_id = queue_item
             execution_start_time = time.perf_counter()
             prompt_id = item[1]
-            server_instance.last_prompt_id = prompt_id
+            e.server.last_prompt_id = prompt_id
 
-            sensitive = item[5]
-            extra_data = item[3].copy()
-            for k in sensitive:
-                extra_data[k] = sensitive[k]
+            batch = [queue_item]
+            if args.batch_prompts > 1:
+                batch += q.get_matching(prompt_batching.batch_matcher(item), args.batch_prompts - 1, lookahead=prompt_batching.BATCH_LOOKAHEAD)
 
-            e.execute(item[2], prompt_id, extra_data, item[4])
+            if len(batch) > 1:
+                while len(executors) < len(batch):
+                    executors.append(execution.PromptExecutor(prompt_batching.PromptServerView(server_instance), cache_type=cache_type, cache_args=cache_args))
+                    server_instance.prompt_executors.append(executors[-1])
+                prompt_batching.execute_batch(executors, [x[0] for x in batch], device=worker.device if worker is not None else None)
+            else:
+                sensitive = item[5]
+                extra_data = item[3].copy()
+                for k in sensitive:
+                    extra_data[k] = sensitive[k]
+
+                e.execute(item[2], prompt_id, extra_data, item[4])
             need_gc = True
 
-            remove_sensitive = lambda prompt: prompt[:5] + prompt[6:]
-            q.task_done(item_id,
-                        e.history_result,
-                        status=execution.PromptQueue.ExecutionStatus(
-                            status_str='success' if e.success else 'error',
-                            completed=e.success,
-                            messages=e.status_messages), process_item=remove_sensitive)
-            if server_instance.client_id is not None:
-                server_instance.send_sync("executing", {"node": None, "prompt_id": prompt_id}, server_instance.client_id)
+            for (item, item_id), executor in zip(batch, executors):
+                if scheduler is not None:
+                    scheduler.task_done(worker, item)
+
+                remove_sensitive = lambda prompt: prompt[:5] + prompt[6:]
+                q.task_done(item_id,
+                            executor.history_result,
+                            status=execution.PromptQueue.ExecutionStatus(
+                                status_str='success' if executor.success else 'error',
+                                completed=executor.success,
+                                messages=executor.status_messages), process_item=remove_sensitive)
+                if executor.server.client_id is not None:
+                    server_instance.send_sync("executing", {"node": None, "prompt_id": item[1]}, executor.server.client_id)
 
             current_time = time.perf_counter()
             execution_time = current_time - execution_start_time
@@ -261,7 +291,8 @@ def prompt_worker(q, server_instance):
             last_gc_collect = 0
 
         if free_memory:
-            e.reset()
+            for executor in executors:
+                executor.reset()
             need_gc = True
             last_gc_collect = 0
 
@@ -291,25 +322,28 @@ def hijack_progress(server_instance):
         if node_id is None and executing_context is not None:
             node_id = executing_context.node_id
         comfy.model_management.throw_exception_if_processing_interrupted()
+        # The prompt, client_id and last node of the executor running in this context.
+        execution_server = get_execution_server() or server_instance
         if prompt_id is None:
-            prompt_id = server_instance.last_prompt_id
+            prompt_id = execution_server.last_prompt_id
         if node_id is None:
-            node_id = server_instance.last_node_id
+            node_id = execution_server.last_node_id
         progress = {"value": value, "max": total, "prompt_id": prompt_id, "node": node_id}
         get_progress_state().update_progress(node_id, value, total, preview_image)
 
-        server_instance.send_sync("progress", progress, server_instance.client_id)
+        client_id = execution_server.client_id
+        server_instance.send_sync("progress", progress, client_id)
         if preview_image is not None:
             # Only send old method if client doesn't support preview metadata
             if not feature_flags.supports_feature(
                 server_instance.sockets_metadata,
-                server_instance.client_id,
+                client_id,
                 "supports_preview_metadata",
             ):
                 server_instance.send_sync(
                     BinaryEventTypes.UNENCODED_PREVIEW_IMAGE,
                     preview_image,
-                    server_instance.client_id,
+                    client_id,
                 )
 
     comfy.utils.set_progress_bar_global_hook(hook)
@@ -369,7 +403,25 @@ def start_comfyui(asyncio_loop=None):
     prompt_server.add_routes()
     hijack_progress(prompt_server)
 
-    threading.Thread(target=prompt_worker, daemon=True, args=(prompt_server.prompt_queue, prompt_server,)).start()
+    if args.prefetch_models > 0:
+        prompt_server.prompt_queue.prefetcher = ModelPrefetcher(int(args.prefetch_models * 1024 * 1024 * 1024))
+        prompt_server.prompt_queue.prefetcher.start()
+
+    devices = comfy.model_management.get_all_torch_devices() if args.multi_gpu else []
+    if len(devices) > 1 or args.model_affinity_window > 0:
+        if len(devices) <= 1:
+            devices = [comfy.model_management.get_torch_device()]
+        if args.model_affinity_window > 0:
+            window = min(args.model_affinity_window, 64)
+            scheduler = DeviceScheduler([DeviceWorker(device) for device in devices], lookahead=window, fairness_window=window)
+        else:
+            scheduler = DeviceScheduler([DeviceWorker(device) for device in devices])
+        prompt_server.prompt_scheduler = scheduler
+        for worker in scheduler.workers:
+            logging.info("Starting prompt worker on device: {}".format(worker.device))
+            threading.Thread(target=prompt_worker, daemon=True, args=(prompt_server.prompt_queue, prompt_server, scheduler, worker)).start()
+    else:
+        threading.Thread(target=prompt_worker, daemon=True, args=(prompt_server.prompt_queue, prompt_server,)).start()
 
     if args.quick_test_for_ci:
         exit(0)
@@ -1,9 +1,16 @@
 import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
 import torch
 
 from comfy.cli_args import args
 
-from PIL import ImageFile, UnidentifiedImageError
+from PIL import Image, ImageFile, UnidentifiedImageError
+from PIL.PngImagePlugin import PngInfo
 
 def conditioning_set_values(conditioning, values={}, append=False):
     c = []
@@ -58,3 +65,56 @@ def image_alpha_fix(destination, source):
         destination = torch.nn.functional.pad(destination, (0, 1))
         destination[..., -1] = 1.0
     return destination, source
+
+_image_save_pool: Optional[ThreadPoolExecutor] = None
+_image_save_lock = threading.Lock()
+# (folder, filename) -> [next counter, number of batches being saved], so batches saved concurrently
+# with the same prefix don't get the same counter before their files exist.
+_image_save_counters = {}
+
+def get_image_save_pool() -> Optional[ThreadPoolExecutor]:
+    """Returns the pool images are compressed and written in, or None when they are saved on the calling thread."""
+    global _image_save_pool
+    if args.image_save_workers <= 0:
+        return None
+    with _image_save_lock:
+        if _image_save_pool is None:
+            _image_save_pool = ThreadPoolExecutor(max_workers=args.image_save_workers, thread_name_prefix="comfy_image_save")
+    return _image_save_pool
+
+def images_to_uint8(images: torch.Tensor) -> np.ndarray:
+    """A batch of images in [0, 1] as uint8, converted on the device they are on so a single uint8 copy goes to the CPU."""
+    return (images * 255.0).clamp(0, 255).to(torch.uint8).cpu().numpy()
+
+def save_png_images(images: torch.Tensor, full_output_folder: str, filename: str, counter: int, pnginfo: Optional[PngInfo] = None, compress_level=4) -> list[str]:
+    """
+    Saves a batch of images as {filename}_{counter:05}_.png files with increasing counters (%batch_num%
+    in filename is replaced by the index in the batch) and returns the file names once they are written.
+    The images are PNG compressed in parallel in the image save pool.
+    """
+    if isinstance(images, torch.Tensor):
+        frames = images_to_uint8(images)
+    else:
+        frames = [images_to_uint8(image) for image in images]
+    key = (os.path.normcase(os.path.abspath(full_output_folder)), os.path.normcase(filename))
+    with _image_save_lock:
+        reserved = _image_save_counters.setdefault(key, [counter, 0])
+        counter = max(counter, reserved[0])
+        reserved[0] = counter + len(frames)
+        reserved[1] += 1
+
+    def save(batch_number):
+        file = f"{filename.replace('%batch_num%', str(batch_number))}_{counter + batch_number:05}_.png"
+        Image.fromarray(frames[batch_number]).save(os.path.join(full_output_folder, file), pnginfo=pnginfo, compress_level=compress_level)
+        return file
+
+    try:
+        pool = get_image_save_pool()
+        if pool is None or len(frames) == 1:
+            return [save(i) for i in range(len(frames))]
+        return list(pool.map(save, range(len(frames))))
+    finally:
+        with _image_save_lock:
+            reserved[1] -= 1
+            if reserved[1] == 0:
+                del _image_save_counters[key]
@@ -49,8 +49,8 @@ if args.enable_manager:
 def before_node_execution():
     comfy.model_management.throw_exception_if_processing_interrupted()
 
-def interrupt_processing(value=True):
-    comfy.model_management.interrupt_current_processing(value)
+def interrupt_processing(value=True, prompt_id=None):
+    comfy.model_management.interrupt_current_processing(value, prompt_id=prompt_id)
 
 MAX_RESOLUTION=16384
 
@@ -518,6 +518,7 @@ class LoadLatent:
 
     RETURN_TYPES = ("LATENT", )
     FUNCTION = "load"
+    THREAD_SAFE = True
 
     def load(self, latent):
         latent_path = folder_paths.get_annotated_filepath(latent)
@@ -1592,6 +1593,7 @@ class SaveImage:
 
     RETURN_TYPES = ()
     FUNCTION = "save_images"
+    THREAD_SAFE = True
 
     OUTPUT_NODE = True
 
@@ -1601,32 +1603,28 @@ class SaveImage:
     def save_images(self, images, filename_prefix="ComfyUI", prompt=None, extra_pnginfo=None):
         filename_prefix += self.prefix_append
         full_output_folder, filename, counter, subfolder, filename_prefix = folder_paths.get_save_image_path(filename_prefix, self.output_dir, images[0].shape[1], images[0].shape[0])
+        metadata = None
+        if not args.disable_metadata:
+            metadata = PngInfo()
+            if prompt is not None:
+                metadata.add_text("prompt", json.dumps(prompt))
+            if extra_pnginfo is not None:
+                for x in extra_pnginfo:
+                    metadata.add_text(x, json.dumps(extra_pnginfo[x]))
+
         results = list()
-        for (batch_number, image) in enumerate(images):
-            i = 255. * image.cpu().numpy()
-            img = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
-            metadata = None
-            if not args.disable_metadata:
-                metadata = PngInfo()
-                if prompt is not None:
-                    metadata.add_text("prompt", json.dumps(prompt))
-                if extra_pnginfo is not None:
-                    for x in extra_pnginfo:
-                        metadata.add_text(x, json.dumps(extra_pnginfo[x]))
-
-            filename_with_batch_num = filename.replace("%batch_num%", str(batch_number))
-            file = f"{filename_with_batch_num}_{counter:05}_.png"
-            img.save(os.path.join(full_output_folder, file), pnginfo=metadata, compress_level=self.compress_level)
+        for file in node_helpers.save_png_images(images, full_output_folder, filename, counter, pnginfo=metadata, compress_level=self.compress_level):
             results.append({
                 "filename": file,
                 "subfolder": subfolder,
                 "type": self.type
             })
-            counter += 1
 
         return { "ui": { "images": results } }
 
 class PreviewImage(SaveImage):
+    THREAD_SAFE = True
+
     def __init__(self):
         self.output_dir = folder_paths.get_temp_directory()
         self.type = "temp"
@@ -1654,6 +1652,7 @@ class LoadImage:
 
     RETURN_TYPES = ("IMAGE", "MASK")
     FUNCTION = "load_image"
+    THREAD_SAFE = True
     def load_image(self, image):
         image_path = folder_paths.get_annotated_filepath(image)
 
@@ -1731,6 +1730,7 @@ class LoadImageMask:
 
     RETURN_TYPES = ("MASK",)
     FUNCTION = "load_image"
+    THREAD_SAFE = True
     def load_image(self, image, channel):
         image_path = folder_paths.get_annotated_filepath(image)
         i = node_helpers.pillow(Image.open, image_path)
@@ -1800,6 +1800,7 @@ class ImageScale:
                               "crop": (s.crop_methods,)}}
     RETURN_TYPES = ("IMAGE",)
     FUNCTION = "upscale"
+    THREAD_SAFE = True
 
     CATEGORY = "image/upscaling"
 
@@ -1827,6 +1828,7 @@ class ImageScaleBy:
                               "scale_by": ("FLOAT", {"default": 1.0, "min": 0.01, "max": 8.0, "step": 0.01}),}}
     RETURN_TYPES = ("IMAGE",)
     FUNCTION = "upscale"
+    THREAD_SAFE = True
 
     CATEGORY = "image/upscaling"
 
@@ -1846,6 +1848,7 @@ class ImageInvert:
 
     RETURN_TYPES = ("IMAGE",)
     FUNCTION = "invert"
+    THREAD_SAFE = True
 
     CATEGORY = "image"
 
@@ -2353,6 +2356,7 @@ async def init_builtin_extra_nodes():
         "nodes_chroma_radiance.py",
         "nodes_model_patch.py",
         "nodes_easycache.py",
+        "nodes_step_cache.py",
         "nodes_audio_encoder.py",
         "nodes_rope.py",
         "nodes_logic.py",
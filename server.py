@@ -27,11 +27,13 @@ import mimetypes
 from comfy.cli_args import args
 import comfy.utils
 import comfy.model_management
+import comfy.weight_pool
 from comfy_api import feature_flags
 import node_helpers
 from comfyui_version import __version__
 from app.frontend_management import FrontendManager, parse_version
 from comfy_api.internal import _ComfyNodeInternal
+from comfy_execution.fair_queue import PRIORITY_CLASSES
 
 from app.user_manager import UserManager
 from app.model_manager import ModelFileManager
@@ -198,6 +200,8 @@ class PromptServer():
         self.internal_routes = InternalRoutes(self)
         self.supports = ["custom_nodes_from_web"]
         self.prompt_queue = execution.PromptQueue(self)
+        self.queue_response = None
+        self.prompt_scheduler = None
         self.loop = loop
         self.messages = asyncio.Queue()
         self.client_session:Optional[aiohttp.ClientSession] = None
@@ -230,8 +234,11 @@ class PromptServer():
         logging.info(f"[Prompt Server] web root: {self.web_root}")
         routes = web.RouteTableDef()
         self.routes = routes
+        self.last_prompt_id = None
         self.last_node_id = None
         self.client_id = None
+        # Every PromptExecutor of the prompt workers (--multi-gpu) and of their batches (--batch-prompts).
+        self.prompt_executors = []
 
         self.on_prompt_handlers = []
 
@@ -631,6 +638,33 @@ class PromptServer():
             }
             return web.json_response(system_stats)
 
+        @routes.get("/queue/model_affinity")
+        async def get_model_affinity_stats(request):
+            if self.prompt_scheduler is None:
+                return web.json_response({"error": "Model affinity scheduling is only available with --model-affinity-window or --multi-gpu"}, status=404)
+            return web.json_response(self.prompt_scheduler.stats())
+
+        @routes.get("/cache/memory")
+        async def get_cache_memory(request):
+            usage = None
+            for executor in list(self.prompt_executors):
+                executor_usage = executor.caches.memory_usage()
+                if executor_usage is None:
+                    continue
+                if usage is None:
+                    usage = {"totals": {}, "nodes": []}
+                for kind, nbytes in executor_usage["totals"].items():
+                    usage["totals"][kind] = usage["totals"].get(kind, 0) + nbytes
+                usage["nodes"] += executor_usage["nodes"]
+            if usage is None:
+                return web.json_response({"error": "Per node memory accounting is only available with --cache-ram"}, status=404)
+            usage["nodes"].sort(key=lambda x: x["total"], reverse=True)
+            return web.json_response(usage)
+
+        @routes.get("/weight_pool")
+        async def get_weight_pool(request):
+            return web.json_response(comfy.weight_pool.weight_pool.stats())
+
         @routes.get("/features")
         async def get_features(request):
             return web.json_response(feature_flags.get_server_features())
@@ -696,31 +730,49 @@ class PromptServer():
 
         @routes.get("/history")
         async def get_history(request):
-            max_items = request.rel_url.query.get("max_items", None)
-            if max_items is not None:
-                max_items = int(max_items)
+            try:
+                max_items = request.rel_url.query.get("max_items", None)
+                if max_items is not None:
+                    max_items = int(max_items)
 
-            offset = request.rel_url.query.get("offset", None)
-            if offset is not None:
-                offset = int(offset)
-            else:
-                offset = -1
+                offset = request.rel_url.query.get("offset", None)
+                if offset is not None:
+                    offset = int(offset)
+                else:
+                    offset = -1
+
+                since = request.rel_url.query.get("since", None)
+                if since is not None:
+                    since = int(since)
+            except ValueError:
+                return web.Response(status=400)
+
+            # Keyset pagination: the page right before or after the entry of a prompt_id.
+            before = request.rel_url.query.get("before", None)
+            after = request.rel_url.query.get("after", None)
+            client_id = request.rel_url.query.get("client_id", None)
 
-            return web.json_response(self.prompt_queue.get_history(max_items=max_items, offset=offset))
+            # Pages that aren't in memory are database queries, run off the event loop.
+            history = await asyncio.get_running_loop().run_in_executor(None, lambda: self.prompt_queue.get_history(max_items=max_items, offset=offset, before=before, after=after, client_id=client_id, since=since))
+            return web.json_response(history)
 
         @routes.get("/history/{prompt_id}")
         async def get_history_prompt_id(request):
             prompt_id = request.match_info.get("prompt_id", None)
-            return web.json_response(self.prompt_queue.get_history(prompt_id=prompt_id))
+            history = await asyncio.get_running_loop().run_in_executor(None, lambda: self.prompt_queue.get_history(prompt_id=prompt_id))
+            return web.json_response(history)
 
         @routes.get("/queue")
         async def get_queue(request):
-            queue_info = {}
-            current_queue = self.prompt_queue.get_current_queue_volatile()
-            remove_sensitive = lambda queue: [x[:5] for x in queue]
-            queue_info['queue_running'] = remove_sensitive(current_queue[0])
-            queue_info['queue_pending'] = remove_sensitive(current_queue[1])
-            return web.json_response(queue_info)
+            snapshot = self.prompt_queue.get_snapshot()
+            # Encoded once per version of the queue however many clients poll it.
+            if self.queue_response is None or self.queue_response[0] != snapshot.version:
+                remove_sensitive = lambda queue: [x[:5] for x in queue]
+                queue_info = {}
+                queue_info['queue_running'] = remove_sensitive(snapshot.running)
+                queue_info['queue_pending'] = remove_sensitive(snapshot.pending)
+                self.queue_response = (snapshot.version, json.dumps(queue_info))
+            return web.Response(text=self.queue_response[1], content_type="application/json")
 
         @routes.post("/prompt")
         async def post_prompt(request):
@@ -753,6 +805,16 @@ class PromptServer():
 
                 if "client_id" in json_data:
                     extra_data["client_id"] = json_data["client_id"]
+                if "priority" in json_data:
+                    if json_data["priority"] not in PRIORITY_CLASSES:
+                        error = {
+                            "type": "invalid_priority",
+                            "message": "Invalid priority",
+                            "details": "priority must be one of: {}".format(", ".join(PRIORITY_CLASSES)),
+                            "extra_info": {}
+                        }
+                        return web.json_response({"error": error, "node_errors": {}}, status=400)
+                    extra_data["priority"] = json_data["priority"]
                 if valid[0]:
                     outputs_to_execute = valid[2]
                     sensitive = {}
@@ -799,7 +861,7 @@ class PromptServer():
             # Check if a specific prompt_id was provided for targeted interruption
             prompt_id = json_data.get('prompt_id')
             if prompt_id:
-                currently_running, _ = self.prompt_queue.get_current_queue()
+                currently_running, _ = self.prompt_queue.get_current_queue_volatile()
 
                 # Check if the prompt_id matches any currently running prompt
                 should_interrupt = False
@@ -811,7 +873,7 @@ class PromptServer():
                         break
 
                 if should_interrupt:
-                    nodes.interrupt_processing()
+                    nodes.interrupt_processing(prompt_id=prompt_id)
                 else:
                     logging.info(f"Prompt {prompt_id} is not currently running, skipping interrupt")
             else:
@@ -835,14 +897,17 @@ class PromptServer():
         @routes.post("/history")
         async def post_history(request):
             json_data =  await request.json()
-            if "clear" in json_data:
-                if json_data["clear"]:
-                    self.prompt_queue.wipe_history()
-            if "delete" in json_data:
-                to_delete = json_data['delete']
-                for id_to_delete in to_delete:
-                    self.prompt_queue.delete_history_item(id_to_delete)
 
+            def update_history():
+                if "clear" in json_data:
+                    if json_data["clear"]:
+                        self.prompt_queue.wipe_history()
+                if "delete" in json_data:
+                    to_delete = json_data['delete']
+                    for id_to_delete in to_delete:
+                        self.prompt_queue.delete_history_item(id_to_delete)
+
+            await asyncio.get_running_loop().run_in_executor(None, update_history)
             return web.Response(status=200)
 
     async def setup(self):
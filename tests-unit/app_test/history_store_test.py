@@ -0,0 +1,93 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import db
+from app.database.models import Base
+from app.history_store import HistoryStore
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "history.db"))
+    Base.metadata.create_all(engine)
+    monkeypatch.setattr(db, "_DB_AVAILABLE", True)
+    monkeypatch.setattr(db, "Session", sessionmaker(bind=engine))
+
+
+def make_entry(i, client_id=None):
+    client_id = client_id or "client_{}".format(i % 3)
+    return {"prompt": [i, "prompt_{}".format(i), {}, {"client_id": client_id}, []], "outputs": {"9": {"images": [i]}},
+            "status": {"status_str": "success", "completed": True, "messages": []}}
+
+
+def fill(store, count):
+    for i in range(count):
+        store.add("prompt_{}".format(i), make_entry(i))
+
+
+def ids(page):
+    return [prompt_id for prompt_id, _ in page]
+
+
+def expected(*numbers):
+    return ["prompt_{}".format(i) for i in numbers]
+
+
+def test_memory_history_is_capped():
+    store = HistoryStore(max_size=5)
+    fill(store, 8)
+    assert ids(store.page()) == expected(3, 4, 5, 6, 7)
+    assert ids(store.page(max_items=2)) == expected(6, 7)
+    assert ids(store.page(max_items=2, offset=1)) == expected(4, 5)
+    assert ids(store.page(max_items=2, before="prompt_5")) == expected(3, 4)
+    assert ids(store.page(after="prompt_5")) == expected(6, 7)
+    assert store.get("prompt_1") is None
+    assert store.get("prompt_7")["outputs"] == {"9": {"images": [7]}}
+
+
+def test_persisted_history_pages(database):
+    store = HistoryStore(max_size=5, cache_size=4)
+    fill(store, 20)
+    assert len(store.entries) == 4
+
+    # A new store, as after a restart, reads the same pages from the database.
+    for s in (store, HistoryStore(max_size=5, cache_size=4)):
+        # The page size is capped to max_size.
+        assert ids(s.page()) == expected(15, 16, 17, 18, 19)
+        assert ids(s.page(offset=0)) == expected(0, 1, 2, 3, 4)
+        assert ids(s.page(max_items=50, after="prompt_3")) == expected(4, 5, 6, 7, 8)
+        assert ids(s.page(max_items=3)) == expected(17, 18, 19)
+        assert ids(s.page(max_items=3, offset=2)) == expected(2, 3, 4)
+        assert ids(s.page(max_items=3, before="prompt_17")) == expected(14, 15, 16)
+        assert ids(s.page(max_items=3, before="prompt_2")) == expected(0, 1)
+        assert ids(s.page(max_items=2, after="prompt_15")) == expected(16, 17)
+        assert ids(s.page(max_items=3, client_id="client_1")) == expected(13, 16, 19)
+        assert ids(s.page(max_items=3, before="missing")) == []
+        assert s.get("prompt_3") == make_entry(3)
+
+    store.add("prompt_20", make_entry(20))
+    store.delete("prompt_18")
+    store.delete("prompt_2")
+    assert ids(store.page(max_items=4)) == expected(16, 17, 19, 20)
+    assert ids(store.page(max_items=3, offset=1)) == expected(1, 3, 4)
+    assert store.get("prompt_2") is None
+
+    restarted = HistoryStore(max_size=5, cache_size=4)
+    restarted.add("prompt_21", make_entry(21))
+    assert ids(restarted.page(max_items=3)) == expected(19, 20, 21)
+
+    restarted.clear()
+    assert restarted.page() == []
+    assert HistoryStore(max_size=5).page() == []
+
+
+def test_history_from_before_the_database_is_kept(database, monkeypatch):
+    HistoryStore(max_size=5).add("prompt_0", make_entry(0))
+    monkeypatch.setattr(db, "_DB_AVAILABLE", False)
+    store = HistoryStore(max_size=5)
+    store.add("prompt_1", make_entry(1))
+    store.add("prompt_0", make_entry(0, client_id="again"))
+    monkeypatch.setattr(db, "_DB_AVAILABLE", True)
+    assert ids(store.page()) == expected(1, 0)
+    assert store.get("prompt_0")["prompt"][3] == {"client_id": "again"}
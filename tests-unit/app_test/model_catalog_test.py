@@ -0,0 +1,158 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import folder_paths
+from app import model_catalog as model_catalog_module
+from app.database import db
+from app.database.models import Base
+from app.model_catalog import HFCacheIndex, ModelCatalog
+
+
+def touch(*parts):
+    path = os.path.join(*parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "w").close()
+    return path
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    models = str(tmp_path / "models")
+    touch(models, "a.safetensors")
+    touch(models, "sub", "b.safetensors")
+    touch(models, "sub", "deep", "c.ckpt")
+    touch(models, ".git", "HEAD")
+    return models
+
+
+@pytest.fixture
+def count_scans(monkeypatch):
+    scanned = []
+    scan_directory = model_catalog_module.scan_directory
+
+    def counting_scan(path, excluded_dir_names):
+        scanned.append(path)
+        return scan_directory(path, excluded_dir_names)
+    monkeypatch.setattr(model_catalog_module, "scan_directory", counting_scan)
+    return scanned
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "catalog.db"))
+    Base.metadata.create_all(engine)
+    monkeypatch.setattr(db, "_DB_AVAILABLE", True)
+    monkeypatch.setattr(db, "Session", sessionmaker(bind=engine))
+
+
+def test_search_matches_recursive_walk(model_dir):
+    files, dirs = ModelCatalog().search(model_dir, [".git"])
+    assert sorted(files) == sorted(["a.safetensors", os.path.join("sub", "b.safetensors"), os.path.join("sub", "deep", "c.ckpt")])
+    assert sorted(dirs) == sorted([model_dir, os.path.join(model_dir, "sub"), os.path.join(model_dir, "sub", "deep")])
+
+
+def test_only_changed_directories_are_listed(model_dir, count_scans):
+    catalog = ModelCatalog(refresh_interval=0)
+    catalog.search(model_dir, [".git"])
+    assert len(count_scans) == 3
+
+    count_scans.clear()
+    catalog.search(model_dir, [".git"])
+    assert count_scans == []
+
+    new_file = touch(model_dir, "sub", "new.safetensors")
+    os.utime(os.path.dirname(new_file), (1, 1))
+    files, _ = catalog.search(model_dir, [".git"])
+    assert count_scans == [os.path.join(model_dir, "sub")]
+    assert os.path.join("sub", "new.safetensors") in files
+
+    os.remove(os.path.join(model_dir, "sub", "deep", "c.ckpt"))
+    os.rmdir(os.path.join(model_dir, "sub", "deep"))
+    os.utime(os.path.join(model_dir, "sub"), (2, 2))
+    files, dirs = catalog.search(model_dir, [".git"])
+    assert os.path.join("sub", "deep", "c.ckpt") not in files
+    assert os.path.join(model_dir, "sub", "deep") not in dirs
+
+
+def test_refresh_interval(model_dir, count_scans):
+    catalog = ModelCatalog(refresh_interval=3600)
+    catalog.search(model_dir, [".git"])
+    touch(model_dir, "late.safetensors")
+    files, _ = catalog.search(model_dir, [".git"])
+    assert "late.safetensors" not in files
+    assert catalog.contains(model_dir, "a.safetensors", [".git"])
+    assert catalog.contains(model_dir, "sub", [".git"])
+    assert not catalog.contains(model_dir, "missing.safetensors", [".git"])
+
+
+def test_index_persists_in_database(model_dir, count_scans, database):
+    ModelCatalog().search(model_dir, [".git"])
+    count_scans.clear()
+
+    # A new process only stats the directories.
+    files, _ = ModelCatalog().search(model_dir, [".git"])
+    assert count_scans == []
+    assert os.path.join("sub", "deep", "c.ckpt") in files
+
+
+def test_get_filename_list_uses_catalog(model_dir, monkeypatch):
+    monkeypatch.setitem(folder_paths.folder_names_and_paths, "catalog_test", ([model_dir], folder_paths.supported_pt_extensions))
+    monkeypatch.setattr(folder_paths.model_catalog, "refresh_interval", 0)
+    assert "a.safetensors" in folder_paths.get_filename_list("catalog_test")
+    assert folder_paths.get_full_path("catalog_test", "sub/b.safetensors") == os.path.join(model_dir, "sub/b.safetensors")
+
+    touch(model_dir, "sub", "deep", "new.safetensors")
+    os.utime(os.path.join(model_dir, "sub", "deep"), (1, 1))
+    assert os.path.join("sub", "deep", "new.safetensors") in folder_paths.get_filename_list("catalog_test")
+
+
+@pytest.fixture
+def hf_cache(tmp_path):
+    cache = str(tmp_path / "hf_cache")
+    repo = os.path.join(cache, "hub", "models--Org--Model")
+    for snapshot in ("aaaa", "bbbb"):
+        touch(repo, "snapshots", snapshot, "model.safetensors")
+        touch(repo, "snapshots", snapshot, "high_noise_model", "diffusion_pytorch_model-00001-of-00002.safetensors")
+    os.utime(os.path.join(repo, "snapshots", "aaaa"), (10, 10))
+    os.utime(os.path.join(repo, "snapshots", "bbbb"), (5, 5))
+    touch(repo, "blobs", "0123456789abcdef")
+    touch(cache, "loose", "other.gguf")
+    return cache, repo
+
+
+def test_hf_cache_index_resolves_newest_snapshot(hf_cache):
+    cache, repo = hf_cache
+    index = HFCacheIndex(ModelCatalog(refresh_interval=0))
+    snapshot = os.path.join(repo, "snapshots", "aaaa")
+    assert index.lookup(cache, "model.safetensors") == os.path.join(snapshot, "model.safetensors")
+    assert index.lookup(cache, "high_noise_model") == os.path.join(snapshot, "high_noise_model")
+    assert index.lookup(cache, os.path.join("high_noise_model", "diffusion_pytorch_model-00001-of-00002.safetensors")) == os.path.join(snapshot, "high_noise_model", "diffusion_pytorch_model-00001-of-00002.safetensors")
+    assert index.lookup(cache, "some/dir/other.gguf") == os.path.join(cache, "loose", "other.gguf")
+    assert index.lookup(cache, "0123456789abcdef") is None
+    assert index.lookup(cache, "missing.safetensors") is None
+
+    # refs/main takes precedence over the snapshot mtimes.
+    touch(repo, "refs", "main")
+    with open(os.path.join(repo, "refs", "main"), "w") as f:
+        f.write("bbbb")
+    assert index.lookup(cache, "model.safetensors") == os.path.join(repo, "snapshots", "bbbb", "model.safetensors")
+
+    with open(os.path.join(repo, "refs", "main"), "w") as f:
+        f.write("aaaa")
+    os.utime(os.path.join(repo, "refs", "main"), (20, 20))
+    assert index.lookup(cache, "model.safetensors") == os.path.join(snapshot, "model.safetensors")
+
+
+def test_hf_cache_index_is_only_built_once(hf_cache, count_scans):
+    cache, repo = hf_cache
+    index = HFCacheIndex(ModelCatalog(refresh_interval=0))
+    index.lookup(cache, "missing.safetensors")
+    assert os.path.join(repo, "blobs") not in count_scans
+    built = index.indexes[cache]
+    count_scans.clear()
+    index.lookup(cache, "also_missing.safetensors")
+    assert count_scans == []
+    assert index.indexes[cache][2] is built[2]
@@ -5,8 +5,8 @@ import os
 import av
 import io
 from fractions import Fraction
-from comfy_api.input_impl.video_types import VideoFromFile, VideoFromComponents
-from comfy_api.util.video_types import VideoComponents
+from comfy_api.input_impl.video_types import VideoFromFile, VideoFromComponents, VideoEncoder
+from comfy_api.util.video_types import VideoComponents, VideoContainer, VideoCodec
 from comfy_api.input.basic_types import AudioInput
 from av.error import InvalidDataError
 
@@ -52,7 +52,7 @@ def create_test_video(width=4, height=4, frames=3, fps=30):
 
         for i in range(frames):
             frame = av.VideoFrame.from_ndarray(
-                torch.ones(height, width, 3, dtype=torch.uint8).numpy() * (i * 85),
+                torch.ones(height, width, 3, dtype=torch.uint8).numpy() * (i * 85 % 256),
                 format="rgb24",
             )
             frame = frame.reformat(format="yuv420p")
@@ -237,3 +237,73 @@ def test_duration_consistency(video_components):
     manual_duration = float(components.images.shape[0] / components.frame_rate)
 
     assert duration == pytest.approx(manual_duration)
+
+
+@pytest.mark.parametrize("background", [False, True])
+def test_video_from_file_iter_frames(background):
+    file_path = create_test_video(frames=7)
+    try:
+        video = VideoFromFile(file_path)
+        images = video.get_components().images
+        assert images.shape == (7, 4, 4, 3)
+
+        chunks = list(video.iter_frames(chunk_size=2, start=1, end=6, stride=2, background=background))
+        assert [c.shape[0] for c in chunks] == [2, 1]
+        assert torch.equal(torch.cat(chunks), images[1:6:2])
+
+        frames = torch.cat(list(video.iter_frames(chunk_size=3, dtype=torch.uint8, background=background)))
+        assert frames.dtype == torch.uint8
+        assert torch.equal(frames.float() / 255.0, images)
+
+        # Stopping early doesn't decode the rest.
+        for chunk in video.iter_frames(chunk_size=1, background=background):
+            break
+        assert torch.equal(chunk, images[:1])
+    finally:
+        os.unlink(file_path)
+
+
+def test_video_from_components_iter_frames(video_components):
+    video = VideoFromComponents(video_components)
+    chunks = list(video.iter_frames(chunk_size=2, stride=2))
+    assert len(chunks) == 1
+    assert torch.equal(chunks[0], video_components.images[0::2])
+    frames = next(video.iter_frames(dtype=torch.uint8))
+    assert torch.equal(frames, (video_components.images * 255).round().byte())
+
+
+def test_video_encoder_writes_chunks_like_save_to(sample_audio):
+    components = VideoComponents(images=torch.rand(20, 16, 16, 3), audio=sample_audio, frame_rate=Fraction(30))
+    expected = io.BytesIO()
+    VideoFromComponents(components).save_to(expected, format=VideoContainer.MP4, metadata={"prompt": {"1": {}}})
+
+    output = io.BytesIO()
+    with VideoFromComponents.encoder(output, Fraction(30), sample_audio, VideoContainer.MP4, metadata={"prompt": {"1": {}}}) as encoder:
+        for i in range(0, 20, 6):
+            encoder.write(components.images[i:i + 6])
+    assert encoder.frame_count == 20
+    assert output.getvalue() == expected.getvalue()
+
+    # The original video is re-encoded from its decoded frames.
+    webm = io.BytesIO()
+    with VideoEncoder(webm, Fraction(30), "libvpx-vp9", container_format="webm") as encoder:
+        encoder.write(components.images)
+    reencoded = io.BytesIO()
+    VideoFromFile(webm).save_to(reencoded, format=VideoContainer.MP4, codec=VideoCodec.H264)
+    video = VideoFromFile(reencoded)
+    assert video.get_container_format().startswith("mov,mp4")
+    assert video.get_components().images.shape == (20, 16, 16, 3)
+
+
+def test_video_encoder_errors():
+    with pytest.raises(ValueError):
+        with VideoEncoder(io.BytesIO(), Fraction(30), "h264", container_format="mp4") as encoder:
+            encoder.write(torch.rand(2, 16, 16, 3))
+            raise ValueError("the images couldn't be produced")
+    assert not encoder.thread.is_alive()
+
+    # An error on the encoding thread is raised by close, odd sizes aren't valid for yuv420p.
+    with pytest.raises(av.error.FFmpegError):
+        with VideoEncoder(io.BytesIO(), Fraction(30), "h264", container_format="mp4") as encoder:
+            encoder.write(torch.rand(2, 15, 15, 3))
+    assert not encoder.thread.is_alive()
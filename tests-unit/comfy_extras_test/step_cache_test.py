@@ -0,0 +1,109 @@
+import torch
+
+from comfy.cli_args import args
+args.cpu = True
+
+import comfy.samplers  # noqa: E402
+from comfy_extras.nodes_step_cache import StepCacheHolder, step_cache_predict_noise_wrapper, step_cache_sample_wrapper  # noqa: E402
+
+
+class FakePatcher:
+    patches_uuid = "patches"
+
+
+class FakeGuider:
+    def __init__(self, model_patcher, conds, holder):
+        self.model_patcher = model_patcher
+        self.conds = conds
+        self.cfg = 7.0
+        self.model_options = {"transformer_options": {"step_cache": holder}}
+        self.model_calls = []
+
+    def predict_noise(self, x, timestep, model_options={}, seed=None):
+        def model(x, timestep, model_options, seed=None):
+            self.model_calls.append(float(timestep[0]))
+            active = [c["value"] for c in self.conds["positive"] if c.get("timestep_start", 1e9) >= timestep[0] >= c.get("timestep_end", -1)]
+            return x * 0.1 + sum(active)
+        return step_cache_predict_noise_wrapper(Executor(self, model), x, timestep, model_options, seed=seed)
+
+    def sample(self, noise, latent_image, sampler, sigmas, denoise_mask=None, callback=None, disable_pbar=False, seed=None):
+        def outer_sample(noise, latent_image, sampler, sigmas, denoise_mask=None, callback=None, disable_pbar=False, seed=None):
+            x = noise * sigmas[0] + latent_image
+            for i in range(len(sigmas) - 1):
+                denoised = self.predict_noise(x, sigmas[i:i + 1], self.model_options, seed=seed)
+                x = x + (x - denoised) / sigmas[i] * (sigmas[i + 1] - sigmas[i])
+            return x
+        return step_cache_sample_wrapper(Executor(self, outer_sample), noise, latent_image, sampler, sigmas, denoise_mask, callback, disable_pbar, seed)
+
+
+class Executor:
+    def __init__(self, class_obj, function):
+        self.class_obj = class_obj
+        self.function = function
+
+    def __call__(self, *args, **kwargs):
+        return self.function(*args, **kwargs)
+
+
+def make_conds(late_value):
+    return {"positive": [{"uuid": "early", "value": 1.0, "timestep_end": 5.0},
+                         {"uuid": "late", "value": late_value, "timestep_start": 5.0}]}
+
+
+# The model patcher of a node output that was cached between the runs.
+MODEL_PATCHER = FakePatcher()
+
+
+def sample(holder, late_value=2.0, seed=0):
+    guider = FakeGuider(MODEL_PATCHER, make_conds(late_value), holder)
+    sigmas = torch.linspace(10.0, 1.0, 10)
+    noise = torch.randn((1, 4, 8, 8), generator=torch.Generator().manual_seed(seed))
+    out = guider.sample(noise, torch.zeros_like(noise), comfy.samplers.ksampler("euler"), sigmas, seed=seed)
+    return out, guider
+
+
+def test_same_run_reuses_every_call():
+    holder = StepCacheHolder(1024 * 1024)
+    first, guider = sample(holder)
+    assert len(guider.model_calls) == 9
+    second, guider = sample(holder)
+    assert guider.model_calls == []
+    assert torch.equal(first, second)
+    # Another seed doesn't match.
+    _, guider = sample(holder, seed=1)
+    assert len(guider.model_calls) == 9
+
+
+def test_changed_late_cond_resumes_from_the_shared_steps():
+    holder = StepCacheHolder(1024 * 1024)
+    sample(holder)
+    out, guider = sample(holder, late_value=3.0)
+    # Only the calls at sigmas <= 5 see the changed cond.
+    assert guider.model_calls == [5.0, 4.0, 3.0, 2.0]
+    assert torch.equal(out, sample(StepCacheHolder(1024 * 1024), late_value=3.0)[0])
+
+
+def test_outputs_are_dropped_beyond_max_bytes():
+    entry = 1 * 4 * 8 * 8 * 4
+    holder = StepCacheHolder(4 * entry)
+    sample(holder)
+    assert len(holder.entries) == 4 and holder.size == 4 * entry
+    # The oldest calls were dropped so the run recomputes from the start.
+    _, guider = sample(holder)
+    assert len(guider.model_calls) == 9
+    holder.set(next(iter(holder.entries)), torch.zeros(1, 4, 8, 8))
+    assert holder.size == 4 * entry
+
+
+def test_calls_with_conds_that_cant_be_hashed_are_not_stored():
+    holder = StepCacheHolder(1024 * 1024)
+    guider = FakeGuider(MODEL_PATCHER, make_conds(2.0), holder)
+    # A cond added during sampling without an original the run could hash.
+    guider.conds["positive"].append({"uuid": "added", "value": 0.0, "timestep_end": 5.0})
+    sigmas = torch.linspace(10.0, 1.0, 10)
+    noise = torch.randn((1, 4, 8, 8))
+    run = holder.start_run(guider, noise, torch.zeros_like(noise), comfy.samplers.ksampler("euler"), sigmas, None, 0)
+    del run.cond_keys["added"]
+    guider.model_options["transformer_options"]["step_cache_run"] = run
+    guider.predict_noise(noise, sigmas[:1], guider.model_options)
+    assert run.unhashable and len(holder.entries) == 0
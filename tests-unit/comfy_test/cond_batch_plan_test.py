@@ -0,0 +1,59 @@
+import torch
+
+from comfy.cli_args import args
+args.cpu = True
+
+import comfy.conds  # noqa: E402
+import comfy.samplers  # noqa: E402
+
+
+class FakeModel:
+    def __init__(self, memory_per_item=10):
+        self.memory_per_item = memory_per_item
+        self.memory_required_calls = 0
+        self.manual_cast_dtype = None
+
+    def get_dtype(self):
+        return torch.float32
+
+    def memory_required(self, input_shape, cond_shapes={}):
+        self.memory_required_calls += 1
+        return input_shape[0] * self.memory_per_item
+
+
+def make_to_run(lengths, cond_indices=None, shape=(1, 4, 8, 8)):
+    to_run = []
+    for i, length in enumerate(lengths):
+        conditioning = {"c_crossattn": comfy.conds.CONDCrossAttn(torch.zeros(1, length, 16))}
+        p = comfy.samplers.get_area_and_mult({"model_conds": conditioning, "uuid": i}, torch.zeros(shape), torch.zeros(1))
+        to_run.append((p, i % 2 if cond_indices is None else cond_indices[i]))
+    return to_run
+
+
+def test_cond_and_uncond_run_together():
+    model = FakeModel()
+    assert comfy.samplers.plan_cond_batches(model, make_to_run([77, 77]), free_memory=1000) == [[1, 0]]
+
+
+def test_batches_are_packed_within_free_memory():
+    model = FakeModel()
+    to_run = make_to_run([77] * 9)
+    # 4 items fit: 4 * 10 * 1.5 < 65
+    plan = comfy.samplers.plan_cond_batches(model, to_run, free_memory=65)
+    assert plan == [[8, 7, 6, 5], [4, 3, 2, 1], [0]]
+
+    # The estimates are cached, the next steps don't call memory_required.
+    calls = model.memory_required_calls
+    assert comfy.samplers.plan_cond_batches(model, to_run, free_memory=65) == plan
+    assert model.memory_required_calls == calls
+
+    # An item that doesn't fit on its own still runs.
+    assert comfy.samplers.plan_cond_batches(model, to_run[:2], free_memory=1) == [[1], [0]]
+
+
+def test_cross_attention_conds_are_padded_only_to_save_calls():
+    model = FakeModel()
+    to_run = make_to_run([77, 154, 77, 154])
+    assert comfy.samplers.plan_cond_batches(model, to_run, free_memory=1000) == [[3, 2, 1, 0]]
+    # With two items per batch the ones of the same length go together.
+    assert comfy.samplers.plan_cond_batches(model, to_run, free_memory=35) == [[2, 0], [3, 1]]
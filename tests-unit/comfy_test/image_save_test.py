@@ -0,0 +1,47 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from comfy.cli_args import args
+args.cpu = True
+
+import folder_paths  # noqa: E402
+import nodes  # noqa: E402
+
+
+@pytest.fixture
+def output_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(folder_paths, "get_output_directory", lambda: str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.parametrize("workers", [0, 4])
+def test_save_images(output_dir, monkeypatch, workers):
+    monkeypatch.setattr(args, "image_save_workers", workers)
+    images = torch.rand(5, 8, 6, 3) * 1.2 - 0.1
+    prompt = {"1": {"class_type": "SaveImage", "inputs": {}}}
+    out = nodes.SaveImage().save_images(images, "test/%batch_num%", prompt=prompt, extra_pnginfo={"workflow": {"nodes": []}})
+
+    results = out["ui"]["images"]
+    assert [r["filename"] for r in results] == ["{}_{:05}_.png".format(i, i + 1) for i in range(5)]
+    for image, result in zip(images, results):
+        assert result["subfolder"] == "test" and result["type"] == "output"
+        with Image.open(os.path.join(output_dir, "test", result["filename"])) as img:
+            # The same pixels as the previous per image numpy conversion.
+            assert np.array_equal(np.asarray(img), np.clip(255. * image.numpy(), 0, 255).astype(np.uint8))
+            assert json.loads(img.info["prompt"]) == prompt
+            assert json.loads(img.info["workflow"]) == {"nodes": []}
+
+
+def test_concurrent_saves_get_their_own_counters(output_dir):
+    save = nodes.SaveImage()
+    with ThreadPoolExecutor(4) as pool:
+        outputs = list(pool.map(lambda _: save.save_images(torch.rand(3, 4, 4, 3), "same"), range(8)))
+    files = [r["filename"] for out in outputs for r in out["ui"]["images"]]
+    assert sorted(files) == ["same_{:05}_.png".format(i) for i in range(1, 25)]
+    assert len(os.listdir(output_dir)) == 24
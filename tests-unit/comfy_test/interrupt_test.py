@@ -0,0 +1,42 @@
+import contextvars
+
+import pytest
+
+from comfy.cli_args import args
+args.cpu = True
+
+import comfy.model_management  # noqa: E402
+from comfy.model_management import InterruptProcessingException  # noqa: E402
+
+
+def start(prompt_id):
+    context = contextvars.copy_context()
+    context.run(comfy.model_management.set_processing_prompt, prompt_id)
+    return context
+
+
+def interrupted(context):
+    try:
+        context.run(comfy.model_management.throw_exception_if_processing_interrupted)
+    except InterruptProcessingException:
+        return True
+    return False
+
+
+def test_interrupting_a_prompt_only_stops_its_worker():
+    first, second = start("first"), start("second")
+    comfy.model_management.interrupt_current_processing(prompt_id="second")
+    assert not interrupted(first)
+    assert interrupted(second)
+    assert not interrupted(second)
+
+
+def test_interrupting_everything_stops_each_worker_once():
+    first, second = start("first"), start("second")
+    comfy.model_management.interrupt_current_processing()
+    assert interrupted(second) and interrupted(first)
+    assert not interrupted(first) and not interrupted(second)
+    # A prompt started after the interrupt runs.
+    assert not interrupted(start("third"))
+    with pytest.raises(InterruptProcessingException):
+        comfy.model_management.throw_exception_if_processing_interrupted()
@@ -0,0 +1,90 @@
+import torch
+
+from comfy.cli_args import args
+args.cpu = True
+
+import comfy.lora  # noqa: E402
+import comfy.model_patcher  # noqa: E402
+from comfy.weight_adapter import LoRAAdapter  # noqa: E402
+
+
+def make_lora(weight_shape, rank, alpha=None, dora_scale=None):
+    up = torch.randn(weight_shape[0], rank, *([1] * (len(weight_shape) - 2)))
+    down = torch.randn(rank, *weight_shape[1:])
+    return LoRAAdapter(set(), (up, down, alpha, None, dora_scale, None))
+
+
+def make_patches(shapes, loras=3):
+    patches = {}
+    for i, shape in enumerate(shapes):
+        key = "layer{}.weight".format(i)
+        patches[key] = [(0.5 + j, make_lora(shape, 4 + j * 4, alpha=float(j + 1)), 1.0, None, None) for j in range(loras)]
+    return patches
+
+
+def test_batched_diffs_match_calculate_weight():
+    shapes = [(16, 8), (16, 8), (32, 8), (16, 8), (8, 4, 3, 3)]
+    patches = make_patches(shapes)
+    weights = {k: torch.randn(s) for k, s in zip(patches, shapes)}
+    # Small enough to need two batches for the (16, 8) weights.
+    batches = comfy.lora.LowRankDiffBatches(patches, list(patches), {k: w.shape for k, w in weights.items()}, torch.device("cpu"), max_batch_memory=2 * 16 * 8 * 4)
+    for key in reversed(list(patches)):
+        expected = comfy.lora.calculate_weight(patches[key], weights[key].clone(), key)
+        diff = batches.pop(key)
+        assert torch.allclose(weights[key] + diff, expected, atol=1e-4)
+    assert batches.pending == {} and batches.diffs == {}
+
+
+def test_unsupported_patches_are_left_to_calculate_weight():
+    shape = (16, 8)
+    patches = make_patches([shape] * 4, loras=2)
+    keys = list(patches)
+    patches[keys[0]].append((1.0, make_lora(shape, 4, dora_scale=torch.ones(16, 1)), 1.0, None, None))
+    patches[keys[1]][0] = (1.0, patches[keys[1]][0][1], 0.5, None, None)
+    patches[keys[2]].append((1.0, (torch.ones(shape),), 1.0, None, None))
+    batches = comfy.lora.LowRankDiffBatches(patches, keys, {k: torch.Size(shape) for k in keys}, torch.device("cpu"))
+    assert list(batches.pending) == [keys[3]]
+    assert batches.pop(keys[0]) is None
+    assert batches.pop(keys[3]) is not None
+
+
+def test_model_patcher_batched_merge(monkeypatch):
+    monkeypatch.setattr(comfy.model_patcher, "merged_weight_cache", comfy.model_patcher.MergedWeightCache(0))
+    model = torch.nn.Sequential(*[torch.nn.Linear(8, 16, bias=False) for _ in range(3)])
+    patcher = comfy.model_patcher.ModelPatcher(model, torch.device("cpu"), torch.device("cpu"))
+    patches = make_patches([(16, 8)] * 3)
+    patcher.add_patches({"{}.weight".format(i): p[0][1] for i, p in enumerate(patches.values())}, 0.5)
+
+    patcher.patch_model(device_to=torch.device("cpu"))
+    expected = [m.weight.detach().clone() for m in model]
+    patcher.unpatch_model()
+
+    monkeypatch.setattr(args, "batched_lora_merge", True)
+    monkeypatch.setattr(comfy.lora, "calculate_weight", None)
+    patcher.patch_model(device_to=torch.device("cpu"))
+    for m, e in zip(model, expected):
+        assert torch.allclose(m.weight, e, atol=1e-4)
+    patcher.unpatch_model()
+
+
+def test_merged_weight_cache_hits_free_their_diffs(monkeypatch):
+    monkeypatch.setattr(comfy.model_patcher, "merged_weight_cache", comfy.model_patcher.MergedWeightCache(1024 * 1024))
+    monkeypatch.setattr(args, "batched_lora_merge", True)
+    created = []
+
+    class RecordedBatches(comfy.lora.LowRankDiffBatches):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            created.append(self)
+    monkeypatch.setattr(comfy.lora, "LowRankDiffBatches", RecordedBatches)
+
+    model = torch.nn.Sequential(*[torch.nn.Linear(8, 16, bias=False) for _ in range(3)])
+    patcher = comfy.model_patcher.ModelPatcher(model, torch.device("cpu"), torch.device("cpu"))
+    patches = make_patches([(16, 8)] * 3)
+    patcher.add_patches({"{}.weight".format(i): p[0][1] for i, p in enumerate(patches.values())}, 0.5)
+    for _ in range(2):
+        patcher.patch_model(device_to=torch.device("cpu"))
+        patcher.unpatch_model()
+    # Every weight came from the cache on the second load, no diff was calculated or left behind.
+    assert len(created[1].pending) == 0 and len(created[1].diffs) == 0
+    assert comfy.model_patcher.merged_weight_cache.stats()["hits"] == 3
@@ -0,0 +1,96 @@
+import pytest
+import torch
+
+from comfy.cli_args import args
+args.cpu = True
+
+import comfy.lora  # noqa: E402
+import comfy.model_patcher  # noqa: E402
+from comfy.model_patcher import MergedWeightCache, ModelPatcher  # noqa: E402
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = MergedWeightCache(1024 * 1024)
+    monkeypatch.setattr(comfy.model_patcher, "merged_weight_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def calculations(monkeypatch):
+    calculated = []
+    calculate_weight = comfy.lora.calculate_weight
+
+    def counting_calculate_weight(patches, weight, key, *args, **kwargs):
+        calculated.append(key)
+        return calculate_weight(patches, weight, key, *args, **kwargs)
+    monkeypatch.setattr(comfy.lora, "calculate_weight", counting_calculate_weight)
+    return calculated
+
+
+def patched_weight(patcher):
+    patcher.patch_model(device_to=torch.device("cpu"))
+    weight = patcher.model[0].weight.detach().clone()
+    patcher.unpatch_model()
+    return weight
+
+
+def test_reloading_a_patch_set_uses_the_cache(cache, calculations):
+    base = ModelPatcher(torch.nn.Sequential(torch.nn.Linear(8, 8, bias=False)), torch.device("cpu"), torch.device("cpu"))
+    original = base.model[0].weight.detach().clone()
+    diff = (torch.ones(8, 8),)
+    a = base.clone()
+    a.add_patches({"0.weight": ("diff", diff)}, 0.5)
+    b = base.clone()
+    b.add_patches({"0.weight": ("diff", diff)}, 1.0)
+
+    expected_a = patched_weight(a)
+    expected_b = patched_weight(b)
+    assert calculations == ["0.weight", "0.weight"]
+    assert torch.equal(base.model[0].weight, original)
+
+    assert torch.equal(patched_weight(a), expected_a)
+    assert torch.equal(patched_weight(b), expected_b)
+    assert calculations == ["0.weight", "0.weight"]
+    assert cache.stats()["hits"] == 2
+    assert torch.allclose(expected_b, original + 1.0)
+
+    # Adding a patch changes the signature.
+    a.add_patches({"0.weight": ("diff", diff)}, 1.0)
+    patched_weight(a)
+    assert len(calculations) == 3
+
+
+def test_lru_eviction_and_freed_models(cache, calculations):
+    cache.max_size = 2 * 8 * 8 * 4
+    patchers = []
+    for i in range(3):
+        p = ModelPatcher(torch.nn.Sequential(torch.nn.Linear(8, 8, bias=False)), torch.device("cpu"), torch.device("cpu"))
+        p.add_patches({"0.weight": ("diff", (torch.ones(8, 8),))}, 1.0)
+        patched_weight(p)
+        patchers.append(p)
+    assert cache.stats()["entries"] == 2
+    assert cache.size == cache.max_size
+
+    patched_weight(patchers[0])
+    assert len(calculations) == 4
+
+    # The entries of freed models are dropped instead of waiting for eviction.
+    del patchers[1:]
+    cache.max_size *= 2
+    p = ModelPatcher(torch.nn.Sequential(torch.nn.Linear(8, 8, bias=False)), torch.device("cpu"), torch.device("cpu"))
+    p.add_patches({"0.weight": ("diff", (torch.ones(8, 8),))}, 1.0)
+    patched_weight(p)
+    assert cache.stats()["entries"] == 2
+
+
+def test_patch_set_larger_than_the_cache_keeps_its_first_weights(cache, calculations):
+    cache.max_size = 2 * 8 * 8 * 4
+    p = ModelPatcher(torch.nn.Sequential(*[torch.nn.Linear(8, 8, bias=False) for _ in range(3)]), torch.device("cpu"), torch.device("cpu"))
+    p.add_patches({"{}.weight".format(i): ("diff", (torch.ones(8, 8),)) for i in range(3)}, 1.0)
+    for _ in range(2):
+        p.patch_model(device_to=torch.device("cpu"))
+        p.unpatch_model()
+    # The third weight doesn't evict the first two, which hit on the second load.
+    assert len(calculations) == 4
+    assert cache.stats()["hits"] == 2
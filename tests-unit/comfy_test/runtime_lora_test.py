@@ -0,0 +1,117 @@
+import pytest
+import torch
+
+from comfy.cli_args import args
+args.cpu = True
+
+import comfy.lora  # noqa: E402
+import comfy.model_patcher  # noqa: E402
+import comfy.ops  # noqa: E402
+from comfy.weight_adapter import LoRAAdapter  # noqa: E402
+
+CPU = torch.device("cpu")
+
+
+def make_model():
+    ops = comfy.ops.manual_cast
+    model = torch.nn.Sequential(ops.Linear(8, 16), ops.Conv2d(16, 4, 3, padding=1), ops.Linear(8, 8))
+    with torch.no_grad():
+        for p in model.parameters():
+            p.normal_()
+    return model
+
+
+def make_lora(weight_shape, rank, alpha):
+    up = torch.randn(weight_shape[0], rank, *([1] * (len(weight_shape) - 2)))
+    down = torch.randn(rank, *weight_shape[1:])
+    return LoRAAdapter(set(), (up, down, alpha, None, None, None))
+
+
+def make_patches(model, seed):
+    torch.manual_seed(seed)
+    return {"{}.weight".format(i): make_lora(m.weight.shape, 2 + i, float(i + 1)) for i, m in enumerate(model)}
+
+
+@torch.no_grad()
+def run(model):
+    x = torch.randn(1, 8, 6, 8, generator=torch.Generator().manual_seed(0))
+    x = model[0](x.movedim(1, -1)).movedim(-1, 1)
+    return model[2](model[1](x))
+
+
+@pytest.fixture
+def base(monkeypatch):
+    monkeypatch.setattr(comfy.model_patcher, "merged_weight_cache", comfy.model_patcher.MergedWeightCache(0))
+    return comfy.model_patcher.ModelPatcher(make_model(), CPU, CPU)
+
+
+def merged_output(patcher):
+    patcher.patch_model(device_to=CPU)
+    out = run(patcher.model)
+    patcher.unpatch_model()
+    return out
+
+
+def test_runtime_loras_match_merged_weights(base, monkeypatch):
+    a = base.clone()
+    a.add_patches(make_patches(base.model, 0), 0.7)
+    a.add_patches(make_patches(base.model, 1), 0.5)
+    expected = merged_output(a)
+    weights = [m.weight.detach().clone() for m in base.model]
+
+    monkeypatch.setattr(args, "runtime_lora", True)
+    assert a.runtime_lora_keys() == set(a.patches)
+    a.patch_model(device_to=CPU)
+    assert all(len(m.runtime_loras) == 1 for m in base.model)
+    assert all(torch.equal(m.weight, w) for m, w in zip(base.model, weights))
+    assert torch.allclose(run(base.model), expected, atol=1e-3)
+    assert base.model.current_weight_patches_uuid == comfy.model_patcher.RUNTIME_LORA_WEIGHTS
+
+    a.unpatch_model()
+    assert all(len(m.runtime_loras) == 0 for m in base.model)
+
+
+def test_switching_runtime_loras_keeps_the_weights(base, monkeypatch):
+    a = base.clone()
+    a.add_patches(make_patches(base.model, 0))
+    b = base.clone()
+    b.add_patches(make_patches(base.model, 1))
+    expected_a = merged_output(a)
+    expected_b = merged_output(b)
+
+    monkeypatch.setattr(args, "runtime_lora", True)
+    a.patch_model(device_to=CPU)
+    assert torch.allclose(run(base.model), expected_a, atol=1e-3)
+
+    monkeypatch.setattr(comfy.lora, "calculate_weight", None)
+    a.detach(unpatch_all=False)
+    assert b.partially_load(CPU, extra_memory=1e12) == 0
+    assert torch.allclose(run(base.model), expected_b, atol=1e-3)
+
+    # Going back to the base model removes the LoRAs without reloading either.
+    base.partially_load(CPU, extra_memory=1e12)
+    assert all(len(m.runtime_loras) == 0 for m in base.model)
+    base.unpatch_model()
+
+
+def test_other_patches_are_still_merged(base, monkeypatch):
+    monkeypatch.setattr(args, "runtime_lora", True)
+    a = base.clone()
+    a.add_patches(make_patches(base.model, 0))
+    a.add_patches({"1.weight": ("diff", (torch.ones(4, 16, 3, 3),))})
+    assert a.runtime_lora_keys() == {"0.weight", "2.weight"}
+    assert a.weight_patches_uuid() == a.patches_uuid
+
+    monkeypatch.setattr(args, "runtime_lora", False)
+    expected = merged_output(a)
+    monkeypatch.setattr(args, "runtime_lora", True)
+    a.patch_model(device_to=CPU)
+    assert [len(m.runtime_loras) for m in base.model] == [1, 0, 1]
+    assert torch.allclose(run(base.model), expected, atol=1e-3)
+
+    # Merging for good (saving the model...) applies everything to the weights.
+    a.unpatch_model()
+    a.patch_model(device_to=CPU, force_patch_weights=True)
+    assert all(len(m.runtime_loras) == 0 for m in base.model)
+    assert torch.allclose(run(base.model), expected, atol=1e-3)
+    a.unpatch_model()
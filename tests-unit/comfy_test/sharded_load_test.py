@@ -0,0 +1,61 @@
+import json
+import os
+
+import pytest
+import safetensors.torch
+import torch
+
+from comfy.cli_args import args
+args.cpu = True
+
+import comfy.utils  # noqa: E402
+
+
+@pytest.fixture
+def sharded_model(tmp_path):
+    model_dir = tmp_path / "model"
+    model_dir.mkdir()
+    sd = {"layer{}.weight".format(i): torch.randn(4, 4) for i in range(6)}
+    weight_map = {}
+    for shard in range(3):
+        name = "diffusion_pytorch_model-{:05d}-of-00003.safetensors".format(shard + 1)
+        keys = list(sd.keys())[shard * 2:shard * 2 + 2]
+        safetensors.torch.save_file({k: sd[k] for k in keys}, str(model_dir / name), metadata={"format": "pt"})
+        weight_map.update({k: name for k in keys})
+    with open(model_dir / "diffusion_pytorch_model.safetensors.index.json", "w") as f:
+        json.dump({"metadata": {}, "weight_map": weight_map}, f)
+    return str(model_dir), sd
+
+
+def test_get_sharded_safetensors_files(sharded_model, tmp_path):
+    model_dir, _ = sharded_model
+    shards = [os.path.join(model_dir, "diffusion_pytorch_model-{:05d}-of-00003.safetensors".format(i + 1)) for i in range(3)]
+    assert comfy.utils.get_sharded_safetensors_files(model_dir) == shards
+    assert comfy.utils.get_sharded_safetensors_files(os.path.join(model_dir, "diffusion_pytorch_model.safetensors.index.json")) == shards
+    assert comfy.utils.get_sharded_safetensors_files(shards[1]) is None
+    # A shard file loads on its own, whether its siblings are there or not.
+    single = comfy.utils.load_torch_file(shards[1])
+    os.remove(shards[0])
+    assert comfy.utils.load_torch_file(shards[1]).keys() == single.keys()
+    assert len(single) == 2
+
+    os.remove(os.path.join(model_dir, "diffusion_pytorch_model.safetensors.index.json"))
+    assert comfy.utils.get_sharded_safetensors_files(model_dir) == shards[1:]
+    assert comfy.utils.get_sharded_safetensors_files(str(tmp_path / "model.safetensors")) is None
+
+
+def test_load_torch_file_loads_sharded_models(sharded_model):
+    model_dir, sd = sharded_model
+    loaded, metadata = comfy.utils.load_torch_file(model_dir, return_metadata=True)
+    assert metadata == {"format": "pt"}
+    assert loaded.keys() == sd.keys()
+    for k in sd:
+        assert torch.equal(loaded[k], sd[k])
+
+
+def test_load_sharded_safetensors_converts_dtype(sharded_model):
+    model_dir, sd = sharded_model
+    loaded = comfy.utils.load_sharded_safetensors(comfy.utils.get_sharded_safetensors_files(model_dir), dtype=torch.float16, max_workers=2)
+    for k in sd:
+        assert loaded[k].dtype == torch.float16
+        assert torch.equal(loaded[k], sd[k].half())
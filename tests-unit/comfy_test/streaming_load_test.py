@@ -0,0 +1,105 @@
+import safetensors.torch
+import torch
+
+from comfy.cli_args import args
+args.cpu = True
+
+import comfy.utils  # noqa: E402
+
+
+class Model(torch.nn.Module):
+    def __init__(self, dtype=None):
+        super().__init__()
+        self.pos = torch.nn.Parameter(torch.empty(3, dtype=dtype))
+        self.blocks = torch.nn.ModuleList([torch.nn.Linear(4, 4, dtype=dtype) for _ in range(2)])
+        self.out = torch.nn.Linear(4, 2, dtype=dtype)
+
+
+def save_model(tmp_path):
+    sd = Model().state_dict()
+    for k in sd:
+        sd[k] = torch.randn(sd[k].shape)
+    path = str(tmp_path / "model.safetensors")
+    safetensors.torch.save_file(sd, path)
+    return path, sd
+
+
+def test_load_torch_file_records_sources(tmp_path):
+    path, sd = save_model(tmp_path)
+    loaded = comfy.utils.load_torch_file(path, stream_sources=True)
+    files = {}
+    for k in sd:
+        assert loaded[k].safetensors_source[0] == path
+        tensor = comfy.utils.read_safetensors_source(loaded[k], files)
+        assert tensor.data_ptr() != loaded[k].data_ptr()
+        assert torch.equal(tensor, sd[k])
+    for f in files.values():
+        f.close()
+    # Only the diffusion model loaders stream, the other files (loras, vaes...) load as before.
+    assert not hasattr(comfy.utils.load_torch_file(path)["out.weight"], "safetensors_source")
+
+
+def test_disable_mmap_streams_without_copying(tmp_path, monkeypatch):
+    path, sd = save_model(tmp_path)
+    monkeypatch.setattr(comfy.utils, "DISABLE_MMAP", True)
+    loaded = comfy.utils.load_torch_file(path, stream_sources=True)
+    assert all(hasattr(loaded[k], "safetensors_source") for k in sd)
+    model = Model()
+    comfy.utils.load_state_dict_streaming(model, loaded)
+    assert torch.equal(model.out.weight, sd["out.weight"])
+
+
+def test_load_state_dict_streaming(tmp_path):
+    path, sd = save_model(tmp_path)
+    loaded = comfy.utils.load_torch_file(path, stream_sources=True)
+    loaded["unexpected.weight"] = torch.zeros(1)
+    loaded["renamed_out.weight"] = loaded.pop("out.weight")
+    # Tensors that were converted after loading don't have a source anymore.
+    loaded["blocks.1.weight"] = loaded["blocks.1.weight"][:, :]
+
+    model = Model(dtype=torch.float16)
+    m, u = comfy.utils.load_state_dict_streaming(model, loaded)
+    assert m == ["out.weight"]
+    assert sorted(u) == ["renamed_out.weight", "unexpected.weight"]
+    assert "out.weight" not in loaded  # the caller's dict isn't modified
+    model_sd = model.state_dict()
+    for k in sd:
+        if k != "out.weight":
+            assert torch.equal(model_sd[k], sd[k].half())
+    assert "_load_from_state_dict" not in model.blocks[0].__dict__
+
+
+def test_load_state_dict_streaming_custom_layer_loading(tmp_path):
+    path, sd = save_model(tmp_path)
+    loaded = comfy.utils.load_torch_file(path, stream_sources=True)
+    loaded["out.weight_scale"] = torch.tensor(2.0)
+    seen = {}
+
+    class ScaledLinear(torch.nn.Linear):
+        def _load_from_state_dict(self, state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs):
+            weight = state_dict.pop(prefix + "weight")
+            seen["weight"] = weight
+            self.weight = torch.nn.Parameter(weight * state_dict.pop(prefix + "weight_scale"), requires_grad=False)
+            super()._load_from_state_dict(state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs)
+            missing_keys.remove(prefix + "weight")
+
+    model = Model()
+    model.out = ScaledLinear(4, 2)
+    m, u = comfy.utils.load_state_dict_streaming(model, loaded)
+    assert m == [] and u == []
+    assert not hasattr(seen["weight"], "safetensors_source")
+    assert torch.equal(model.out.weight, sd["out.weight"] * 2)
+
+
+def test_load_state_dict_streaming_keeps_in_place_changes(tmp_path):
+    path, sd = save_model(tmp_path)
+    loaded = comfy.utils.load_torch_file(path, stream_sources=True)
+    loaded["pos"].mul_(2.0)
+    model = Model()
+    override = model.out._load_from_state_dict
+    model.out._load_from_state_dict = override
+    comfy.utils.load_state_dict_streaming(model, loaded)
+    assert torch.equal(model.pos, sd["pos"] * 2.0)
+    assert torch.equal(model.blocks[0].weight, sd["blocks.0.weight"])
+    # An instance override of the loading function is still there after.
+    assert model.out.__dict__["_load_from_state_dict"] is override
@@ -0,0 +1,110 @@
+import pytest
+import torch
+
+from comfy.cli_args import args
+args.cpu = True
+
+import comfy.sd  # noqa: E402
+from comfy.model_patcher import ModelPatcher  # noqa: E402
+from comfy.sd import CLIP, TextEncoderCache  # noqa: E402
+
+
+class FakeTextEncoder(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.linear = torch.nn.Linear(1, 4, bias=False)
+        self.layer = None
+        self.encoded = 0
+
+    def reset_clip_options(self):
+        self.layer = None
+
+    def set_clip_options(self, options):
+        self.layer = options.get("layer", self.layer)
+
+    def encode_token_weights(self, token_weight_pairs):
+        self.encoded += 1
+        tokens = torch.tensor([[float(t) * w for t, w in token_weight_pairs["l"][0]]])
+        cond = self.linear(tokens.unsqueeze(-1)) + (self.layer or 0)
+        return cond, cond.mean(dim=1), {"attention_mask": torch.ones(tokens.shape)}
+
+
+def make_clip():
+    clip = CLIP(no_init=True)
+    clip.cond_stage_model = FakeTextEncoder()
+    clip.patcher = ModelPatcher(clip.cond_stage_model, torch.device("cpu"), torch.device("cpu"))
+    clip.tokenizer = None
+    clip.layer_idx = None
+    clip.tokenizer_options = {}
+    clip.use_clip_schedule = False
+    clip.apply_hooks_to_conds = None
+    return clip
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = TextEncoderCache(1024 * 1024)
+    monkeypatch.setattr(comfy.sd, "text_encoder_cache", cache)
+    return cache
+
+
+def tokens(*ids, weight=1.0):
+    return {"l": [[(i, weight) for i in ids]]}
+
+
+def test_same_tokens_skip_the_encoder(cache):
+    clip = make_clip()
+    first = clip.encode_from_tokens_scheduled(tokens(1, 2, 3))
+    second = clip.clone().encode_from_tokens_scheduled(tokens(1, 2, 3))
+    assert clip.cond_stage_model.encoded == 1
+    assert torch.equal(first[0][0], second[0][0])
+    assert torch.equal(first[0][1]["pooled_output"], second[0][1]["pooled_output"])
+    assert torch.equal(first[0][1]["attention_mask"], second[0][1]["attention_mask"])
+    assert cache.stats()["hits"] == 1
+
+    # Other tokens, weights or clip layers are encoded.
+    clip.encode_from_tokens(tokens(1, 2, 4))
+    clip.encode_from_tokens(tokens(1, 2, 3, weight=1.1))
+    layer = clip.clone()
+    layer.clip_layer(-2)
+    layer.encode_from_tokens(tokens(1, 2, 3))
+    assert clip.cond_stage_model.encoded == 4
+
+
+def test_patches_and_hooks_change_the_key(cache):
+    clip = make_clip()
+    clip.encode_from_tokens(tokens(1, 2))
+    lora = clip.clone()
+    lora.add_patches({"linear.weight": ("diff", (torch.ones(4, 1),))})
+    out = lora.encode_from_tokens(tokens(1, 2))
+    assert clip.cond_stage_model.encoded == 2
+    assert torch.equal(out, lora.encode_from_tokens(tokens(1, 2)))
+    assert clip.cond_stage_model.encoded == 2
+
+    lora.patcher.object_patches["linear"] = torch.nn.Identity()
+    assert cache.cache_key(lora, tokens(1, 2), False) is None
+
+
+def test_entries_are_dropped_beyond_max_size(cache):
+    cache.max_size = 3 * (4 * 4 * 3 + 4 * 4 + 3 * 4)
+    clip = make_clip()
+    for i in range(5):
+        clip.encode_from_tokens(tokens(i, i, i))
+    assert len(cache.entries) == 3 and cache.size <= cache.max_size
+    clip.encode_from_tokens(tokens(0, 0, 0))
+    assert clip.cond_stage_model.encoded == 6
+
+
+def test_model_options_and_clip_options(cache):
+    clip = make_clip()
+    clip.encode_from_tokens(tokens(1, 2))
+    # Options set on the encoder before are reset on a hit like when encoding.
+    clip.cond_stage_model.set_clip_options({"layer": 3})
+    clip.encode_from_tokens(tokens(1, 2))
+    assert clip.cond_stage_model.encoded == 1 and clip.cond_stage_model.layer is None
+
+    options = clip.clone()
+    options.patcher.model_options["custom_encoder_option"] = True
+    assert cache.cache_key(options, tokens(1, 2), False) is None
+    options.encode_from_tokens(tokens(1, 2))
+    assert clip.cond_stage_model.encoded == 2
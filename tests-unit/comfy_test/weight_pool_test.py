@@ -0,0 +1,96 @@
+import gc
+import os
+
+import pytest
+import torch
+
+from comfy.cli_args import args
+args.cpu = True
+
+import comfy.model_patcher  # noqa: E402
+from comfy.weight_pool import WeightPool  # noqa: E402
+
+
+class Loader:
+    def __init__(self):
+        self.loads = 0
+
+    def __call__(self):
+        self.loads += 1
+        model = comfy.model_patcher.ModelPatcher(torch.nn.Linear(16, 16), torch.device("cpu"), torch.device("cpu"))
+        return (model, None)
+
+
+@pytest.fixture(autouse=True)
+def enable_weight_pool(monkeypatch):
+    monkeypatch.setattr(args, "weight_pool", True)
+
+
+@pytest.fixture
+def model_file(tmp_path):
+    path = str(tmp_path / "model.safetensors")
+    with open(path, "wb") as f:
+        f.write(b"weights")
+    return path
+
+
+def test_loads_share_the_weights(model_file):
+    pool = WeightPool()
+    loader = Loader()
+    a, _ = pool.load(model_file, None, (True, False), loader)
+    b, _ = pool.load(model_file, None, (True, False), loader)
+    assert loader.loads == 1
+    assert a is not b
+    assert a.model is b.model
+    assert a.is_clone(b)
+    assert pool.stats()["bytes_saved"] == b.model_size() > 0
+
+    # Patches only go to the clone they are added to.
+    b.add_patches({"weight": (torch.zeros(16, 16),)})
+    assert len(a.patches) == 0
+
+
+def test_entries_die_with_the_last_clone(model_file):
+    pool = WeightPool()
+    loader = Loader()
+    a, _ = pool.load(model_file, None, (True, False), loader)
+    b = a.clone()
+    del a
+    gc.collect()
+    pool.load(model_file, None, (True, False), loader)
+    assert loader.loads == 1
+
+    del b
+    gc.collect()
+    assert pool.stats()["models"] == []
+    pool.load(model_file, None, (True, False), loader)
+    assert loader.loads == 2
+
+
+def test_file_changes_options_and_outputs_reload(model_file):
+    pool = WeightPool()
+    loader = Loader()
+    a, _ = pool.load(model_file, None, (True, False), loader)
+    pool.load(model_file, ("dtype", "fp8"), (True, False), loader)
+    assert loader.loads == 2
+
+    # The second output was never requested so it isn't known to be None.
+    b, _ = pool.load(model_file, None, (True, True), loader)
+    assert loader.loads == 3
+    pool.load(model_file, None, (True, True), loader)
+    pool.load(model_file, None, (True, False), loader)
+    assert loader.loads == 3
+
+    os.utime(model_file, (1, 1))
+    pool.load(model_file, None, (True, True), loader)
+    assert loader.loads == 4
+
+
+def test_disabled_by_default(model_file, monkeypatch):
+    monkeypatch.setattr(args, "weight_pool", False)
+    pool = WeightPool()
+    loader = Loader()
+    a, _ = pool.load(model_file, None, (True, False), loader)
+    b, _ = pool.load(model_file, None, (True, False), loader)
+    assert loader.loads == 2
+    assert a.model is not b.model
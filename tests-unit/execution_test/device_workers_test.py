@@ -0,0 +1,137 @@
+from comfy.cli_args import args
+args.cpu = True
+
+from comfy_execution.device_workers import DeviceScheduler, DeviceWorker, prompt_model_files  # noqa: E402
+from execution import PromptQueue  # noqa: E402
+
+
+class FakeServer:
+    def queue_updated(self):
+        pass
+
+
+class FakeModel:
+    pass
+
+
+class FakeDevices:
+    """Stands in for model_management.loaded_models_on_device with fake devices."""
+    def __init__(self):
+        self.loaded = {}
+
+    def __call__(self, device):
+        return list(self.loaded.get(device, []))
+
+
+def make_item(number, *model_files):
+    prompt = {str(i): {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": f}} for i, f in enumerate(model_files)}
+    prompt["sampler"] = {"class_type": "KSampler", "inputs": {"seed": number, "sampler_name": "euler"}}
+    return (number, "prompt_{}".format(number), prompt, {}, [], {})
+
+
+def make_scheduler(devices, count=2):
+    return DeviceScheduler([DeviceWorker("gpu{}".format(i), loaded_models=devices) for i in range(count)])
+
+
+def run_on(scheduler, worker, devices, item, model):
+    devices.loaded.setdefault(worker.device, []).append(model)
+    scheduler.task_done(worker, item)
+
+
+def test_prompt_model_files():
+    item = make_item(0, "sd15.safetensors", "vae.pt")
+    assert prompt_model_files(item[2]) == frozenset(["sd15.safetensors", "vae.pt"])
+
+
+def test_affinity_follows_loaded_models():
+    devices = FakeDevices()
+    scheduler = make_scheduler(devices)
+    worker = scheduler.workers[0]
+    model = FakeModel()
+    run_on(scheduler, worker, devices, make_item(0, "a.safetensors"), model)
+    assert worker.affinity(["a.safetensors"]) == 1
+    assert worker.affinity(["b.safetensors"]) == 0
+    assert scheduler.workers[1].affinity(["a.safetensors"]) == 0
+
+    # Unloaded from the device.
+    devices.loaded[worker.device].remove(model)
+    assert worker.affinity(["a.safetensors"]) == 0
+
+
+def test_select_prefers_loaded_models():
+    devices = FakeDevices()
+    scheduler = make_scheduler(devices)
+    gpu0, gpu1 = scheduler.workers
+    run_on(scheduler, gpu0, devices, make_item(0, "a.safetensors"), FakeModel())
+    run_on(scheduler, gpu1, devices, make_item(1, "b.safetensors"), FakeModel())
+
+    queue = [make_item(2, "a.safetensors"), make_item(3, "b.safetensors")]
+    assert scheduler.select(gpu1, queue)[0] == 3
+    assert scheduler.select(gpu0, queue)[0] == 2
+    # Nothing loaded anywhere: the first item, the candidates come in the order they would run.
+    assert scheduler.select(gpu0, [make_item(5, "c.safetensors"), make_item(4, "d.safetensors")])[0] == 5
+
+
+def test_select_leaves_items_to_idle_workers():
+    devices = FakeDevices()
+    scheduler = make_scheduler(devices)
+    gpu0, gpu1 = scheduler.workers
+    run_on(scheduler, gpu1, devices, make_item(0, "b.safetensors"), FakeModel())
+
+    queue = [make_item(1, "b.safetensors")]
+    gpu1.idle = True
+    assert scheduler.select(gpu0, queue) is None
+    gpu1.idle = False
+    assert scheduler.select(gpu0, queue)[0] == 1
+
+
+def test_prompt_queue_hands_items_to_matching_worker():
+    devices = FakeDevices()
+    scheduler = make_scheduler(devices)
+    gpu0, gpu1 = scheduler.workers
+    run_on(scheduler, gpu1, devices, make_item(0, "b.safetensors"), FakeModel())
+
+    q = PromptQueue(FakeServer())
+    q.put(make_item(1, "b.safetensors"))
+    q.put(make_item(2, "a.safetensors"))
+    gpu1.idle = True
+    item, _ = scheduler.get(q, gpu0, timeout=0.1)
+    assert item[0] == 2
+    assert scheduler.get(q, gpu0, timeout=0.1) is None
+
+    item, _ = scheduler.get(q, gpu1, timeout=0.1)
+    assert item[0] == 1
+    assert q.get_tasks_remaining() == 2
+
+
+def test_single_worker_groups_prompts_by_model():
+    devices = FakeDevices()
+    worker = DeviceWorker("gpu0", loaded_models=devices)
+    scheduler = DeviceScheduler([worker], lookahead=8, fairness_window=2)
+    models = {"a.safetensors": FakeModel(), "b.safetensors": FakeModel()}
+
+    q = PromptQueue(FakeServer())
+    for i, f in enumerate(["a", "b", "a", "a", "a"]):
+        q.put(make_item(i, f + ".safetensors"))
+    order = []
+    while q.get_tasks_remaining() > 0:
+        item, i = scheduler.get(q, worker, timeout=0.1)
+        model_file = next(iter(prompt_model_files(item[2])))
+        devices.loaded[worker.device] = [models[model_file]]
+        scheduler.task_done(worker, item)
+        q.task_done(i, {}, None)
+        order.append(item[0])
+
+    # Prompt 1 is passed over by at most 2 prompts using the loaded model.
+    assert order == [0, 2, 3, 1, 4]
+    assert scheduler.stats() == {"prompts": 5, "reordered": 2, "swaps_avoided": 2, "model_loads": 3}
+
+
+def test_select_keeps_priority_classes():
+    devices = FakeDevices()
+    worker = DeviceWorker("gpu0", loaded_models=devices)
+    scheduler = DeviceScheduler([worker], lookahead=8, fairness_window=8)
+    run_on(scheduler, worker, devices, make_item(0, "a.safetensors"), FakeModel())
+    high = make_item(1, "b.safetensors")
+    high[3]["priority"] = "high"
+    assert scheduler.select(worker, [high, make_item(2, "a.safetensors")]) is high
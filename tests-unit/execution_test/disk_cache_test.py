@@ -0,0 +1,93 @@
+import asyncio
+from types import SimpleNamespace
+from typing import NamedTuple
+
+import torch
+
+from comfy.cli_args import args
+args.cpu = True
+
+from comfy_execution import caching  # noqa: E402
+from comfy_execution.caching import CacheKeySetID, LRUCache, RAMPressureCache  # noqa: E402
+from comfy_execution.disk_cache import DiskCache, signature_digest  # noqa: E402
+from comfy_execution.graph import DynamicPrompt  # noqa: E402
+
+
+class Entry(NamedTuple):
+    ui: dict
+    outputs: list
+
+
+def make_key(value):
+    return frozenset([(0, frozenset([(0, "KSampler"), (1, False), (2, ("seed", value))]))])
+
+
+def test_signature_digest_is_stable_and_rejects_nan():
+    assert signature_digest(make_key(1)) == signature_digest(make_key(1))
+    assert signature_digest(make_key(1)) != signature_digest(make_key(2))
+    assert signature_digest(make_key(float("NaN"))) is None
+    assert signature_digest(frozenset([(0, object())])) is None
+
+
+def test_roundtrip_and_warm_start(tmp_path):
+    latent = {"samples": torch.randn(1, 4, 8, 8)}
+    cond = [[torch.randn(1, 77, 16), {"pooled_output": torch.randn(1, 16)}]]
+    entry = ({"output": {"text": ["hi"]}}, [[latent], [cond]])
+
+    cache = DiskCache(str(tmp_path), 1024**3)
+    assert cache.store(make_key(1), entry)
+    assert make_key(1) in cache
+
+    restarted = DiskCache(str(tmp_path), 1024**3)
+    ui, outputs = restarted.load(make_key(1))
+    assert ui == {"output": {"text": ["hi"]}}
+    assert torch.equal(outputs[0][0]["samples"], latent["samples"])
+    assert torch.equal(outputs[1][0][0][0], cond[0][0])
+    assert torch.equal(outputs[1][0][0][1]["pooled_output"], cond[0][1]["pooled_output"])
+    assert restarted.load(make_key(2)) is None
+
+
+def test_evicted_entries_are_spilled(tmp_path, monkeypatch):
+    prompt = {str(i): {"class_type": "Test", "inputs": {}} for i in range(2)}
+    disk_cache = DiskCache(str(tmp_path), 1024**3)
+    cache = LRUCache(CacheKeySetID, max_size=1)
+    cache.set_disk_cache(disk_cache)
+    asyncio.run(cache.set_prompt(DynamicPrompt(prompt), prompt.keys(), None))
+    cache.set("0", (None, [[torch.ones(4)]]))
+    cache.set("1", (None, [[torch.zeros(4)]]))
+    key = cache.cache_key_set.get_data_key("0")
+    # Outputs are only written when they leave the memory cache.
+    assert disk_cache.stats()["entries"] == 0
+
+    asyncio.run(cache.set_prompt(cache.dynprompt, ["1"], None))
+    cache.clean_unused()
+    assert disk_cache.stats()["entries"] == 1 and len(cache.cache) == 1
+    assert torch.equal(disk_cache.load(key)[1][0][0], torch.ones(4))
+    # A second store of the same signature is a no-op.
+    assert not disk_cache.store(key, (None, [[torch.ones(4)]]))
+
+    ram_cache = RAMPressureCache(CacheKeySetID)
+    ram_cache.set_disk_cache(DiskCache(str(tmp_path / "ram"), 1024**3, entry_factory=Entry))
+    asyncio.run(ram_cache.set_prompt(DynamicPrompt(prompt), prompt.keys(), None))
+    ram_cache.set("0", Entry(None, [[torch.full((4,), 2.0)]]))
+    monkeypatch.setattr(caching.psutil, "virtual_memory", lambda: SimpleNamespace(available=0 if len(ram_cache.cache) > 0 else 1024**3))
+    ram_cache.poll(ram_headroom=0.5)
+    assert len(ram_cache.cache) == 0
+    assert torch.equal(ram_cache.get("0")[1][0][0], torch.full((4,), 2.0))
+
+
+def test_unpersistable_outputs_are_skipped(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024**3)
+    assert not cache.store(make_key(1), (None, [[object()]]))
+    assert not cache.store(make_key(float("NaN")), (None, [[torch.ones(1)]]))
+    assert cache.stats()["entries"] == 0
+
+
+def test_size_bounded_eviction(tmp_path):
+    tensor = torch.zeros(1024)
+    cache = DiskCache(str(tmp_path), 3 * (tensor.numel() * tensor.element_size()) + 1024)
+    for i in range(6):
+        cache.store(make_key(i), (None, [[tensor + i]]))
+    assert cache.stats()["bytes"] <= cache.max_bytes
+    assert cache.load(make_key(0)) is None
+    assert torch.equal(cache.load(make_key(5))[1][0][0], tensor + 5)
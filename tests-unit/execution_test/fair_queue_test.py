@@ -0,0 +1,95 @@
+import pytest
+
+from comfy.cli_args import args
+args.cpu = True
+
+from comfy_execution.fair_queue import PendingPrompts, parse_client_weights  # noqa: E402
+from execution import PromptQueue  # noqa: E402
+
+
+class FakeServer:
+    def __init__(self):
+        self.updates = 0
+
+    def queue_updated(self):
+        self.updates += 1
+
+
+def make_item(number, client_id, priority=None):
+    extra_data = {"client_id": client_id}
+    if priority is not None:
+        extra_data["priority"] = priority
+    return (number, "{}_{}".format(client_id, number), {}, extra_data, [], {})
+
+
+def run_all(queue):
+    out = []
+    while len(queue.queue) > 0:
+        item, i = queue.get()
+        queue.task_done(i, {}, None)
+        out.append(item[1])
+    return out
+
+
+def test_default_is_number_order_by_priority_class():
+    queue = PromptQueue(FakeServer())
+    for item in [make_item(0, "a"), make_item(1, "a", "low"), make_item(2, "b"), make_item(3, "b", "high"), make_item(-4, "c")]:
+        queue.put(item)
+    assert [x[1] for x in queue.get_current_queue_volatile()[1]] == ["b_3", "c_-4", "a_0", "b_2", "a_1"]
+    assert run_all(queue) == ["b_3", "c_-4", "a_0", "b_2", "a_1"]
+
+
+def test_fair_share_runs_clients_in_turns(monkeypatch):
+    monkeypatch.setattr(args, "fair_share_queue", True)
+    queue = PromptQueue(FakeServer())
+    queue.set_client_weight("b", 2)
+    for i in range(6):
+        queue.put(make_item(i, "a"))
+    for i in range(6, 10):
+        queue.put(make_item(i, "b"))
+    queue.put(make_item(10, "c"))
+    queue.put(make_item(11, "a", "high"))
+
+    expected = ["a_11", "b_6", "c_10", "b_7", "a_0", "b_8", "b_9", "a_1", "a_2", "a_3", "a_4", "a_5"]
+    assert [x[1] for x in queue.get_current_queue_volatile()[1]] == expected
+    assert run_all(queue) == expected
+
+
+def test_clients_dont_save_up_turns():
+    pending = PendingPrompts(fair_share=True)
+    for i in range(6):
+        pending.add(make_item(i, "a"))
+    for _ in range(3):
+        pending.take(pending.order(1)[0])
+    # b was idle while a ran, it gets one turn in two from now on and not the next three.
+    for i in range(10, 14):
+        pending.add(make_item(i, "b"))
+    assert [x[1] for x in pending.order()] == ["b_10", "a_3", "b_11", "a_4", "b_12", "a_5", "b_13"]
+
+
+def test_snapshot_is_shared_until_the_queue_changes():
+    server = FakeServer()
+    queue = PromptQueue(server)
+    queue.put(make_item(0, "a"))
+    queue.put(make_item(1, "a"))
+    snapshot = queue.get_snapshot()
+    assert queue.get_snapshot() is snapshot
+    assert [x[1] for x in snapshot.pending] == ["a_0", "a_1"]
+
+    item, i = queue.get()
+    updated = queue.get_snapshot()
+    assert updated.version > snapshot.version
+    assert updated.running == (item,) and [x[1] for x in updated.pending] == ["a_1"]
+    assert [x[1] for x in snapshot.pending] == ["a_0", "a_1"]
+
+    assert queue.delete_queue_item(lambda x: x[1] == "a_1")
+    assert not queue.delete_queue_item(lambda x: x[1] == "a_1")
+    assert queue.get_snapshot().pending == ()
+
+
+def test_parse_client_weights():
+    assert parse_client_weights(["api=2", "a=b=0.5"]) == {"api": 2.0, "a=b": 0.5}
+    with pytest.raises(ValueError):
+        parse_client_weights(["api"])
+    with pytest.raises(ValueError):
+        parse_client_weights(["api=0"])
@@ -0,0 +1,83 @@
+import dataclasses
+
+import torch
+
+from comfy.cli_args import args
+args.cpu = True
+
+from comfy_execution import fingerprint as fingerprint_module  # noqa: E402
+from comfy_execution.caching import Unhashable, to_hashable  # noqa: E402
+from comfy_execution.disk_cache import signature_digest  # noqa: E402
+
+
+@dataclasses.dataclass
+class Settings:
+    strength: float
+    mask: torch.Tensor
+
+
+class CustomHash:
+    def __init__(self, name):
+        self.name = name
+
+    def __comfy_hash__(self):
+        return {"name": self.name}
+
+
+class NotHashable:
+    pass
+
+
+def test_tensors_hash_by_content():
+    a = torch.arange(16, dtype=torch.float32)
+    assert to_hashable(a) == to_hashable(a.clone())
+    assert to_hashable(a) != to_hashable(a + 1)
+    assert to_hashable(a) != to_hashable(a.reshape(4, 4))
+    assert to_hashable(a) != to_hashable(a.half())
+    assert signature_digest(to_hashable([a])) is not None
+
+
+def test_in_place_modification_invalidates_memo():
+    a = torch.zeros(8)
+    before = to_hashable(a)
+    a[3] = 1.0
+    assert to_hashable(a) != before
+
+
+def test_inference_tensors():
+    with torch.inference_mode():
+        a = torch.ones(8)
+    assert to_hashable(a) == to_hashable(torch.ones(8))
+
+
+def test_sampled_hash_for_large_tensors(monkeypatch):
+    monkeypatch.setattr(fingerprint_module, "FINGERPRINT_FULL_HASH_MAX_BYTES", 1024)
+    a = torch.randn(4 * 1024 * 1024)
+    b = a.clone()
+    b[12345] += 1.0
+    assert to_hashable(a) == to_hashable(a.clone())
+    assert to_hashable(a) != to_hashable(b)
+
+
+def test_dataclasses_and_custom_objects():
+    mask = torch.ones(2, 2)
+    assert to_hashable(Settings(1.0, mask)) == to_hashable(Settings(1.0, mask.clone()))
+    assert to_hashable(Settings(1.0, mask)) != to_hashable(Settings(0.5, mask))
+    assert to_hashable(CustomHash("a")) == to_hashable(CustomHash("a"))
+    assert to_hashable(CustomHash("a")) != to_hashable(CustomHash("b"))
+    assert isinstance(to_hashable(NotHashable()), Unhashable)
+
+
+def test_register_fingerprinter(monkeypatch):
+    monkeypatch.setitem(fingerprint_module.FINGERPRINTERS, NotHashable, lambda obj: "constant")
+    assert to_hashable(NotHashable()) == to_hashable(NotHashable())
+
+
+def test_sampled_hash_sees_small_half_precision_changes(monkeypatch):
+    monkeypatch.setattr(fingerprint_module, "FINGERPRINT_FULL_HASH_MAX_BYTES", 1024)
+    a = torch.randn(4 * 1024 * 1024, generator=torch.Generator().manual_seed(0)).half()
+    b = a.clone()
+    # Byte 20000 is between the sampled chunks (every 32768 bytes) and flipping its lowest bit is lost in an fp16 row sum.
+    b.view(torch.int16)[10000] ^= 1
+    assert not torch.equal(a, b)
+    assert to_hashable(a) != to_hashable(b)
@@ -0,0 +1,37 @@
+from comfy.cli_args import args
+args.cpu = True
+
+import nodes  # noqa: E402
+from comfy_api.latest import io  # noqa: E402
+from comfy_execution.parallel import is_thread_safe  # noqa: E402
+
+
+class CustomSaveImage(nodes.SaveImage):
+    pass
+
+
+class ThreadSafeNode(io.ComfyNode):
+    @classmethod
+    def define_schema(cls):
+        return io.Schema(node_id="TestThreadSafeNode", inputs=[], outputs=[], thread_safe=True)
+
+    @classmethod
+    def execute(cls):
+        return io.NodeOutput()
+
+
+class ExtendedNode(ThreadSafeNode):
+    @classmethod
+    def define_schema(cls):
+        return io.Schema(node_id="TestExtendedNode", inputs=[], outputs=[])
+
+
+def test_v1_flag_is_not_inherited():
+    assert is_thread_safe(nodes.SaveImage) and is_thread_safe(nodes.PreviewImage)
+    assert not is_thread_safe(CustomSaveImage)
+    assert not is_thread_safe(nodes.LoraLoader) and not is_thread_safe(nodes.LoraLoaderModelOnly)
+
+
+def test_v3_flag_comes_from_the_schema_of_the_class():
+    assert is_thread_safe(ThreadSafeNode)
+    assert not is_thread_safe(ExtendedNode)
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from comfy.cli_args import args
+args.cpu = True
+
+import folder_paths  # noqa: E402
+from comfy_execution import prefetch  # noqa: E402
+from comfy_execution.prefetch import ModelPrefetcher  # noqa: E402
+from execution import PromptQueue  # noqa: E402
+
+
+class FakeServer:
+    def queue_updated(self):
+        pass
+
+
+@pytest.fixture
+def model_folders(tmp_path, monkeypatch):
+    folders = {}
+    for name in ("checkpoints", "loras"):
+        folders[name] = tmp_path / name
+        folders[name].mkdir()
+    monkeypatch.setattr(folder_paths, "folder_names_and_paths", {
+        "checkpoints": ([str(folders["checkpoints"])], folder_paths.supported_pt_extensions),
+        "loras": ([str(folders["loras"])], folder_paths.supported_pt_extensions),
+        "configs": ([str(tmp_path / "configs")], [".yaml"]),
+    })
+    monkeypatch.setattr(folder_paths, "filename_list_cache", {})
+    (folders["checkpoints"] / "model.safetensors").write_bytes(b"m" * 3000)
+    (folders["loras"] / "style.safetensors").write_bytes(b"l" * 1000)
+    (folders["loras"] / "other.safetensors").write_bytes(b"o" * 1000)
+    monkeypatch.setattr(prefetch, "PREFETCH_RAM_HEADROOM", 0)
+    return folders
+
+
+def make_item(number, ckpt_name, *lora_names):
+    prompt = {"1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": ckpt_name}}}
+    for i, lora_name in enumerate(lora_names):
+        prompt[str(i + 2)] = {"class_type": "LoraLoader", "inputs": {"lora_name": lora_name, "strength_model": 1.0, "model": ["1", 0]}}
+    return (number, "prompt_{}".format(number), prompt, {}, [], {})
+
+
+def test_prefetch_reads_the_model_files_once(model_folders):
+    prefetcher = ModelPrefetcher(ram_budget=10000)
+    items = [make_item(0, "model.safetensors", "style.safetensors", "missing.safetensors")]
+    assert prefetcher.prefetch(items) == [str(model_folders["checkpoints"] / "model.safetensors"), str(model_folders["loras"] / "style.safetensors")]
+    assert prefetcher.prefetch(items) == []
+    assert prefetcher.stats() == {"files": 2, "bytes": 4000}
+
+    # A modified file is read again.
+    (model_folders["loras"] / "style.safetensors").write_bytes(b"n" * 1500)
+    os.utime(model_folders["loras"] / "style.safetensors", ns=(0, 10 ** 18))
+    assert prefetcher.prefetch(items) == [str(model_folders["loras"] / "style.safetensors")]
+
+
+def test_prefetch_stays_within_the_budget(model_folders):
+    prefetcher = ModelPrefetcher(ram_budget=2500)
+    items = [make_item(0, "model.safetensors", "style.safetensors"), make_item(1, "model.safetensors", "other.safetensors")]
+    assert [os.path.basename(p) for p in prefetcher.prefetch(items)] == ["style.safetensors", "other.safetensors"]
+
+
+def test_queue_schedules_the_next_prompts(model_folders):
+    scheduled = []
+
+    class RecordingPrefetcher(ModelPrefetcher):
+        def schedule(self, items):
+            scheduled.append([item[1] for item in items])
+
+    q = PromptQueue(FakeServer())
+    q.prefetcher = RecordingPrefetcher(ram_budget=10000)
+    for i in range(4):
+        q.put(make_item(i, "model.safetensors"))
+    # Nothing runs yet, the worker is about to load the first prompt itself.
+    assert scheduled == []
+    q.get()
+    assert scheduled == [["prompt_1", "prompt_2"]]
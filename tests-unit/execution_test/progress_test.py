@@ -0,0 +1,30 @@
+import contextvars
+import threading
+
+from comfy.cli_args import args
+args.cpu = True
+
+from comfy_execution.graph import DynamicPrompt  # noqa: E402
+from comfy_execution.progress import get_progress_state, reset_progress_state  # noqa: E402
+from comfy_execution.utils import current_execution_server, get_execution_server  # noqa: E402
+
+
+def test_prompts_running_at_the_same_time_keep_their_registry():
+    started = threading.Barrier(2)
+    seen = {}
+
+    def run(prompt_id, server):
+        current_execution_server.set(server)
+        reset_progress_state(prompt_id, DynamicPrompt({}))
+        started.wait()
+        get_progress_state().start_progress(prompt_id + "-node")
+        started.wait()
+        seen[prompt_id] = (get_progress_state().prompt_id, list(get_progress_state().nodes), get_execution_server())
+
+    threads = [threading.Thread(target=contextvars.copy_context().run, args=(run, prompt_id, prompt_id + "-server")) for prompt_id in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert seen == {"a": ("a", ["a-node"], "a-server"), "b": ("b", ["b-node"], "b-server")}
+    assert get_execution_server() is None
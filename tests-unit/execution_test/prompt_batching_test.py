@@ -0,0 +1,147 @@
+import asyncio
+from types import SimpleNamespace
+
+import torch
+
+from comfy.cli_args import args
+args.cpu = True
+
+import comfy.samplers  # noqa: E402
+from comfy_execution import prompt_batching  # noqa: E402
+from comfy_execution.caching import CacheKeySetID, HierarchicalCache  # noqa: E402
+from comfy_execution.graph import DynamicPrompt  # noqa: E402
+from comfy_execution.progress import get_progress_state, reset_progress_state  # noqa: E402
+from execution import PromptQueue  # noqa: E402
+
+
+class FakeServer:
+    def queue_updated(self):
+        pass
+
+
+def txt2img(number, seed=0, text="a cat", steps=20, ckpt_name="model.safetensors", width=512):
+    prompt = {
+        "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": ckpt_name}},
+        "5": {"class_type": "EmptyLatentImage", "inputs": {"width": width, "height": 512, "batch_size": 1}},
+        "6": {"class_type": "CLIPTextEncode", "inputs": {"text": text, "clip": ["4", 1]}},
+        "7": {"class_type": "CLIPTextEncode", "inputs": {"text": "blurry", "clip": ["4", 1]}},
+        "3": {"class_type": "KSampler", "inputs": {"seed": seed, "steps": steps, "cfg": 8.0, "sampler_name": "euler", "scheduler": "normal", "denoise": 1.0,
+                                                   "model": ["4", 0], "positive": ["6", 0], "negative": ["7", 0], "latent_image": ["5", 0]}},
+        "8": {"class_type": "VAEDecode", "inputs": {"samples": ["3", 0], "vae": ["4", 2]}},
+        "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "user{}".format(number), "images": ["8", 0]}},
+    }
+    return (number, "prompt_{}".format(number), prompt, {"client_id": "client_{}".format(number)}, ["9"], {})
+
+
+def test_batch_signature_ignores_texts_and_seeds():
+    signature = prompt_batching.batch_signature(txt2img(0)[2], ["9"])
+    assert signature is not None
+    assert prompt_batching.batch_signature(txt2img(1, seed=5, text="a dog")[2], ["9"]) == signature
+    assert prompt_batching.batch_signature(txt2img(2, steps=30)[2], ["9"]) != signature
+    assert prompt_batching.batch_signature(txt2img(3, ckpt_name="other.safetensors")[2], ["9"]) != signature
+    assert prompt_batching.batch_signature(txt2img(4, width=768)[2], ["9"]) != signature
+    assert prompt_batching.batch_signature(txt2img(5)[2], ["8"]) != signature
+
+    prompt = txt2img(6)[2]
+    prompt["10"] = {"class_type": "NotANode", "inputs": {}}
+    assert prompt_batching.batch_signature(prompt, ["9"]) is None
+
+
+def test_get_matching_pops_compatible_prompts():
+    queue = PromptQueue(FakeServer())
+    for item in [txt2img(0), txt2img(1, seed=1), txt2img(2, steps=4), txt2img(3, text="x"), txt2img(4, seed=9)]:
+        queue.put(item)
+    item, _ = queue.get()
+    batch = queue.get_matching(prompt_batching.batch_matcher(item), 2)
+    assert [x[0][0] for x in batch] == [1, 3]
+    assert [x[0] for x in queue.queue] == [2, 4]
+    assert len(queue.currently_running) == 3
+    assert queue.get_matching(lambda x: False, 2) == []
+
+
+class FakeModel:
+    def __init__(self):
+        self.batch_sizes = []
+
+    def memory_required(self, input_shape, cond_shapes={}):
+        return 0
+
+    def apply_model(self, x, t, c_crossattn=None, transformer_options={}):
+        self.batch_sizes.append(x.shape[0])
+        assert len(transformer_options["cond_or_uncond"]) == x.shape[0]
+        return x * t.reshape(-1, 1) + c_crossattn.sum(dim=1, keepdim=True)
+
+
+class FakeExecutor:
+    """Samples steps times through the model call batcher like comfy.samplers does with the batcher of its thread."""
+    def __init__(self, model, steps, width=4):
+        self.model = model
+        self.steps = steps
+        self.width = width
+        self.outputs = []
+        self.progress_prompt_ids = []
+        self.success = True
+        self.status_messages = []
+        self.server = prompt_batching.PromptServerView(FakeServer())
+        self.caches = SimpleNamespace(outputs=HierarchicalCache(CacheKeySetID))
+        self.loads = 0
+
+    def add_message(self, event, data, broadcast):
+        self.status_messages.append((event, data))
+
+    def execute(self, prompt, prompt_id, extra_data, execute_outputs):
+        batcher = comfy.samplers._model_call_batcher.batcher
+        reset_progress_state(prompt_id, DynamicPrompt(prompt))
+        # The loader of the graph, the same node for every prompt of the batch.
+        loader = {"4": {"class_type": "CheckpointLoaderSimple", "inputs": {}}}
+        asyncio.run(self.caches.outputs.set_prompt(DynamicPrompt(loader), loader.keys(), None))
+        if self.caches.outputs.get("4") is None:
+            self.loads += 1
+            self.caches.outputs.set("4", (None, [[self.model]]))
+        x = torch.full((2, self.width), float(prompt["seed"]))
+        for step in range(self.steps):
+            t = torch.full((2,), float(step + 1))
+            c = {"c_crossattn": torch.ones(2, 3), "transformer_options": {"cond_or_uncond": [0, 1]}}
+            self.outputs.append(batcher.apply_model(self.model, x, t, c))
+            self.progress_prompt_ids.append(get_progress_state().prompt_id)
+
+
+def test_model_calls_of_a_batch_are_merged():
+    model = FakeModel()
+    executors = [FakeExecutor(model, 3), FakeExecutor(model, 3), FakeExecutor(model, 2), FakeExecutor(model, 2, width=8)]
+    items = [(i, "prompt_{}".format(i), {"seed": i}, {"client_id": "client_{}".format(i)}, [], {}) for i in range(len(executors))]
+    prompt_batching.execute_batch(executors, items)
+
+    # The first two steps of the three prompts with the same shapes ran together, then the last step of two of them.
+    assert sorted(model.batch_sizes) == [2, 2, 4, 6, 6]
+    for i, executor in enumerate(executors):
+        # Each prompt kept its own progress state while the others ran.
+        assert executor.progress_prompt_ids == ["prompt_{}".format(i)] * executor.steps
+        assert executor.server.last_prompt_id == "prompt_{}".format(i)
+        assert len(executor.outputs) == executor.steps
+        for step, output in enumerate(executor.outputs):
+            assert torch.equal(output, torch.full((2, executor.width), i * (step + 1) + 3.0))
+        assert executor.success
+    # The first prompt to run loaded the model for the others.
+    assert sum(executor.loads for executor in executors) == 1
+    assert all(executor.caches.outputs.shared_caches == [] for executor in executors)
+
+
+class FailingModel(FakeModel):
+    def apply_model(self, x, t, c_crossattn=None, transformer_options={}):
+        if x.shape[1] == 8:
+            raise RuntimeError("out of memory")
+        return super().apply_model(x, t, c_crossattn, transformer_options)
+
+
+def test_a_failed_prompt_only_fails_its_own_item():
+    model = FailingModel()
+    executors = [FakeExecutor(model, 2), FakeExecutor(model, 2, width=8), FakeExecutor(model, 2)]
+    items = [(i, "prompt_{}".format(i), {"seed": i}, {"client_id": "client_{}".format(i)}, [], {}) for i in range(len(executors))]
+    prompt_batching.execute_batch(executors, items)
+
+    assert [executor.success for executor in executors] == [True, False, True]
+    assert len(executors[0].outputs) == len(executors[2].outputs) == 2
+    event, data = executors[1].status_messages[-1]
+    assert event == "execution_error" and data["prompt_id"] == "prompt_1" and data["exception_message"] == "out of memory"
+    assert executors[1].history_result == {"outputs": {}, "meta": {}}
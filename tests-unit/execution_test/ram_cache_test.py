@@ -0,0 +1,71 @@
+import asyncio
+from types import SimpleNamespace
+from typing import NamedTuple
+
+import torch
+
+from comfy.cli_args import args
+args.cpu = True
+
+from comfy_execution import caching  # noqa: E402
+from comfy_execution.caching import CacheKeySetID, RAMPressureCache, estimate_memory_usage  # noqa: E402
+from comfy_execution.graph import DynamicPrompt  # noqa: E402
+
+
+class Entry(NamedTuple):
+    ui: dict
+    outputs: list
+
+
+class FakeModel:
+    def get_ram_usage(self):
+        return 1000
+
+
+def test_estimate_memory_usage_dedups_storage():
+    t = torch.zeros(256)
+    model = FakeModel()
+    usage = estimate_memory_usage([[t], [{"samples": t[:10]}], [[t, {"pooled_output": torch.zeros(16)}]], [model, model]])
+    assert usage == {"cpu": 256 * 4 + 16 * 4, "objects": 1000}
+
+
+def make_cache(node_count):
+    prompt = {str(i): {"class_type": "Test", "inputs": {}} for i in range(node_count)}
+    cache = RAMPressureCache(CacheKeySetID)
+    asyncio.run(cache.set_prompt(DynamicPrompt(prompt), prompt.keys(), None))
+    return cache
+
+
+def test_poll_evicts_largest_first(monkeypatch):
+    cache = make_cache(4)
+    sizes = {"0": 10, "1": 400, "2": 50, "3": 200}
+    for node_id, size in sizes.items():
+        cache.set(node_id, Entry(None, [[torch.zeros(size * 1024, dtype=torch.uint8)]]))
+
+    def virtual_memory():
+        held = sum(sum(u[2].values()) for u in cache.entry_usage.values())
+        return SimpleNamespace(available=(1000 * 1024 - held) * 1024**3 / (1000 * 1024))
+    monkeypatch.setattr(caching.psutil, "virtual_memory", virtual_memory)
+
+    # 340KB "available", evicting the 400KB entry gets us over the headroom.
+    cache.poll(ram_headroom=600 / 1000)
+    assert cache.get("1") is None
+    assert all(cache.get(node_id) is not None for node_id in ("0", "2", "3"))
+
+    usage = cache.memory_usage()
+    assert [n["node_id"] for n in usage["nodes"]] == ["3", "2", "0"]
+    assert usage["totals"]["cpu"] == 260 * 1024
+
+
+def test_older_generations_are_evicted_first(monkeypatch):
+    cache = make_cache(2)
+    cache.set("0", Entry(None, [[torch.zeros(100 * 1024, dtype=torch.uint8)]]))
+    cache.set("1", Entry(None, [[torch.zeros(100 * 1024, dtype=torch.uint8)]]))
+    # A new prompt only using node 1 makes node 0 older.
+    asyncio.run(cache.set_prompt(cache.dynprompt, ["1"], None))
+    cache.get("1")
+
+    monkeypatch.setattr(caching.psutil, "virtual_memory", lambda: SimpleNamespace(available=0 if "0" in [u[0] for u in cache.entry_usage.values()] else 1024**3))
+    cache.poll(ram_headroom=0.5)
+    assert cache.get("0") is None
+    assert cache.get("1") is not None
@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from comfy.cli_args import args
+args.cpu = True
+
+import nodes  # noqa: E402
+from comfy_execution.caching import CacheKeySetInputSignature, Unhashable  # noqa: E402
+from comfy_execution.graph import DynamicPrompt  # noqa: E402
+
+
+class SignatureTestNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {}}
+
+
+class SignatureTestNotIdempotent(SignatureTestNode):
+    NOT_IDEMPOTENT = True
+
+
+class FakeIsChangedCache:
+    def __init__(self, values=None):
+        self.values = values or {}
+
+    async def get(self, node_id):
+        return self.values.get(node_id, False)
+
+
+@pytest.fixture(autouse=True)
+def register_nodes(monkeypatch):
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "SignatureTestNode", SignatureTestNode)
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "SignatureTestNotIdempotent", SignatureTestNotIdempotent)
+
+
+def chain(length, value=0, class_type="SignatureTestNode"):
+    prompt = {"0": {"class_type": class_type, "inputs": {"value": value}}}
+    for i in range(1, length):
+        prompt[str(i)] = {"class_type": "SignatureTestNode", "inputs": {"a": [str(i - 1), 0], "b": [str(i - 1), 0]}}
+    return prompt
+
+
+def signatures(prompt, is_changed=None):
+    key_set = CacheKeySetInputSignature(DynamicPrompt(prompt), prompt.keys(), FakeIsChangedCache(is_changed))
+    asyncio.run(key_set.add_keys(prompt.keys()))
+    return key_set.keys
+
+
+def test_identical_graphs_have_identical_signatures():
+    first = signatures(chain(5))
+    second = signatures(chain(5))
+    assert first == second
+    assert len(set(first.values())) == 5
+
+
+def test_upstream_changes_propagate():
+    first = signatures(chain(5, value=1))
+    second = signatures(chain(5, value=2))
+    for node_id in first:
+        assert first[node_id] != second[node_id]
+
+
+def test_deep_graph_does_not_recurse():
+    keys = signatures(chain(5000))
+    assert len(keys) == 5000
+
+
+def test_nan_is_changed_is_never_reused():
+    first = signatures(chain(3), is_changed={"1": float("NaN")})
+    second = signatures(chain(3), is_changed={"1": float("NaN")})
+    assert first["0"] == second["0"]
+    for node_id in ("1", "2"):
+        assert isinstance(first[node_id], Unhashable)
+        assert first[node_id] != second[node_id]
+
+
+def test_not_idempotent_includes_node_id():
+    prompt = {
+        "1": {"class_type": "SignatureTestNotIdempotent", "inputs": {"value": 1}},
+        "2": {"class_type": "SignatureTestNotIdempotent", "inputs": {"value": 1}},
+        "3": {"class_type": "SignatureTestNode", "inputs": {"value": 1}},
+        "4": {"class_type": "SignatureTestNode", "inputs": {"value": 1}},
+    }
+    keys = signatures(prompt)
+    assert keys["1"] != keys["2"]
+    assert keys["3"] == keys["4"]
+
+
+def test_cycles_are_unhashable():
+    prompt = {
+        "1": {"class_type": "SignatureTestNode", "inputs": {"a": ["2", 0]}},
+        "2": {"class_type": "SignatureTestNode", "inputs": {"a": ["1", 0]}},
+    }
+    keys = signatures(prompt)
+    assert isinstance(keys["1"], Unhashable)
+    assert isinstance(keys["2"], Unhashable)
@@ -0,0 +1,85 @@
+"""
+Benchmark for saving IMAGE batches with SaveImage.
+
+Times SaveImage.save_images for batches of random 1024x1024 images with the prompt metadata of a
+workflow, against the previous implementation that converted, built the metadata of and compressed
+each image in turn on the node's thread.
+
+    python tests/benchmarks/image_save_benchmark.py [--batch-sizes 1 4 16 64] [--size 1024] [--workers 4]
+
+With --preview the PreviewImage compression level is used.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from comfy.cli_args import args
+args.cpu = True
+
+import numpy as np  # noqa: E402
+import torch  # noqa: E402
+from PIL import Image  # noqa: E402
+from PIL.PngImagePlugin import PngInfo  # noqa: E402
+
+import folder_paths  # noqa: E402
+import nodes  # noqa: E402
+
+
+def legacy_save_images(images, output_dir, filename_prefix, prompt, extra_pnginfo, compress_level):
+    # The previous SaveImage.save_images, kept here as a reference.
+    full_output_folder, filename, counter, subfolder, filename_prefix = folder_paths.get_save_image_path(filename_prefix, output_dir, images[0].shape[1], images[0].shape[0])
+    results = list()
+    for (batch_number, image) in enumerate(images):
+        i = 255. * image.cpu().numpy()
+        img = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
+        metadata = PngInfo()
+        metadata.add_text("prompt", json.dumps(prompt))
+        for x in extra_pnginfo:
+            metadata.add_text(x, json.dumps(extra_pnginfo[x]))
+        file = f"{filename}_{counter:05}_.png"
+        img.save(os.path.join(full_output_folder, file), pnginfo=metadata, compress_level=compress_level)
+        results.append(file)
+        counter += 1
+    return results
+
+
+def make_prompt(size=200):
+    prompt = {str(i): {"class_type": "KSampler", "inputs": {"seed": i, "steps": 20, "cfg": 7.0, "model": [str(i - 1), 0]}} for i in range(size)}
+    return prompt, {"workflow": {"nodes": list(prompt.values())}}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--workers", type=int, default=args.image_save_workers)
+    parser.add_argument("--preview", action="store_true")
+    options = parser.parse_args()
+    args.image_save_workers = options.workers
+
+    prompt, extra_pnginfo = make_prompt()
+    with tempfile.TemporaryDirectory() as output_dir:
+        folder_paths.get_output_directory = lambda: output_dir
+        node = nodes.SaveImage()
+        if options.preview:
+            node.compress_level = 1
+        print("{:>6} {:>12} {:>12} {:>8}".format("batch", "legacy (s)", "save (s)", "speedup"))  # noqa: T201
+        for batch_size in options.batch_sizes:
+            images = torch.rand(batch_size, options.size, options.size, 3)
+            start = time.perf_counter()
+            legacy_save_images(images, output_dir, "legacy", prompt, extra_pnginfo, node.compress_level)
+            legacy = time.perf_counter() - start
+
+            start = time.perf_counter()
+            node.save_images(images, "save", prompt=prompt, extra_pnginfo=extra_pnginfo)
+            elapsed = time.perf_counter() - start
+            print("{:>6} {:>12.3f} {:>12.3f} {:>7.2f}x".format(batch_size, legacy, elapsed, legacy / elapsed))  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark for merging stacks of LoRAs into the weights, comparing comfy.lora.calculate_weight (one
+matmul and one add per LoRA and key) with comfy.lora.LowRankDiffBatches (--batched-lora-merge: the
+LoRAs of a key concatenated along the rank and keys of the same shape multiplied in one bmm).
+
+The key sets are the linear layers of SDXL, Flux and Wan 14B transformer blocks. Full models take
+minutes on a CPU so only a few blocks are merged by default.
+
+    python tests/benchmarks/lora_merge_benchmark.py [--models sdxl flux wan] [--blocks 2] [--loras 5] [--rank 32]
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from comfy.cli_args import args
+args.cpu = True
+
+import comfy.lora  # noqa: E402
+from comfy.weight_adapter import LoRAAdapter  # noqa: E402
+
+# (out, in) of the linear layers of one transformer block.
+BLOCKS = {
+    "sdxl": [(1280, 1280)] * 4 + [(1280, 1280), (1280, 2048), (1280, 2048), (1280, 1280)] + [(10240, 1280), (1280, 5120), (1280, 1280), (1280, 1280)],
+    "flux": [(9216, 3072), (3072, 3072), (12288, 3072), (3072, 12288), (18432, 3072)] * 2,
+    "wan": [(5120, 5120)] * 8 + [(13824, 5120), (5120, 13824)],
+}
+
+
+def make_patches(shapes, loras, rank, dtype):
+    patches = {}
+    weights = {}
+    for i, shape in enumerate(shapes):
+        key = "blocks.{}.weight".format(i)
+        weights[key] = torch.randn(shape, dtype=dtype)
+        patches[key] = []
+        for j in range(loras):
+            lora = LoRAAdapter(set(), (torch.randn(shape[0], rank, dtype=dtype) / rank, torch.randn(rank, shape[1], dtype=dtype), float(rank), None, None, None))
+            patches[key].append((0.8, lora, 1.0, None, None))
+    return patches, weights
+
+
+def merge_reference(patches, weights):
+    for key, weight in weights.items():
+        comfy.lora.calculate_weight(patches[key], weight.to(torch.float32, copy=True), key)
+
+
+def merge_batched(patches, weights):
+    batches = comfy.lora.LowRankDiffBatches(patches, list(weights), {k: w.shape for k, w in weights.items()}, torch.device("cpu"))
+    for key, weight in weights.items():
+        weight.to(torch.float32, copy=True).add_(batches.pop(key))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", nargs="+", default=list(BLOCKS), choices=list(BLOCKS))
+    parser.add_argument("--blocks", type=int, default=2)
+    parser.add_argument("--loras", type=int, default=5)
+    parser.add_argument("--rank", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=2)
+    bench_args = parser.parse_args()
+
+    print("{:<6} {:>6} {:>10} {:>12} {:>12} {:>8}".format("model", "keys", "params", "reference", "batched", "speedup"))  # noqa: T201
+    for model in bench_args.models:
+        shapes = BLOCKS[model] * bench_args.blocks
+        patches, weights = make_patches(shapes, bench_args.loras, bench_args.rank, torch.float16)
+        times = []
+        for merge in (merge_reference, merge_batched):
+            merge(patches, weights)  # warmup
+            start = time.perf_counter()
+            for _ in range(bench_args.repeat):
+                merge(patches, weights)
+            times.append((time.perf_counter() - start) / bench_args.repeat)
+        params = sum(w.numel() for w in weights.values())
+        print("{:<6} {:>6} {:>9.0f}M {:>11.3f}s {:>11.3f}s {:>7.2f}x".format(model, len(shapes), params / 1e6, times[0], times[1], times[0] / times[1]))  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
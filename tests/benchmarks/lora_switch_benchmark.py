@@ -0,0 +1,102 @@
+"""
+Benchmark for switching between models that only differ by their LoRAs, comparing merging them into the
+weights (the default: every switch restores the original weights and merges the new LoRAs) with applying
+them in the forward of the layers (--runtime-lora: a switch only replaces the low rank weights).
+
+Each switch goes through comfy.model_management.load_models_gpu like sampling does, followed by one
+forward of all the layers to show the cost of the extra low rank term. The layers are those of Flux,
+SDXL or Wan transformer blocks, see lora_merge_benchmark.py.
+
+    python tests/benchmarks/lora_switch_benchmark.py [--model flux] [--blocks 1] [--loras 4] [--rank 32] [--switches 8]
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from comfy.cli_args import args
+args.cpu = True
+
+import comfy.model_management  # noqa: E402
+import comfy.model_patcher  # noqa: E402
+import comfy.ops  # noqa: E402
+from comfy.weight_adapter import LoRAAdapter  # noqa: E402
+from lora_merge_benchmark import BLOCKS  # noqa: E402
+
+
+def make_model(shapes, dtype):
+    layers = torch.nn.ModuleList()
+    for out_features, in_features in shapes:
+        layer = comfy.ops.manual_cast.Linear(in_features, out_features, bias=False, dtype=dtype)
+        torch.nn.init.normal_(layer.weight, std=in_features ** -0.5)
+        layers.append(layer)
+    return layers
+
+
+def make_lora_clones(base, loras, rank):
+    clones = []
+    for _ in range(loras):
+        clone = base.clone()
+        patches = {}
+        for i, layer in enumerate(base.model):
+            out_features, in_features = layer.weight.shape
+            patches["{}.weight".format(i)] = LoRAAdapter(set(), (torch.randn(out_features, rank) / rank, torch.randn(rank, in_features) / in_features, float(rank), None, None, None))
+        clone.add_patches(patches, 0.8)
+        clones.append(clone)
+    return clones
+
+
+@torch.no_grad()
+def forward(layers, tokens):
+    for layer in layers:
+        x = torch.randn(1, tokens, layer.in_features)
+        layer(x)
+
+
+def run(clones, switches, tokens):
+    switch_time = 0.0
+    forward_time = 0.0
+    for i in range(switches + 1):
+        start = time.perf_counter()
+        comfy.model_management.load_models_gpu([clones[i % len(clones)]])
+        loaded = time.perf_counter()
+        forward(clones[0].model, tokens)
+        if i > 0:  # the first load isn't a switch
+            switch_time += loaded - start
+            forward_time += time.perf_counter() - loaded
+    comfy.model_management.unload_all_models()
+    return switch_time / switches, forward_time / switches
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="flux", choices=list(BLOCKS))
+    parser.add_argument("--blocks", type=int, default=1)
+    parser.add_argument("--loras", type=int, default=4)
+    parser.add_argument("--rank", type=int, default=32)
+    parser.add_argument("--switches", type=int, default=8)
+    parser.add_argument("--tokens", type=int, default=256)
+    bench_args = parser.parse_args()
+
+    # Measure the merge itself, not reloading the merged weights from the cache.
+    comfy.model_patcher.merged_weight_cache = comfy.model_patcher.MergedWeightCache(0)
+    shapes = BLOCKS[bench_args.model] * bench_args.blocks
+    base = comfy.model_patcher.ModelPatcher(make_model(shapes, torch.float16), torch.device("cpu"), torch.device("cpu"))
+    clones = make_lora_clones(base, bench_args.loras, bench_args.rank)
+    print("{} layers, {:.0f}M parameters, {} LoRAs of rank {}".format(len(shapes), sum(w.numel() for w in base.model.parameters()) / 1e6, bench_args.loras, bench_args.rank))  # noqa: T201
+
+    print("{:<8} {:>12} {:>12}".format("mode", "switch", "forward"))  # noqa: T201
+    results = {}
+    for mode in ("merged", "runtime"):
+        args.runtime_lora = mode == "runtime"
+        results[mode] = run(clones, bench_args.switches, bench_args.tokens)
+        print("{:<8} {:>11.4f}s {:>11.4f}s".format(mode, *results[mode]))  # noqa: T201
+    print("switch speedup: {:.1f}x, forward overhead: {:+.1f}%".format(results["merged"][0] / results["runtime"][0], (results["runtime"][1] / results["merged"][1] - 1) * 100))  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark for CacheKeySetInputSignature on synthetic graphs.
+
+Builds layered graphs where every node links to a few nodes of the previous layer (similar to
+large workflows with many shared loaders/encoders) and times computing the signatures of every
+node, cold (new process state) and warm (resubmitting an identical graph).
+
+    python tests/benchmarks/signature_benchmark.py [--sizes 1000 5000] [--legacy]
+
+--legacy also times the previous ancestry walking implementation for comparison, it is
+quadratic so it is only run for graphs up to 1000 nodes.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from comfy.cli_args import args
+args.cpu = True
+
+import nodes  # noqa: E402
+from comfy_execution.caching import CacheKeySetInputSignature, to_hashable  # noqa: E402
+from comfy_execution.graph import DynamicPrompt  # noqa: E402
+from comfy_execution.graph_utils import is_link  # noqa: E402
+
+
+class BenchmarkNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {}}
+
+
+class FakeIsChangedCache:
+    async def get(self, node_id):
+        return False
+
+
+class LegacyInputSignature(CacheKeySetInputSignature):
+    # The full ancestry walk used before signatures were memoized, kept here as a reference.
+    async def get_node_signature(self, dynprompt, node_id):
+        signature = []
+        ancestors, order_mapping = self.get_ordered_ancestry(dynprompt, node_id)
+        signature.append(await self.get_legacy_immediate_signature(dynprompt, node_id, order_mapping))
+        for ancestor_id in ancestors:
+            signature.append(await self.get_legacy_immediate_signature(dynprompt, ancestor_id, order_mapping))
+        return to_hashable(signature)
+
+    async def get_legacy_immediate_signature(self, dynprompt, node_id, order_mapping):
+        node = dynprompt.get_node(node_id)
+        signature = [node["class_type"], await self.is_changed_cache.get(node_id)]
+        inputs = node["inputs"]
+        for key in sorted(inputs.keys()):
+            if is_link(inputs[key]):
+                (ancestor_id, ancestor_socket) = inputs[key]
+                signature.append((key, ("ANCESTOR", order_mapping[ancestor_id], ancestor_socket)))
+            else:
+                signature.append((key, inputs[key]))
+        return signature
+
+    def get_ordered_ancestry(self, dynprompt, node_id):
+        ancestors = []
+        order_mapping = {}
+        stack = [node_id]
+        while stack:
+            inputs = dynprompt.get_node(stack.pop())["inputs"]
+            for key in sorted(inputs.keys(), reverse=True):
+                if is_link(inputs[key]) and inputs[key][0] not in order_mapping:
+                    ancestors.append(inputs[key][0])
+                    order_mapping[inputs[key][0]] = len(ancestors) - 1
+                    stack.append(inputs[key][0])
+        return ancestors, order_mapping
+
+
+def make_graph(size, width=20, fan_in=3, seed=0):
+    rng = random.Random(seed)
+    prompt = {}
+    for i in range(size):
+        inputs = {"seed": i, "text": "node {}".format(i), "strength": 1.0}
+        layer_start = (i // width - 1) * width
+        if layer_start >= 0:
+            for j in range(fan_in):
+                inputs["input_{}".format(j)] = [str(layer_start + rng.randrange(width)), 0]
+        prompt[str(i)] = {"class_type": "BenchmarkNode", "inputs": inputs}
+    return prompt
+
+
+def time_signatures(key_class, prompt):
+    key_set = key_class(DynamicPrompt(prompt), prompt.keys(), FakeIsChangedCache())
+    start = time.perf_counter()
+    asyncio.run(key_set.add_keys(prompt.keys()))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000])
+    parser.add_argument("--legacy", action="store_true")
+    options = parser.parse_args()
+
+    nodes.NODE_CLASS_MAPPINGS["BenchmarkNode"] = BenchmarkNode
+    for size in options.sizes:
+        CacheKeySetInputSignature.signature_memo.clear()
+        cold = time_signatures(CacheKeySetInputSignature, make_graph(size))
+        warm = time_signatures(CacheKeySetInputSignature, make_graph(size))
+        line = "{:>6} nodes: cold {:8.3f}s  warm {:8.3f}s".format(size, cold, warm)
+        if options.legacy and size <= 1000:
+            line += "  legacy {:8.3f}s".format(time_signatures(LegacyInputSignature, make_graph(size)))
+        print(line)  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,8 @@ import torch
 from typing import Union, Dict
 import json
 import subprocess
+import os
+import tempfile
 import websocket #NOTE: websocket-client (https://github.com/websocket-client/websocket-client)
 import uuid
 import urllib.request
@@ -156,6 +158,8 @@ class TestExecution:
         { "extra_args" : ["--cache-lru", 0], "should_cache_results" : True },
         { "extra_args" : ["--cache-lru", 100], "should_cache_results" : True },
         { "extra_args" : ["--cache-none"], "should_cache_results" : False },
+        { "extra_args" : ["--cache-lru", 100], "should_cache_results" : True, "disk_cache" : True },
+        { "extra_args" : ["--cache-ram", 0.1], "should_cache_results" : True },
     ])
     def server(self, args_pytest, request):
         # Start server
@@ -166,8 +170,12 @@ class TestExecution:
             '--port', str(args_pytest["port"]),
             '--extra-model-paths-config', 'tests/execution/extra_model_paths.yaml',
             '--cpu',
+            # The history is persisted, each server starts with an empty one.
+            '--database-url', 'sqlite:///{}'.format(os.path.join(tempfile.mkdtemp(), 'comfyui.db')),
         ]
         pargs += [ str(param) for param in request.param["extra_args"] ]
+        if request.param.get("disk_cache", False):
+            pargs += [ '--cache-disk', tempfile.mkdtemp() ]
         print("Running server with args:", pargs)  # noqa: T201
         p = subprocess.Popen(pargs)
         yield request.param
@@ -0,0 +1,133 @@
+import pytest
+import time
+import torch
+import subprocess
+
+from pytest import fixture
+from comfy_execution.graph_utils import GraphBuilder
+from tests.execution.test_execution import ComfyClient, run_warmup
+
+
+@pytest.mark.execution
+class TestParallelNodes:
+    @fixture(scope="class", autouse=True, params=[0, 4])
+    def _server(self, args_pytest, request):
+        pargs = [
+            'python','main.py',
+            '--output-directory', args_pytest["output_dir"],
+            '--listen', args_pytest["listen"],
+            '--port', str(args_pytest["port"]),
+            '--extra-model-paths-config', 'tests/execution/extra_model_paths.yaml',
+            '--cpu',
+        ]
+        if request.param > 0:
+            pargs += ['--parallel-node-workers', str(request.param)]
+        # Running server with args: pargs
+        p = subprocess.Popen(pargs)
+        yield request.param
+        p.kill()
+        torch.cuda.empty_cache()
+
+    @fixture(scope="class", autouse=True)
+    def shared_client(self, args_pytest, _server):
+        client = ComfyClient()
+        n_tries = 5
+        for i in range(n_tries):
+            time.sleep(4)
+            try:
+                client.connect(listen=args_pytest["listen"], port=args_pytest["port"])
+            except ConnectionRefusedError:
+                # Retrying...
+                pass
+            else:
+                break
+        yield client
+        del client
+        torch.cuda.empty_cache()
+
+    @fixture
+    def client(self, shared_client, request):
+        shared_client.set_test_name(f"parallel_nodes[{request.node.name}]")
+        yield shared_client
+
+    @fixture
+    def builder(self, request):
+        yield GraphBuilder(prefix=request.node.name)
+
+    def test_independent_branches_overlap(self, client: ComfyClient, builder: GraphBuilder, _server, skip_timing_checks):
+        run_warmup(client)
+
+        g = builder
+        image = g.node("StubImage", content="BLACK", height=64, width=64, batch_size=1)
+        # Different durations so the identical nodes don't share a cache entry
+        sleeps = [g.node("TestThreadSafeSleep", value=image.out(0), seconds=0.4 + i * 0.01) for i in range(3)]
+        for sleep in sleeps:
+            g.node("PreviewImage", images=sleep.out(0))
+
+        start_time = time.time()
+        result = client.run(g)
+        elapsed_time = time.time() - start_time
+
+        assert all(result.did_run(sleep) for sleep in sleeps)
+        if not skip_timing_checks:
+            if _server > 0:
+                assert elapsed_time < 1.0, f"Parallel execution took {elapsed_time}s, expected < 1.0s"
+            else:
+                assert elapsed_time >= 1.2, f"Serial execution took {elapsed_time}s, expected >= 1.2s"
+
+    def test_overlaps_with_async_nodes(self, client: ComfyClient, builder: GraphBuilder, _server, skip_timing_checks):
+        run_warmup(client)
+
+        g = builder
+        image = g.node("StubImage", content="BLACK", height=64, width=64, batch_size=1)
+        thread_sleep = g.node("TestThreadSafeSleep", value=image.out(0), seconds=0.5)
+        async_sleep = g.node("TestSleep", value=image.out(0), seconds=0.5)
+        g.node("PreviewImage", images=thread_sleep.out(0))
+        g.node("PreviewImage", images=async_sleep.out(0))
+
+        start_time = time.time()
+        result = client.run(g)
+        elapsed_time = time.time() - start_time
+
+        assert result.did_run(thread_sleep) and result.did_run(async_sleep)
+        if not skip_timing_checks and _server > 0:
+            assert elapsed_time < 0.9, f"Parallel execution took {elapsed_time}s, expected < 0.9s"
+
+    def test_dependencies_are_respected(self, client: ComfyClient, builder: GraphBuilder):
+        g = builder
+        image1 = g.node("StubImage", content="BLACK", height=64, width=64, batch_size=1)
+        image2 = g.node("StubImage", content="WHITE", height=64, width=64, batch_size=1)
+        sleep1 = g.node("TestThreadSafeSleep", value=image1.out(0), seconds=0.2)
+        sleep2 = g.node("TestThreadSafeSleep", value=image2.out(0), seconds=0.1)
+        average = g.node("TestVariadicAverage", input1=sleep1.out(0), input2=sleep2.out(0))
+        chained = g.node("TestThreadSafeSleep", value=average.out(0), seconds=0.1)
+        output = g.node("SaveImage", images=chained.out(0))
+
+        result = client.run(g)
+
+        images = result.get_images(output)
+        assert len(images) == 1
+        assert abs(images[0].getpixel((0, 0))[0] - 127) <= 1, "Image should be grey"
+
+    def test_errors_are_reported(self, client: ComfyClient, builder: GraphBuilder):
+        g = builder
+        image = g.node("StubImage", content="BLACK", height=64, width=64, batch_size=1)
+        error_node = g.node("TestThreadSafeSleep", value=image.out(0), seconds=0.1, error=True)
+        g.node("PreviewImage", images=error_node.out(0))
+
+        try:
+            client.run(g)
+            assert False, "Should have raised an error"
+        except Exception as e:
+            assert 'prompt_id' in e.args[0], f"Did not get proper error message: {e}"
+            assert e.args[0]['node_id'] == error_node.id, "Error should be from the thread safe node"
+
+    def test_cached_on_rerun(self, client: ComfyClient, builder: GraphBuilder):
+        g = builder
+        image = g.node("StubImage", content="BLACK", height=64, width=64, batch_size=1)
+        sleep = g.node("TestThreadSafeSleep", value=image.out(0), seconds=0.1)
+        g.node("PreviewImage", images=sleep.out(0))
+
+        client.run(g)
+        result = client.run(g)
+        assert not result.did_run(sleep), "Thread safe node should be cached"